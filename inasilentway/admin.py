@@ -0,0 +1,50 @@
+"""
+Admin for inasilentway
+
+Only the hand maintained corrections and our suggested links are
+edited here, everything else comes from Discogs or Last.fm.
+"""
+from django.contrib import admin
+
+from inasilentway import fuzzy, models
+
+
+@admin.register(models.Correction)
+class CorrectionAdmin(admin.ModelAdmin):
+    list_display  = ['lastfm_name', 'discogs_name', 'kind', 'note']
+    list_filter   = ['kind']
+    search_fields = ['lastfm_name', 'discogs_name']
+
+
+@admin.register(models.Substitution)
+class SubstitutionAdmin(admin.ModelAdmin):
+    list_display  = ['original', 'substitute', 'kind']
+    list_filter   = ['kind']
+    search_fields = ['original', 'substitute']
+
+
+@admin.register(models.TrackFilter)
+class TrackFilterAdmin(admin.ModelAdmin):
+    list_display  = ['record_title', 'artist_name', 'method', 'criteria']
+    search_fields = ['record_title', 'artist_name']
+
+
+@admin.register(models.ArtistChoice)
+class ArtistChoiceAdmin(admin.ModelAdmin):
+    list_display  = ['record_title', 'artist_name']
+    search_fields = ['record_title', 'artist_name']
+
+
+@admin.register(models.LinkSuggestion)
+class LinkSuggestionAdmin(admin.ModelAdmin):
+    list_display  = [
+        'artist', 'title', 'album', 'isw_track', 'score', 'scrobbles'
+    ]
+    search_fields = ['artist', 'title', 'album']
+    raw_id_fields = ['isw_artist', 'isw_track']
+    actions       = ['accept']
+
+    def accept(self, request, queryset):
+        linked = fuzzy.accept(queryset, progress=lambda m: None)
+        self.message_user(request, 'Linked {} scrobbles'.format(linked))
+    accept.short_description = 'Link these scrobbles'
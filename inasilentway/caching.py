@@ -0,0 +1,148 @@
+"""
+Caching for the expensive computations behind our pages.
+
+Cached values live under a namespace whose generation counter is part
+of every key. The code that changes the underlying data bumps the
+counter, which invalidates everything cached in that namespace at
+once without having to know which keys exist.
+
+The counters are Generation rows, so a bump made by the job worker is
+seen by every web process even when the cache itself is per process.
+"""
+import datetime
+import functools
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db.models import F
+from django.utils.functional import cached_property
+
+# Changes when we load or relink scrobbles
+SCROBBLES = 'scrobbles'
+# Changes when we load records from Discogs
+COLLECTION = 'collection'
+# Changes when we edit the corrections we match scrobbles with
+CORRECTIONS = 'corrections'
+NAMESPACES  = [SCROBBLES, COLLECTION, CORRECTIONS]
+
+# Cached values are invalidated by generation, this just stops
+# abandoned generations hanging around forever
+TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _new_generation():
+    # Starting from the clock means a counter that has been deleted
+    # won't come back with a generation we have used before
+    return int(time.time() * 1000000)
+
+
+def generations(namespaces):
+    """
+    Return a dict of namespace -> current generation for NAMESPACES
+    """
+    # models.py bumps our generations, so we can't import it at the top
+    from inasilentway.models import Generation
+
+    found = dict(Generation.objects.filter(
+        namespace__in=namespaces
+    ).values_list('namespace', 'value'))
+    missing = [n for n in namespaces if n not in found]
+    if missing:
+        Generation.objects.bulk_create([
+            Generation(namespace=n, value=_new_generation()) for n in missing
+        ], ignore_conflicts=True)
+        found.update(Generation.objects.filter(
+            namespace__in=missing
+        ).values_list('namespace', 'value'))
+    return found
+
+
+def generation(namespace):
+    """
+    Return the current generation of NAMESPACE
+    """
+    return generations([namespace])[namespace]
+
+
+def bump(*namespaces):
+    """
+    Invalidate everything cached under NAMESPACES
+    """
+    from inasilentway.models import Generation
+
+    for namespace in namespaces:
+        updated = Generation.objects.filter(namespace=namespace).update(
+            value=F('value') + 1
+        )
+        if not updated:
+            # A new counter starts from the clock, past anything we used
+            generation(namespace)
+
+
+def make_key(namespaces, *parts):
+    """
+    Return a cache key for PARTS that changes whenever any of
+    NAMESPACES is bumped.
+    """
+    current = generations(namespaces)
+    prefix  = ':'.join('{}{}'.format(n, current[n]) for n in namespaces)
+    digest  = hashlib.md5(repr(parts).encode('utf8')).hexdigest()
+    return 'cached:{}:{}'.format(prefix, digest)
+
+
+def get_or_set(namespaces, parts, func):
+    """
+    Return the cached result of calling FUNC, keyed on PARTS in
+    NAMESPACES, calling it if we don't have one.
+    """
+    key = make_key(namespaces, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = func()
+        cache.set(key, value, TIMEOUT)
+    return value
+
+
+def cached(*namespaces):
+    """
+    Decorate a view method so that its result is cached until one of
+    NAMESPACES is bumped.
+
+    The key includes the view class, the method, its arguments, the
+    view's URL kwargs and today's date (for the "this month" style
+    methods).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            parts = (
+                type(self).__module__, type(self).__name__, method.__name__,
+                args, sorted(kwargs.items()),
+                sorted(getattr(self, 'kwargs', {}).items()),
+                datetime.date.today().isoformat()
+            )
+            return get_or_set(
+                namespaces, parts, lambda: method(self, *args, **kwargs)
+            )
+        return wrapper
+    return decorator
+
+
+class CachedCountPaginator(Paginator):
+    """
+    A Paginator that caches the count of its queryset in the
+    collection and scrobble namespaces.
+    """
+    @cached_property
+    def count(self):
+        def count():
+            return Paginator.count.func(self)
+
+        try:
+            sql = str(self.object_list.query)
+        except (AttributeError, EmptyResultSet):
+            return count()
+        return get_or_set([COLLECTION, SCROBBLES], ('count', sql), count)
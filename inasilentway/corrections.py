@@ -0,0 +1,95 @@
+"""
+The hand maintained corrections we use to match scrobbles to our
+collection and to scrobble records to Last.fm.
+
+They live in the database so that they can be edited in the admin.
+Each process compiles them into dictionaries once, and recompiles
+them when the corrections generation changes, so edits take effect
+without a restart and lookups stay dictionary lookups.
+
+The generation is a Generation row that models.py bumps whenever a
+correction is saved or deleted, in the same transaction. Every web
+and worker process compares against the database, so they all see an
+edit as soon as it is committed.
+"""
+import collections
+import json
+
+from inasilentway import caching, utils
+from inasilentway.models import (
+    ArtistChoice, Correction, Substitution, TrackFilter
+)
+
+
+class Lookups(object):
+    """
+    The corrections compiled into dictionaries:
+
+        corrections    {'album': {lastfm key: discogs key},
+                        'artist': {lastfm key: [discogs key, ...]}}
+        substitutions  {'album'|'artist'|'title': {original: substitute}}
+        track_filters  {(record title, artist name): [(method, criteria)]}
+        artist_choices {record title: artist name}
+    """
+
+    def __init__(self, generation=None):
+        self.generation = generation
+
+        self.substitutions = {kind: {} for kind, _ in Substitution.KINDS}
+        for sub in Substitution.objects.order_by('id'):
+            self.substitutions[sub.kind][sub.original] = sub.substitute
+
+        albums  = {}
+        artists = collections.defaultdict(list)
+        for correction in Correction.objects.order_by('id'):
+            if correction.kind == Correction.ALBUM:
+                albums[utils.match_key(correction.lastfm_name)] = (
+                    utils.match_key(correction.discogs_name)
+                )
+            else:
+                lastfm_key   = utils.artist_key(correction.lastfm_name)
+                alternatives = artists[lastfm_key]
+                discogs_key = utils.artist_key(correction.discogs_name)
+                if discogs_key not in alternatives:
+                    alternatives.append(discogs_key)
+
+        # Scrobbles of things we substituted come back with the substitute
+        album_subs  = self.substitutions[Substitution.ALBUM]
+        artist_subs = self.substitutions[Substitution.ARTIST]
+        for original, substitute in album_subs.items():
+            albums.setdefault(
+                utils.match_key(substitute), utils.match_key(original)
+            )
+        for original, substitute in artist_subs.items():
+            alternatives = artists[utils.artist_key(substitute)]
+            if utils.artist_key(original) not in alternatives:
+                alternatives.append(utils.artist_key(original))
+
+        self.corrections = {'album': albums, 'artist': dict(artists)}
+
+        self.track_filters = collections.defaultdict(list)
+        for track_filter in TrackFilter.objects.order_by('id'):
+            self.track_filters[
+                (track_filter.record_title, track_filter.artist_name)
+            ].append((track_filter.method, json.loads(track_filter.criteria)))
+        self.track_filters = dict(self.track_filters)
+
+        self.artist_choices = dict(
+            ArtistChoice.objects.values_list('record_title', 'artist_name')
+        )
+
+
+_lookups = None
+
+
+def get_lookups():
+    """
+    Return the compiled Lookups, recompiling them if the corrections
+    have changed since we last did.
+    """
+    global _lookups
+
+    generation = caching.generation(caching.CORRECTIONS)
+    if _lookups is None or _lookups.generation != generation:
+        _lookups = Lookups(generation)
+    return _lookups
@@ -1,106 +1,372 @@
 """
 Interacting with Discogs from Inasilentway
 """
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import collections
+import hashlib
 import json
+import os
+import re
+import tempfile
+import threading
 import time
 
 from dateutil import parser
 import discogs_client
+from discogs_client.fetchers import UserTokenRequestsFetcher
 from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 import requests
 
-from inasilentway import models
+from inasilentway import caching, models, rollups, search, utils
+
+
+class RateLimiter(object):
+    """
+    A token bucket shared by every thread talking to Discogs.
+
+    Discogs allows 60 authenticated requests per minute in a moving
+    window, and reports what is left of it in the
+    X-Discogs-Ratelimit-Remaining header of every response. We refill
+    the bucket at the advertised rate and pull it back down to whatever
+    the server says remains, so concurrent workers never outrun it.
+    """
+
+    def __init__(self, rate=60, per=60.0):
+        self.capacity = rate
+        self.tokens   = float(rate)
+        self.per      = per
+        self.updated  = time.monotonic()
+        self.lock     = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity,
+            self.tokens + (now - self.updated) * self.capacity / self.per
+        )
+        self.updated = now
+
+    def acquire(self):
+        """
+        Block until we are allowed to make a request
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.per / self.capacity
+            time.sleep(wait)
+
+    def update(self, headers):
+        """
+        Given the headers of a Discogs response, bring the bucket into
+        line with the server's view of our rate limit.
+        """
+        with self.lock:
+            limit = headers.get('X-Discogs-Ratelimit')
+            if limit:
+                self.capacity = int(limit)
+
+            remaining = headers.get('X-Discogs-Ratelimit-Remaining')
+            if remaining is not None:
+                self._refill()
+                self.tokens = min(self.tokens, float(remaining))
+
+
+class ResponseCache(object):
+    """
+    An on-disk cache of raw Discogs API responses, keyed by the URL of
+    the resource.
+
+    Responses younger than TTL seconds are replayed from disk without
+    asking Discogs. Older ones are revalidated with a conditional
+    request, so a resource that hasn't changed costs a 304 rather than
+    the whole body.
+    """
+
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl       = ttl
+
+    def path(self, url):
+        digest = hashlib.sha1(url.encode('utf8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.json')
+
+    def get(self, url):
+        """
+        Return the cached entry for URL, or None
+        """
+        try:
+            with open(self.path(url), encoding='utf8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, entry):
+        """
+        Store ENTRY as the cached response for URL
+        """
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so other threads never read half a file
+        handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(handle, 'w', encoding='utf8') as fh:
+            json.dump(entry, fh)
+        os.replace(tmp, path)
+
+    def is_fresh(self, entry):
+        return time.time() - entry['fetched'] < self.ttl
+
+    def fetch(self, url, request):
+        """
+        Return the (content, status_code) of URL, calling REQUEST with
+        any conditional headers to get a requests Response if we can't
+        answer from the cache.
+        """
+        entry = self.get(url)
+        if entry is not None and self.is_fresh(entry):
+            return entry['content'].encode('utf8'), 200
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = request(headers)
+
+        if response.status_code == 304 and entry is not None:
+            entry['fetched'] = time.time()
+            self.put(url, entry)
+            return entry['content'].encode('utf8'), 200
+
+        if response.status_code == 200:
+            self.put(url, {
+                'url'          : url,
+                'content'      : response.content.decode('utf8'),
+                'etag'         : response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched'      : time.time(),
+            })
+        return response.content, response.status_code
+
+
+API_ROOT = 'https://api.discogs.com'
+
+# The resources worth caching. Collection pages change as we add
+# records, so we always ask for those.
+CACHEABLE = re.compile(
+    r'^https://api\.discogs\.com/(releases|artists|labels|masters)/\d+$'
+)
+
+
+def get_response_cache():
+    directory = getattr(settings, 'DISCOGS_CACHE_DIR', None)
+    if not directory:
+        return None
+    return ResponseCache(directory, settings.DISCOGS_CACHE_TTL)
+
+
+def request(method, url, params, data=None, headers=None):
+    """
+    Make a request to the Discogs API, waiting on our rate limiter,
+    and return (content, status_code).
+
+    GETs of single resources go through the response cache. PARAMS
+    (which carry our credentials) are not part of the cache key, so
+    the same release fetched with a user token or with our key and
+    secret is only downloaded once.
+    """
+    def send(extra_headers):
+        limiter.acquire()
+        response = requests.request(
+            method, url, params=params, data=data,
+            headers=dict(headers or {}, **extra_headers)
+        )
+        limiter.update(response.headers)
+        return response
+
+    cache = get_response_cache()
+    if cache is None or method != 'GET' or data or not CACHEABLE.match(url):
+        response = send({})
+        return response.content, response.status_code
+    return cache.fetch(url, send)
+
+
+class RateLimitedFetcher(UserTokenRequestsFetcher):
+    """
+    A discogs_client fetcher that goes through request(), so it waits
+    on our RateLimiter and uses the response cache.
+    """
+
+    def fetch(self, client, method, url, data=None, headers=None, json=True):
+        return request(
+            method, url, {'token': self.user_token},
+            data=data, headers=headers
+        )
+
+
+limiter = RateLimiter()
 
 try:
     api = discogs_client.Client(
         'Inasilentway/2.0',
         user_token=settings.DISCOGS_USER_TOKEN
     )
+    api._fetcher = RateLimitedFetcher(settings.DISCOGS_USER_TOKEN)
 
 except AttributeError:
     print('No Discogs user token found')
     api = None
 
-def save_artist_from_discogs_data(artist_data):
+LOADER_WORKERS = 4
+# How many releases each loader worker may have fetched or in flight
+# before we stop submitting more and save what has arrived
+RELEASES_PER_WORKER = 2
+
+# Fields we read when saving, which discogs_client would otherwise
+# re-fetch the whole resource to look for if they are missing
+RELEASE_FIELDS = [
+    'title', 'year', 'images', 'country', 'notes', 'formats', 'uri',
+    'status', 'genres', 'styles', 'labels', 'tracklist', 'artists'
+]
+ARTIST_FIELDS = ['name', 'uri', 'profile', 'urls', 'images']
+
+
+def artist_images(artist_data):
     """
-    Given a discogs artist instance, save it to our database
-    if it doesn't exist
+    Given a discogs artist instance, return a list of its image dicts,
+    or None if Discogs won't give them to us.
     """
-    art, _ = models.Artist.objects.get_or_create(discogs_id=artist_data.id)
-
-    art.name    = artist_data.name
     try:
-        art.url     = artist_data.url
+        images = artist_data.images
     except discogs_client.exceptions.HTTPError:
-        pass  # 404 on the artist images happens sometimes apparently?
-    try:
-        art.profile = artist_data.profile
-    except discogs_client.exceptions.HTTPError:
-        pass  # 404 on the artist images happens sometimes apparently?
-    try:
-        art.urls    = artist_data.urls
-    except discogs_client.exceptions.HTTPError:
-        pass  # 404 on the artist images happens sometimes apparently?
+        return None  # 404 on the artist images happens sometimes apparently?
+    if images is None:
+        return []
+    if not isinstance(images, list):
+        images = json.loads(images)
+    return images
 
-    art.save()
 
-    try:
-        if not isinstance(artist_data.images, list):
-            if artist_data.images is None:
-                images = []
-            else:
-                images  = json.loads(artist_data.images)
-        else:
-            images = artist_data.images
-
-        art.artistimage_set.all().delete()
-        for image in images:
-            del image['uri150']
-            image['artist'] = art
-            image['category'] = image['type']
-            del image['type']
-            image = models.ArtistImage.objects.create(**image)
-            image.save()
+def save_artists_from_discogs_data(artists_data):
+    """
+    Given a list of discogs artist instances, save them to our database,
+    creating those that don't exist, and return a list of Artists in the
+    same order.
 
-    except discogs_client.exceptions.HTTPError:
-        pass  # 404 on the artist images happens sometimes apparently?
+    This is a fixed number of queries however many artists and images
+    there are.
+    """
+    by_id = collections.OrderedDict(
+        (str(artist_data.id), artist_data) for artist_data in artists_data
+    )
+    models.Artist.objects.bulk_create(
+        [models.Artist(discogs_id=discogs_id) for discogs_id in by_id],
+        ignore_conflicts=True
+    )
+    artists = {
+        art.discogs_id: art for art in
+        models.Artist.objects.filter(discogs_id__in=list(by_id))
+    }
+
+    refreshed = []
+    images    = []
+    for discogs_id, artist_data in by_id.items():
+        art = artists[discogs_id]
+        art.name = artist_data.name
+        for field in ['url', 'profile', 'urls']:
+            try:
+                setattr(art, field, getattr(artist_data, field))
+            except discogs_client.exceptions.HTTPError:
+                pass  # 404 on the artist images happens sometimes apparently?
+
+        image_data = artist_images(artist_data)
+        if image_data is None:
+            continue
+        refreshed.append(art)
+        for image in image_data:
+            images.append(models.ArtistImage(
+                artist=art,
+                uri=image.get('uri'),
+                height=image.get('height'),
+                width=image.get('width'),
+                resource_url=image.get('resource_url'),
+                category=image.get('type')
+            ))
+
+    for art in artists.values():
+        art.set_match_keys()
+    models.Artist.objects.bulk_update(
+        list(artists.values()), ['name', 'name_key', 'url', 'profile', 'urls']
+    )
+    # Images don't have an ID so replace them all
+    models.ArtistImage.objects.filter(artist__in=refreshed).delete()
+    models.ArtistImage.objects.bulk_create(images)
 
-    return art
+    return [artists[str(artist_data.id)] for artist_data in artists_data]
+
+
+def save_artist_from_discogs_data(artist_data):
+    """
+    Given a discogs artist instance, save it to our database
+    if it doesn't exist
+    """
+    return save_artists_from_discogs_data([artist_data])[0]
 
 
 def save_label_from_discogs_data(label_data):
     """
     Given a discogs label instance, save it to our database if it doesn't exist
     """
-    label, _ = models.Label.objects.get_or_create(
-        discogs_id=label_data.id)
-    label.name = label_data.name
-    label.save()
+    label = utils.get_or_insert(models.Label, discogs_id=label_data.id)
+    if label.name != label_data.name:
+        label.name = label_data.name
+        label.save()
     return label
 
 
-def save_record_from_discogs_data(record, added=None):
+def get_tags(model, names):
     """
-    Given a Discogs record instance, save it to our database
+    Given a tag MODEL (Genre or Style) and some NAMES, return a list of
+    instances with those names, creating any we don't have.
     """
-    artists = [
-        save_artist_from_discogs_data(a) for a in record.artists
-    ]
+    names = list(collections.OrderedDict.fromkeys(names or []))
+    if not names:
+        return []
 
-    rec, created = models.Record.objects.get_or_create(discogs_id=record.id)
+    tags = {}
+
+    def fetch(names):
+        for tag in model.objects.filter(name__in=names).order_by('id'):
+            tags.setdefault(tag.name, tag)
+
+    fetch(names)
+    missing = [name for name in names if name not in tags]
+    if missing:
+        model.objects.bulk_create([model(name=name) for name in missing])
+        fetch(missing)
+    return [tags[name] for name in names]
+
+
+def save_record_from_discogs_data(record, added=None, thumb=None):
+    """
+    Given a Discogs record instance, save it to our database
 
-    for artist in artists:
-        rec.artist.add(artist)
+    If we have already fetched the THUMB url, don't fetch it again.
 
-    for genre in record.genres:
-        g, _ = models.Genre.objects.get_or_create(name=genre)
-        rec.genres.add(g)
+    Artists, tags, images and tracks are written in bulk and the Record
+    is saved once, so the number of queries doesn't grow with the size
+    of the release.
+    """
+    artists = save_artists_from_discogs_data(record.artists)
 
-    if record.styles:
-        for style in record.styles:
-            s, _ = models.Style.objects.get_or_create(name=style)
-            rec.styles.add(s)
+    rec = utils.get_or_insert(models.Record, discogs_id=record.id)
 
     rec.label   = save_label_from_discogs_data(record.labels[0])
     rec.title   = record.title
@@ -116,74 +382,257 @@ def save_record_from_discogs_data(record, added=None):
     rec.status     = record.status
 
     if added:
-        rec.date_added = added
+        rec.added = added
+
+    if thumb is None:
+        # Artwork requires secret/key urls not supported by this client so
+        # fetch them ourselves
+        thumb = with_retries(fetch_thumb, rec.discogs_id)
+    rec.thumb = thumb
 
     rec.save()
 
-    # Artwork requires secret/key urls not supported by this client so
-    # fetch them ourselves
-    save_thumb(rec)
+    rec.artist.add(*artists)
+    rec.genres.add(*get_tags(models.Genre, record.genres))
+    rec.styles.add(*get_tags(models.Style, record.styles))
 
     # Tracks don't have an ID so kill them all
     models.Track.objects.filter(record=rec).delete()
-    for track in record.tracklist:
+    tracks = [
         models.Track(
             record=rec,
             duration=track.duration,
             position=track.position,
             title=track.title
-        ).save()
+        )
+        for track in record.tracklist
+    ]
+    for track in tracks:
+        track.set_match_keys()
+    models.Track.objects.bulk_create(tracks)
 
+    search.index_record(rec)
     return rec
 
 
+def is_transient(error):
+    """
+    Is ERROR worth retrying?
+    (Rate limiting, server errors and connection problems are.)
+    """
+    if isinstance(error, discogs_client.exceptions.HTTPError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+def with_retries(func, *args):
+    """
+    Call FUNC with ARGS, retrying transient Discogs errors with a
+    bounded backoff.
+    """
+    return utils.retry(
+        lambda: func(*args),
+        (
+            discogs_client.exceptions.HTTPError,
+            requests.exceptions.ConnectionError
+        ),
+        attempts=6, delay=2,
+        giveup=lambda err: not is_transient(err)
+    )
+
+
+def fetch_release(record_data):
+    """
+    Given a Discogs API object representing a single item in a
+    collection, fetch everything we need to save it, so that
+    saving it makes no further HTTP requests.
+
+    Return a tuple of (release, thumb, added).
+
+    This is called from worker threads.
+    """
+    release = record_data.release
+    release.refresh()
+    for field in RELEASE_FIELDS:
+        release.data.setdefault(field, None)
+
+    for artist in release.artists:
+        artist.refresh()
+        for field in ARTIST_FIELDS:
+            artist.data.setdefault(field, None)
+
+    thumb = fetch_thumb(release.id)
+
+    added = record_data.data.get('date_added')
+    if added:
+        added = parser.parse(added).date()
+
+    return release, thumb, added
+
+
 def load_record(record_data):
     """
     Given a Discogs API object representing a single record, load
     that record into our database.
     """
-    try:
-        with transaction.atomic():
-            return save_record_from_discogs_data(record_data.release)
+    release, thumb, added = with_retries(fetch_release, record_data)
+    with transaction.atomic():
+        record = save_record_from_discogs_data(
+            release, added=added, thumb=thumb
+        )
+    caching.bump(caching.COLLECTION)
+    return record
 
-    except discogs_client.exceptions.HTTPError:
-        print('Discogs API rate limit exceeded, sleeping for 61s')
-        time.sleep(61)
-        # Unsure what this was here for, but it raises, so removing
-        # return load_record(record_data.release, added=parser.parse(record.data['date_added']))
-        return load_record(record_data)
-    except requests.exceptions.ConnectionError:
-        print('"Connection error", sleeping for 61s')
-        time.sleep(61)
-        return load_record(record_data)
+
+def remove_records(discogs_ids):
+    """
+    Given an iterable of Discogs IDs that are no longer in the
+    collection, remove their Records, unlinking any scrobbles.
+    """
+    records = models.Record.objects.filter(discogs_id__in=list(discogs_ids))
+    for record in records:
+        print('Removing {}'.format(record))
+    scrobbles = models.Scrobble.objects.filter(isw_album__in=records)
+    timestamps = list(scrobbles.values_list('timestamp', flat=True))
+    scrobbles.update(isw_album=None, isw_track=None)
+    deleted = records.delete()
+    rollups.refresh_days(
+        rollups.scrobble_day(t) for t in timestamps if t is not None
+    )
+    return deleted
 
 
-def load_collection():
+def load_collection(full=False, prune=False, workers=LOADER_WORKERS,
+                    progress=print):
     """
     Load the users entire collection
     into our local copy
+
+    The collection is read newest first by date_added. Unless FULL is
+    set we stop at the first release that is no newer than the last
+    sync, so a sync with nothing new costs one page of the collection.
+
+    If PRUNE is set we read every page of the collection (but none of
+    the releases we already have) and remove Records that are no
+    longer in it.
+
+    Releases are fetched concurrently by a pool of WORKERS threads that
+    share our rate limiter, and written to the database one at a time
+    from this thread as they arrive. Only a few releases per worker are
+    in flight at once, so we never hold much of the collection in
+    memory, and a crash loses little more than they were.
+
+    PROGRESS is called with a message as each release is saved.
     """
+    last_sync = None if full else models.CollectionSync.last_high_water_mark()
+    sync = models.CollectionSync.objects.create(high_water_mark=last_sync)
+    high_water_mark = sync.high_water_mark
+
     user = api.user(settings.DISCOGS_USER)
     records = user.collection_folders[0].releases
+    records.per_page = 100
+    records = records.sort('added', 'desc')
     print('{} records in collection'.format(user.num_collection))
-    for record in records:
-        if models.Record.objects.filter(discogs_id=record.release.id).exists():
-            if record.release.id != '21029362':
-                print('Skipping {} - already loaded'.format(record.release.title))
+
+    loaded = set(models.Record.objects.values_list('discogs_id', flat=True))
+    seen   = set()
+    failed = []
+
+    def save(done):
+        for future in done:
+            record = futures.pop(future)
+            try:
+                release, thumb, added = future.result()
+            except (
+                discogs_client.exceptions.HTTPError,
+                requests.exceptions.ConnectionError
+            ) as err:
+                print('Failed to load {}: {}'.format(
+                    record.release.id, repr(err)
+                ))
+                failed.append(record)
+                continue
+
+            with transaction.atomic():
+                instance = save_record_from_discogs_data(
+                    release, added=added, thumb=thumb
+                )
+            sync.added += 1
+            progress('Added {} ({} of {} so far)'.format(
+                instance, sync.added, submitted
+            ))
+
+    futures   = {}
+    submitted = 0
+    in_flight = workers * RELEASES_PER_WORKER
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for record in records:
+            discogs_id = str(record.release.id)
+            seen.add(discogs_id)
+
+            date_added = parser.parse(record.data['date_added'])
+            newest = sync.high_water_mark
+            if newest is None or date_added > newest:
+                sync.high_water_mark = date_added
+
+            if high_water_mark and date_added <= high_water_mark:
+                if not prune:
+                    print('Reached the last sync at {}'.format(
+                        high_water_mark
+                    ))
+                    break
                 continue
 
-        instance = load_record(record)
-        print('Added {}'.format(instance))
+            if discogs_id in loaded:
+                print('Skipping {} - already loaded'.format(
+                    record.release.title
+                ))
+                continue
+
+            if len(futures) >= in_flight:
+                save(wait(futures, return_when=FIRST_COMPLETED).done)
+
+            futures[pool.submit(with_retries, fetch_release, record)] = record
+            submitted += 1
+
+        while futures:
+            save(wait(futures, return_when=FIRST_COMPLETED).done)
+
+    if prune:
+        removed = loaded - seen
+        remove_records(removed)
+        sync.removed = len(removed)
+
+    if failed:
+        print('{} records failed to load'.format(len(failed)))
+    else:
+        # Only move the high water mark on if we got everything up to it
+        sync.finished = timezone.now()
+    sync.save()
+
+    caching.bump(caching.COLLECTION, caching.SCROBBLES)
+    return failed
+
+
+def fetch_thumb(discogs_id):
+    """
+    Given the Discogs ID of a release, return the url of its thumb
+    """
+    content, status_code = request(
+        'GET', '{}/releases/{}'.format(API_ROOT, discogs_id),
+        {'key': settings.DISCOGS_KEY, 'secret': settings.DISCOGS_SECRET}
+    )
+    if status_code != 200:
+        raise discogs_client.exceptions.HTTPError(
+            'Failed to fetch release {}'.format(discogs_id), status_code
+        )
+    return json.loads(content.decode('utf8'))['thumb']
 
 
 def save_thumb(record):
     """
     Given a Record instance, get it's thumb from upstream
     """
-    data = api.release(record.discogs_id)
-    url = f"https://api.discogs.com/releases/{record.discogs_id}?key={settings.DISCOGS_KEY}&secret={settings.DISCOGS_SECRET}"
-    response = requests.get(url)
-    data = response.json()
-    thumb_url = data['thumb']
-    record.thumb = thumb_url
+    record.thumb = with_retries(fetch_thumb, record.discogs_id)
     record.save()
@@ -0,0 +1,263 @@
+"""
+Importing Last.fm export files.
+
+Third party tools will export your whole Last.fm history as CSV or
+JSON, which is much quicker to load than walking the API a page at a
+time. We read exports a row at a time so that memory use stays flat
+however long your history is.
+"""
+import csv
+import datetime
+import itertools
+import json
+import re
+
+from django.utils import timezone
+from pytz.exceptions import AmbiguousTimeError, NonExistentTimeError
+
+from inasilentway import lastfm
+
+# How many scrobbles we save at once
+BATCH_SIZE = 5000
+
+# How many characters of a JSON export we read at once
+CHUNK_SIZE = 64 * 1024
+
+# The date format of exports that don't include a unix timestamp
+EXPORT_DATE_FORMATS = [
+    '%d %b %Y %H:%M', '%d %b %Y, %H:%M', '%Y-%m-%d %H:%M:%S'
+]
+
+# CSV header names we understand, and the field they hold
+CSV_COLUMNS = {
+    'artist'   : 'artist',
+    'album'    : 'album',
+    'track'    : 'title',
+    'title'    : 'title',
+    'name'     : 'title',
+    'uts'      : 'timestamp',
+    'timestamp': 'timestamp',
+    'utc_time' : 'date',
+    'date'     : 'date',
+}
+
+# Exports without a header are artist, album, title, date
+CSV_DEFAULT_COLUMNS = ['artist', 'album', 'title', 'date']
+
+JSON_SEPARATOR = re.compile(r'[\s,]*')
+
+
+class ExportError(ValueError):
+    """
+    Raised when we can't make sense of an export file
+    """
+
+
+def parse_date(value):
+    """
+    Given the UTC date string of an export row, return a unix timestamp
+    """
+    for format_string in EXPORT_DATE_FORMATS:
+        try:
+            when = datetime.datetime.strptime(value.strip(), format_string)
+        except ValueError:
+            continue
+        return int(when.replace(tzinfo=datetime.timezone.utc).timestamp())
+    raise ExportError('Unknown date format {}'.format(value))
+
+
+def scrobble_datetime(timestamp):
+    """
+    Return the datetime scrobble_data() would have stored for TIMESTAMP
+    """
+    # scrobble_data() makes Last.fm's UTC playback_date aware in our own
+    # timezone, so do the same or re-importing would change every row
+    when = datetime.datetime.utcfromtimestamp(timestamp)
+    try:
+        return timezone.make_aware(when)
+    except (AmbiguousTimeError, NonExistentTimeError):
+        return None
+
+
+def export_row(artist, title, album, timestamp=None, date=None):
+    """
+    Return a dict of the fields scrobble_data() sets, or None for rows
+    we can't place in time (e.g. the track that was playing when the
+    export ran).
+    """
+    if timestamp:
+        timestamp = int(timestamp)
+    elif date:
+        timestamp = parse_date(date)
+    else:
+        return None
+    return {
+        'artist'   : artist or '',
+        'title'    : title or '',
+        'album'    : album or None,
+        'timestamp': timestamp,
+        'datetime' : scrobble_datetime(timestamp)
+    }
+
+
+def read_csv(stream):
+    """
+    Yield scrobble dicts from a CSV export in STREAM
+    """
+    reader = csv.reader(stream)
+    first = next(reader, None)
+    if first is None:
+        return
+
+    header = [c.strip().lower() for c in first]
+    if 'artist' in header:
+        columns = [CSV_COLUMNS.get(c) for c in header]
+        rows = reader
+    else:
+        columns = CSV_DEFAULT_COLUMNS
+        rows = itertools.chain([first], reader)
+
+    for row in rows:
+        if not row:
+            continue
+        fields = {
+            column: value for column, value in zip(columns, row) if column
+        }
+        data = export_row(
+            fields.get('artist'), fields.get('title'), fields.get('album'),
+            timestamp=fields.get('timestamp'), date=fields.get('date')
+        )
+        if data is not None:
+            yield data
+
+
+def iter_json_array(stream, chunk_size=CHUNK_SIZE):
+    """
+    Yield the items of the top level JSON array in STREAM one at a time,
+    without reading the whole file.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    started = False
+
+    while True:
+        position = JSON_SEPARATOR.match(buffer, position).end()
+
+        if position == len(buffer) or not started:
+            # Drop what we have parsed before reading any more
+            buffer = buffer[position:]
+            position = 0
+            if not started and buffer:
+                if buffer[0] != '[':
+                    raise ExportError('A JSON export should be an array')
+                started = True
+                position = 1
+                continue
+            if eof:
+                raise ExportError('The JSON export ended unexpectedly')
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+
+        if buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            end = None
+        if (end is None or end == len(buffer)) and not eof:
+            # The item runs past the end of what we have read
+            buffer = buffer[position:]
+            position = 0
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        if end is None:
+            raise ExportError('Invalid JSON in export')
+
+        yield item
+        position = end
+
+
+def text(value):
+    """
+    Last.fm JSON has both {"#text": "Name"} and plain "Name" values
+    """
+    if isinstance(value, dict):
+        return value.get('#text') or value.get('name')
+    return value
+
+
+def json_track_row(track):
+    """
+    Return a scrobble dict for one track of a JSON export
+    """
+    date = track.get('date')
+    timestamp = track.get('uts') or track.get('timestamp')
+    if isinstance(date, dict):
+        timestamp = date.get('uts')
+        date = date.get('#text')
+    return export_row(
+        text(track.get('artist')),
+        track.get('name') or track.get('track') or track.get('title'),
+        text(track.get('album')),
+        timestamp=timestamp, date=date
+    )
+
+
+def read_json(stream):
+    """
+    Yield scrobble dicts from a JSON export in STREAM.
+
+    This is either an array of tracks, or an array of pages of tracks
+    as returned by user.getRecentTracks.
+    """
+    for item in iter_json_array(stream):
+        if isinstance(item, list):
+            tracks = item
+        elif 'recenttracks' in item:
+            tracks = item['recenttracks']['track']
+        elif 'track' in item and isinstance(item['track'], list):
+            tracks = item['track']
+        else:
+            tracks = [item]
+
+        for track in tracks:
+            data = json_track_row(track)
+            if data is not None:
+                yield data
+
+
+def read_export(path):
+    """
+    Yield scrobble dicts from the export file at PATH
+    """
+    with open(path, encoding='utf8', newline='') as stream:
+        if path.lower().endswith('.json'):
+            yield from read_json(stream)
+        else:
+            yield from read_csv(stream)
+
+
+def import_export(path, batch_size=BATCH_SIZE, progress=print):
+    """
+    Save and link every scrobble in the export file at PATH, BATCH_SIZE
+    at a time.
+
+    Return the number of scrobbles we read.
+    """
+    rows = read_export(path)
+    total = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        lastfm.save_scrobble_rows(batch)
+        total += len(batch)
+        progress('Imported {} scrobbles'.format(total))
+    return total
@@ -0,0 +1,283 @@
+"""
+Fuzzy matching for the scrobbles our exact matching can't link.
+
+Names that differ by more than our match keys and corrections smooth
+over - a typo, a missing word, 'Quintet' on the end of an artist - are
+matched by the similarity of their character trigrams instead. Record
+titles go in an in-memory inverted index from trigram to the titles
+containing it, so finding the records a scrobbled album might be only
+touches the titles that share a trigram with it.
+
+Matches we are confident of are linked, the rest are queued as
+LinkSuggestions for the unlinked scrobbles page.
+"""
+import collections
+import time
+
+from django.db import transaction
+from django.db.models import Count, Min
+
+from inasilentway import linking, lastfm
+from inasilentway.models import Artist, LinkSuggestion, Record, Scrobble, Track
+
+# Link scrobbles whose worst matching name is at least this similar
+AUTO_LINK_SCORE = 0.8
+
+# Suggest links down to this similarity
+SUGGEST_SCORE = 0.5
+
+FuzzyMatch = collections.namedtuple(
+    'FuzzyMatch', ['score', 'artist_id', 'record_id', 'track_id']
+)
+
+
+def trigrams(key):
+    """
+    Return the set of character trigrams in the match key KEY, padded
+    so that the start and end of each word count for more.
+    """
+    if not key:
+        return frozenset()
+    padded = '  {} '.format(key)
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def similarity(these, those):
+    """
+    Return the Dice coefficient of two sets of trigrams: 1.0 if they
+    are the same, 0.0 if they share nothing.
+    """
+    if not these or not those:
+        return 0.0
+    return 2.0 * len(these & those) / (len(these) + len(those))
+
+
+class TrigramIndex(object):
+    """
+    An inverted index from trigram to the keys that contain it, each
+    key with a list of values, e.g. record title_key -> [record id, ...]
+    """
+
+    def __init__(self):
+        self.positions = {}
+        self.grams     = []
+        self.values    = []
+        self.postings  = collections.defaultdict(list)
+
+    def __len__(self):
+        return len(self.grams)
+
+    def add(self, key, value):
+        position = self.positions.get(key)
+        if position is None:
+            position = self.positions[key] = len(self.grams)
+            grams = trigrams(key)
+            self.grams.append(grams)
+            self.values.append([])
+            for gram in grams:
+                self.postings[gram].append(position)
+        self.values[position].append(value)
+
+    def search(self, key, threshold=SUGGEST_SCORE):
+        """
+        Return (score, values) for each key at least THRESHOLD similar
+        to KEY, most similar first.
+        """
+        grams = trigrams(key)
+        if not grams:
+            return []
+
+        shared = collections.Counter()
+        for gram in grams:
+            postings = self.postings.get(gram)
+            if postings:
+                shared.update(postings)
+
+        found = []
+        for position, count in shared.items():
+            score = 2.0 * count / (len(grams) + len(self.grams[position]))
+            if score >= threshold:
+                found.append((score, self.values[position]))
+        found.sort(key=lambda f: f[0], reverse=True)
+        return found
+
+
+class FuzzyMatcher(object):
+    """
+    An in-memory index of our collection for matching scrobbles by the
+    similarity of their names.
+
+        record title trigrams -> [record id, ...]
+        record id             -> [(artist id, name trigrams), ...]
+        record id             -> [(track id, title trigrams), ...]
+    """
+
+    def __init__(self, signature=None, threshold=SUGGEST_SCORE):
+        if signature is None:
+            signature = lastfm.CollectionMatcher.collection_signature()
+        self.signature = signature
+        self.threshold = threshold
+
+        self.records = TrigramIndex()
+        titles = Record.objects.exclude(title_key='').values_list(
+            'id', 'title_key'
+        ).order_by('id')
+        for record_id, title_key in titles:
+            self.records.add(title_key, record_id)
+
+        names = dict(
+            Artist.objects.exclude(name_key='').values_list('id', 'name_key')
+        )
+        self.artists = collections.defaultdict(list)
+        record_artists = Record.artist.through.objects.values_list(
+            'record_id', 'artist_id'
+        ).order_by('record_id', 'artist_id')
+        for record_id, artist_id in record_artists:
+            if artist_id in names:
+                self.artists[record_id].append(
+                    (artist_id, trigrams(names[artist_id]))
+                )
+
+        self.tracks = collections.defaultdict(list)
+        tracks = Track.objects.exclude(title_key='').values_list(
+            'id', 'record_id', 'title_key'
+        ).order_by('id')
+        for track_id, record_id, title_key in tracks:
+            self.tracks[record_id].append((track_id, trigrams(title_key)))
+
+        self.corrections = lastfm.correction_keys()
+
+    @staticmethod
+    def best(grams, candidates):
+        """
+        Return (score, id) of the most similar of CANDIDATES, a list of
+        (id, trigrams), to GRAMS.
+        """
+        best = 0.0, None
+        for candidate_id, candidate_grams in candidates:
+            score = similarity(grams, candidate_grams)
+            if score > best[0]:
+                best = score, candidate_id
+        return best
+
+    def match_keys(self, artist, album, title):
+        """
+        Return the FuzzyMatch most similar to the match keys ARTIST,
+        ALBUM and TITLE, or None if nothing is at least our threshold
+        similar.
+
+        A match only scores as well as its least similar name.
+        """
+        if not (artist and album and title):
+            return None
+        album = self.corrections['album'].get(album, album)
+        artist_grams = trigrams(artist)
+        title_grams  = trigrams(title)
+
+        best = None
+        albums = self.records.search(album, self.threshold)
+        for album_score, record_ids in albums:
+            if best is not None and album_score <= best.score:
+                break
+            for record_id in record_ids:
+                artist_score, artist_id = self.best(
+                    artist_grams, self.artists.get(record_id, [])
+                )
+                if artist_score < self.threshold:
+                    continue
+                track_score, track_id = self.best(
+                    title_grams, self.tracks.get(record_id, [])
+                )
+                score = min(album_score, artist_score, track_score)
+                if score < self.threshold:
+                    continue
+                if best is None or score > best.score:
+                    best = FuzzyMatch(score, artist_id, record_id, track_id)
+        return best
+
+
+_matcher = None
+
+
+def get_matcher():
+    """
+    Return a FuzzyMatcher for the current state of our collection, only
+    rebuilding it when the collection has changed.
+    """
+    global _matcher
+
+    signature = lastfm.CollectionMatcher.collection_signature()
+    if _matcher is None or _matcher.signature != signature:
+        _matcher = FuzzyMatcher(signature)
+    return _matcher
+
+
+def link(auto_link=AUTO_LINK_SCORE, progress=print):
+    """
+    Fuzzy match every distinct thing our unlinked scrobbles played in
+    a single pass, linking those that score at least AUTO_LINK and
+    replacing our LinkSuggestions with the rest.
+
+    Return the number of scrobbles whose links changed.
+    """
+    started   = time.monotonic()
+    unlinked  = Scrobble.objects.filter(isw_track__isnull=True)
+    played    = unlinked.exclude(album_key='').values(
+        'artist_key', 'album_key', 'title_key'
+    ).annotate(
+        count=Count('id'), artist=Min('artist'), album=Min('album'),
+        title=Min('title')
+    ).order_by()
+    matcher = get_matcher()
+
+    matches     = {}
+    suggestions = []
+    for row in played.iterator():
+        keys  = row['artist_key'], row['album_key'], row['title_key']
+        match = matcher.match_keys(*keys)
+        if match is None:
+            continue
+        if match.score >= auto_link:
+            matches[keys] = match.artist_id, match.record_id, match.track_id
+        else:
+            suggestions.append(LinkSuggestion(
+                artist_key=keys[0], album_key=keys[1], title_key=keys[2],
+                artist=row['artist'], album=row['album'], title=row['title'],
+                isw_artist_id=match.artist_id, isw_track_id=match.track_id,
+                score=match.score, scrobbles=row['count']
+            ))
+    progress('Fuzzy matched unlinked scrobbles in {:.1f}s'.format(
+        time.monotonic() - started
+    ))
+
+    with transaction.atomic():
+        LinkSuggestion.objects.all().delete()
+        LinkSuggestion.objects.bulk_create(suggestions, batch_size=500)
+        progress('Suggested {} links'.format(len(suggestions)))
+        return linking.save_matches(
+            unlinked, matches, started=started, progress=progress
+        )
+
+
+def accept(suggestions, progress=print):
+    """
+    Link the scrobbles of each of SUGGESTIONS to its track, and forget
+    the suggestions.
+
+    Return the number of scrobbles whose links changed.
+    """
+    suggestions = list(suggestions.select_related('isw_track'))
+    matches = {
+        s.keys: (s.isw_artist_id, s.isw_track.record_id, s.isw_track_id)
+        for s in suggestions
+    }
+    scrobbles = Scrobble.objects.filter(
+        isw_track__isnull=True,
+        artist_key__in={s.artist_key for s in suggestions}
+    )
+    with transaction.atomic():
+        linked = linking.save_matches(scrobbles, matches, progress=progress)
+        LinkSuggestion.objects.filter(
+            id__in=[s.id for s in suggestions]
+        ).delete()
+    return linked
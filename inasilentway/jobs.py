@@ -0,0 +1,175 @@
+"""
+A small database backed job queue.
+
+Views enqueue() jobs and return straight away, and the worker
+management command claims and runs them one at a time. Only one job
+with the same name and arguments can be pending or running at once,
+so clicking "Load collection" twice doesn't start two syncs.
+"""
+import datetime
+import json
+import time
+import traceback
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from inasilentway import discogs, lastfm
+from inasilentway.models import Job, Record
+
+# Seconds between looking for new jobs when the queue is empty
+POLL_INTERVAL = 5
+
+# Running jobs we haven't heard from in this long have lost their worker
+STALE_AFTER = datetime.timedelta(minutes=30)
+
+# The format we pass datetimes to tasks in
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M'
+
+TASKS = {}
+
+
+def task(func):
+    """
+    Register FUNC as a task that can be enqueued by name.
+
+    Tasks are called with the Job and its arguments as keyword
+    arguments.
+    """
+    TASKS[func.__name__] = func
+    return func
+
+
+def enqueue(name, **kwargs):
+    """
+    Queue the task NAME to be run with KWARGS, and return the Job.
+
+    If an identical job is already pending or running, return that
+    instead.
+    """
+    if name not in TASKS:
+        raise ValueError('Unknown task {}'.format(name))
+    arguments = json.dumps(kwargs, sort_keys=True)
+    dedupe_key = '{}:{}'.format(name, arguments)[:200]
+    try:
+        with transaction.atomic():
+            return Job.objects.create(
+                name=name, arguments=arguments, dedupe_key=dedupe_key
+            )
+    except IntegrityError:
+        return Job.objects.get(dedupe_key=dedupe_key, status__in=Job.ACTIVE)
+
+
+def claim():
+    """
+    Mark the oldest pending job as running and return it, or None if
+    there is nothing to do.
+
+    Safe to call from several workers at once - only one of them will
+    get any given job.
+    """
+    while True:
+        job = Job.objects.filter(
+            status=Job.PENDING
+        ).order_by('created', 'id').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = Job.objects.filter(id=job.id, status=Job.PENDING).update(
+            status=Job.RUNNING, started=now, heartbeat=now
+        )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def finish(job, status, error=None):
+    job.status   = status
+    job.error    = error
+    job.finished = timezone.now()
+    job.save()
+
+
+def run(job):
+    """
+    Run a claimed JOB, recording whether it worked
+    """
+    print('Running {}'.format(job))
+    try:
+        TASKS[job.name](job, **json.loads(job.arguments))
+    except Exception:
+        error = traceback.format_exc()
+        print(error)
+        finish(job, Job.FAILED, error=error)
+    else:
+        finish(job, Job.DONE)
+    print('Finished {}'.format(job))
+    return job
+
+
+def fail_stale_jobs():
+    """
+    Fail running jobs whose worker has stopped reporting, so that they
+    can be enqueued again.
+    """
+    return Job.objects.filter(
+        status=Job.RUNNING, heartbeat__lt=timezone.now() - STALE_AFTER
+    ).update(
+        status=Job.FAILED, finished=timezone.now(),
+        error='The worker stopped reporting progress'
+    )
+
+
+def work(once=False, poll=POLL_INTERVAL):
+    """
+    Run jobs as they arrive. If ONCE is set, stop when the queue is
+    empty.
+    """
+    fail_stale_jobs()
+    while True:
+        job = claim()
+        if job is not None:
+            run(job)
+            continue
+        if once:
+            return
+        time.sleep(poll)
+
+
+"""
+Tasks
+"""
+
+
+@task
+def load_collection(job, full=False, prune=False):
+    failed = discogs.load_collection(
+        full=full, prune=prune, progress=job.report
+    )
+    if failed:
+        job.report('{} records failed to load'.format(len(failed)))
+
+
+@task
+def load_scrobbles(job):
+    job.report('Loading recent scrobbles')
+    lastfm.load_last_24_hours_of_scrobbles()
+
+
+@task
+def submit_scrobble(job, record_id, when, tracks='*'):
+    """
+    Scrobble TRACKS of a record (or all of them) starting at WHEN, then
+    load them back from Last.fm.
+    """
+    record = Record.objects.get(pk=record_id)
+    when = datetime.datetime.strptime(when, DATETIME_FORMAT)
+
+    job.report('Scrobbling {}'.format(record.title))
+    if tracks == '*':
+        lastfm.scrobble_record(record, when)
+    else:
+        lastfm.scrobble_tracks(lastfm.filter_tracks(record, tracks), when)
+
+    job.report('Loading recent scrobbles')
+    lastfm.load_last_24_hours_of_scrobbles()
@@ -1,195 +1,28 @@
 """
 Interacting with Last.fm from Inasilentway
 """
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import collections
+import contextlib
 import datetime
+import threading
 import time
 
 from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import CharField, Count, Func, Max, Sum
 from django.utils import timezone
 import pylast
 from pytz.tzinfo import NonExistentTimeError
 
-from inasilentway.models import Scrobble
-from inasilentway import utils
-
-LASTFM_PRE_SUBMIT_SUBS = {
-    #
-    # Sometimes when you give the Last.fm scrobble API the name of something
-    # their parser throws it away. So for some selected values we substitue
-    # them pre submission (only to re-substitute them once we've gotten the
-    # data back).
-    #
-    # It's an all-round win for 'being clever'.
-    #
-    'album': {
-        "Getz & J.J. 'Live' - Stan Getz & J.J. Johnson": "Getz & J.J. 'Live'"
-    },
-    'artist': {},
-    'title': {}
-}
-
-#
-# Some records have additional tracks in the Discogs listing - for instance a
-# bonus CD, or a 'track' for the title of a side of an album. Wwhen this
-# happens we exclude them, for now with hard coded Track.exclude() criteria.
-#
-LASTFM_PRE_SUBMIT_TRACKS = {
-    # Title:Artist.first().name : {method: {**kwargs}}
-    'Wave:Antonio Carlos Jobim': [{'exclude': {'position__startswith': 'CD'}}],
-    'It Takes A Nation Of Millions To Hold Us Back:Public Enemy': [{'exclude': {'title__icontains': 'side'}}],
-    'Live At Carnegie Hall:Ryan Adams': [{'exclude': {'title': 'Untitled'}}, {'exclude': {'title__contains': 'November'}}],
-    'Mess:Liars': [{'exclude': {'position__startswith': 'CD'}}],
-    'O Amor, O Sorriso E A Flor:João Gilberto': [{'exclude': {'position__startswith': 'CD'}}],
-    'Bad As Me:Tom Waits': [{'exclude': {'position__startswith': 'CD'}}],
-    'Comedown Machine:The Strokes': [{'exclude': {'position__startswith': 'CD'}}],
-    'Ballads:The John Coltrane Quartet': [{'exclude': {'position': ''}}],
-    'Ghosteen:Nick Cave & The Bad Seeds': [{'exclude': {'position': ''}}],
-    'Are You Experienced / Axis: Bold As Love:The Jimi Hendrix Experience': [{'exclude': {'position': ''}}],
-    'The Modern Jazz Quartet:The Modern Jazz Quartet': [{'exclude': {'position': ''}}],
-    'Chapter Four: Alive In New York:Gato Barbieri': [{'exclude': {'position': ''}}],
-    'Bird / The Savoy Recordings (Master Takes):Charlie Parker': [{'exclude': {'position': ''}}],
-    'Memorial:Clifford Brown': [{'exclude': {'position': ''}}],
-    'Misterioso:The Thelonious Monk Quartet': [{'exclude': {'title__icontains': 'bonus'}}],
-    '... And Star Power:Foxygen': [{'exclude': {'position': ''}}],
-    "This One's For Blanton:Duke Ellington": [{'exclude': {'position': ''}}],
-    "Africa / Brass:The John Coltrane Quartet": [{'exclude': {'position': ''}}],
-    "Highlights From La Damnation De Faust:Hector Berlioz": [{'exclude': {'position': ''}}],
-    "Automatic For The People:R.E.M.": [{'exclude': {'position': ''}}],
-    "A Drum Is A Woman:Duke Ellington And His Orchestra": [{'exclude': {'position': ''}}],
-    "Ellington At Newport:Duke Ellington And His Orchestra": [{'exclude': {'position': ''}}],
-    "Bossa Nova!:João Gilberto": [{'exclude': {'position__startswith': 'CD'}}],
-    "Absolutely Free:The Mothers": [{'exclude': {'position': ''}}],
-    "Imitations:Mark Lanegan": [{'exclude': {'position__startswith': 'CD'}}],
-    "Journey To The Mountain Of Forever:Binker And Moses": [{'exclude': {'position': ''}}],
-    'Sings The Cole Porter Songbook:Ella Fitzgerald': [{'exclude': {'position': ''}}],
-    'Ruth Is Stranger Than Richard:Robert Wyatt': [{'exclude': {'position': ''}}],
-    'Centipede Hz:Animal Collective': [{'exclude': {'position__startswith': 'DVD'}}, {'exclude': {'position': ''}}],
-    "IX:...And You Will Know Us By The Trail Of Dead": [{'exclude': {'position__startswith': 'CD'}}],
-    'Comicopera:Robert Wyatt': [{'exclude': {'position': ''}}],
-    'Enter The Wu-Tang (36 Chambers):Wu-Tang Clan': [{'exclude': {'position': ''}}],
-    'Abattoir Blues / The Lyre Of Orpheus:Nick Cave & The Bad Seeds': [{'exclude': {'position': ''}}],
-    'Enter The Wu-Tang (36 Chambers):Wu-Tang Clan': [{'exclude': {'position': ''}}],
-    'Cheetah EP:Aphex Twin': [{'exclude': {'position': ''}}],
-    'The Crackdown:Cabaret Voltaire': [{'exclude': {'position': ''}}],
-    'Mingus At Monterey:Charles Mingus': [{'exclude': {'title': '-'}}],
-    'Let Go:Nada Surf': [{'exclude': {'position': 'D'}}],
-    "Orfeo Ed Euridice (Abridged Version):Christoph Willibald Gluck": [{'exclude': {'position': ''}}],
-    "Penthouse And Pavement:Heaven 17": [{'exclude': {'position': ''}}],
-    "OK Computer:Radiohead": [{'exclude': {'position': ''}}],
-    "Illmatic:Nas": [{'exclude': {'position': ''}}],
-    "Astral Weeks:Van Morrison": [{'exclude': {'position': ''}}],
-    'Cuckooland:Robert Wyatt': [{'exclude': {'position': ''}}],
-    'Yankee Hotel Foxtrot:Wilco': [{'exclude': {'position__startswith': 'CD'}}],
-    'Evermore:Taylor Swift': [{'exclude': {'position': ''}}],
-    'Folklore:Taylor Swift': [{'exclude': {'position': ''}}],
-    'The Tortured Poets Department:Taylor Swift': [{'exclude': {'position': ''}}],
-    'Yankee Hotel Foxtrot:Wilco': [{'exclude': {'position__startswith': 'CD'}}],
-    'Wednesdays:Ryan Adams' : [{'exclude': {'position': 'C'}}, {'position': 'D'}],
-    'Hello Everything:Squarepusher': [{'exclude': {'position': ''}}, {'exclude': {'title__contains': '4026'}}],
-
-}
-
-# Sometimes we would like to pick an artist from a record that has many.
-
-# e.g. Discogs lists Earl Hines as the first artist on The Louis Armstrong
-# Story vol 3. Louis Armstrong and Earl Hines. With love, Earl is not why we're here.
-LASTFM_PRE_SUBMIT_ARTIST_CHOICES = {
-    'The Louis Armstrong Story - Vol. 3'                    : 'Louis Armstrong',
-    'The Greatest Trumpet Of Them All'                      : 'The Dizzy Gillespie Octet',
-    'Things Are Getting Better'                             : 'Cannonball Adderley',
-    'Oleo'                                                  : 'Grant Green Quartet',
-    'In Orbit'                                              : 'Clark Terry',
-    'Der Ring Des Nibelungen'                               : 'Richard Wagner',
-    'The All-Star Sessions'                                 : 'Elmo Hope',
-    'Violin Concerto'                                       : 'Johannes Brahms',
-    'Finlandia, Karelia, The Swan Of Tuonela, Valse Triste' : 'Jean Sibelius',
-    'Piano Concertos Nos.1 And 2'                           : 'Sergei Vasilyevich Rachmaninoff',
-    'Eine Kleine Nachtmusik, Divertimento KV 287'           : 'Wolfgang Amadeus Mozart',
-    'Symphony Number 6 In F Major, Op. 68 "Pastoral"'       : 'Ludwig Van Beethoven',
-    'High Pressure'                                         : 'The Red Garland Quintet',
-}
+from inasilentway.models import (
+    Artist, DailyScrobbleCount, HistoryWindow, Record, Scrobble, Track
+)
+from inasilentway import caching, corrections, rollups, utils
 
-
-LASTFM_CORRECTIONS = {
-    #
-    # Sometimes Last.fm "corrects" album titles.
-    #
-    # This is useful on occasions where it e.g. strips trailing whitespace.
-    #
-    # It's less useful when being pernickerty about punctuaion.
-    #
-    # Where these are different to Discogs album title versions this means we
-    # are unable to match the scrobbles to the album.
-    #
-    # We keep a mapping of known corrections here so we can move between them
-    #
-    'album': {
-        # lastfm name                                           : disgogs name
-        'Desafinado: Bossa Nova & Jazz Samba'                   : 'Desafinado Coleman Hawkins Plays Bossa Nova & Jazz Samba', # noqa
-        'Oscar Peterson Plays the Duke Ellington Songbook'      : 'The Duke Ellington Songbook', # noqa
-        'Standard Time Vol.2 - Intimacy Calling'                : 'Standard Time Vol. 2 (Intimacy Calling)', # noqa
-        'White Light/White Heat'                                : 'White Light / White Heat', # noqa
-        'Thelonious Monk Plays Duke Ellington'                  : 'Plays Duke Ellington', # noaa
-        'Nights Of Ballads & Blues'                             : 'Nights Of Ballads And Blues', # noqa
-        'Birth of the Cool'                                     : 'The Birth Of The Cool', # noqa
-        'The Ace Of Rhythm'                                     : 'The Ace Of Rhythm ', # Discogs leaves in trailing spaces on album names :/
-        'Soused'                                                : 'Soused ',
-        'Your Queen Is a Reptile'                               : 'Your Queen Is A Reptile ',
-        'Muito À Vontade'                                       : 'Muito à Vontade',
-        'A Night At Birdland, Volume 1'                         : 'A Night At Birdland Volume 1',
-        'A Night at Birdland, Volume 2'                         : 'A Night At Birdland Volume 2',
-        'Out to Lunch'                                          : 'Out To Lunch! ',
-        'Out to Lunch!'                                         : 'Out To Lunch! ',
-        'A New Morning, Changing Weather'                       : 'A New Morning Changing Weather',
-        '"Classical" Symphony / Symphony No 1'                  :'"Classical" Symphony / Symphony No 1 ',
-        'Genius of Modern Music, Volume 1'                      : 'genius of modern music volume one',
-        'Genius Of Modern Music: Vol. 1'                        : 'genius of modern music volume one',
-        'The Complete Jelly Roll Morton Volumes 7/8 (1930-1940)': 'The Complete Jelly Roll Morton Volumes 7/8 (1930-1940) ',
-        '…And Star Power'                                       : '... And Star Power',
-        '801 / 801 Live'                                        : '801 Live',
-        'Blood on the Tracks'                                   : 'Blood On The Tracks',
-        'Master Takes. The Savoy Recordings'                    : 'Master Takes / The Savoy Recordings',
-        'Ella Fitzgerald Sings the Cole Porter Song Book'       : 'Sings The Cole Porter Songbook',
-        'Ella Fitzgerald Sings The Cole Porter Songbook'        : 'Sings The Cole Porter Songbook',
-        'Live At The Village Vanguard'                          : '"Live" At the Village Vanguard',
-        'Planet Her'                                            : 'Planet Her ',
-        'Blackboard Jungle Dub'                                 : ' Blackboard Jungle Dub',
-        'THE TORTURED POETS DEPARTMENT'                         : 'The Tortured Poets Department ',
-
-    },
-
-    'artist': {
-        # lastfm name                         : discogs name
-        'Duke Ellington & His Orchestra'      : 'Duke Ellington And His Orchestra',
-        'Miles Davis Quintet'                 : 'The Miles Davis Quintet',
-        'Clifford Brown & Max Roach'          : 'Clifford Brown And Max Roach',
-        'Antônio Carlos Jobim'                : 'Antonio Carlos Jobim',
-        'N.W.A'                               : 'N.W.A.',
-        'Mark Lanegan'                        : 'Mark Lanegan Band',
-        'Oscar Peterson Trio'                 : 'The Oscar Peterson Trio',
-        'Miles Davis'                         : 'Miles Davis All Stars', # Walkin'
-        'Miles Davis Quintet'                 : 'The Miles Davis Quintet', # Cookin'
-        'The Miles Davis Quartet'             : 'Miles Davis', # The Musings Of Miles
-        'Bill Evans Trio'                     : 'The Bill Evans Trio',
-        'Bill Evans'                          : 'The Bill Evans Trio',
-        'Modern Jazz Quartet'                 : 'The Modern Jazz Quartet',
-        'Duke Ellington'                      : 'Duke Ellington And His Orchestra',
-        'Captain Beefheart & His Magic Band'  : 'Captain Beefheart And His Magic Band',
-        'The (International) Noise Conspiracy': 'The International Noise Conspiracy',
-        'Sonny Rollins'                       : 'Sonny Rollins Quartet',
-        'Thelonious Monk'                     : 'The Thelonious Monk Orchestra',
-        'Thelonious Monk'                     : 'Thelonious Monk Septet',
-        'Phil Manzanera'                      : '801',
-        'HAIM'                                : 'Haim (2)',
-    }
-}
-
-# Put the ones we mangled our side into the corrections dataset without
-# needing to re-type them
-for substitution_type in LASTFM_PRE_SUBMIT_SUBS:
-    for pre, post in LASTFM_PRE_SUBMIT_SUBS[substitution_type].items():
-        LASTFM_CORRECTIONS[substitution_type][post] = pre
+# The corrections and substitutions we need to match scrobbles to our
+# collection and to scrobble records live in the database, see
+# corrections.py
 
 SPOTIFY_EQUIVALENTS = {
     'album': {
@@ -211,116 +44,196 @@ except AttributeError:
     print('No Last.fm API details')
     api = None
 
-def match_artist(artist_name):
-    """
-    Given the name of an artist, return a matching Artist
-    or None
-    """
-    from inasilentway.models import Artist
-
-    artist_matches = Artist.objects.filter(
-        name__iexact=artist_name
-    )
 
-    if len(artist_matches) == 0:
-        return None
-
-    if len(artist_matches) == 1:
-        return artist_matches[0]
+def correction_keys():
+    """
+    Return our corrections as match keys, e.g.
 
-    if len(artist_matches) > 1:
-        import pdb; pdb.set_trace() # noqa
-        print(artist_matches)
+        {'album': {lastfm key: discogs key},
+         'artist': {lastfm key: [discogs key, ...]}}
+    """
+    return corrections.get_lookups().corrections
 
 
-def _match_track(album, title):
+class CollectionMatcher(object):
     """
-    Given a record and a track name, discover if there
-    is a matching track
-    """
-    for track in album.track_set.all():
-        if track.title.lower().strip() == title.lower().strip():
-            return track
+    An in-memory index of our collection for matching Last.fm scrobbles
+    against Discogs records.
 
+    The collection is loaded once into dictionaries keyed on the match
+    keys we store alongside each name (see utils.match_key()):
 
-def _match(artist, album, title):
-    """
-    Return matches if we have them or none
-    e.g. (The Hives, Veni Vidi Viscious, Main Offender)
-    or (None, None, None)
+        artist name_key            -> Artist
+        (artist, album title_key)  -> [Record, ...]
+        (record, track title_key)  -> Track
+
+    with our corrections normalised alongside them, so that matching
+    a scrobble is a handful of dictionary lookups.
     """
-    from inasilentway.models import Record
 
-    match_album = None
-    match_track = None
+    def __init__(self, signature=None):
+        if signature is None:
+            signature = self.collection_signature()
+        self.signature = signature
+
+        self.artists = {}
+        for artist in Artist.objects.exclude(name_key='').order_by('id'):
+            self.artists.setdefault(artist.name_key, artist)
+
+        records = Record.objects.in_bulk()
+        self.records = collections.defaultdict(list)
+        record_artists = Record.artist.through.objects.values_list(
+            'record_id', 'artist_id'
+        ).order_by('record_id')
+        for record_id, artist_id in record_artists:
+            record = records[record_id]
+            if not record.title_key:
+                continue
+            self.records[(artist_id, record.title_key)].append(record)
+
+        self.tracks = {}
+        for track in Track.objects.order_by('id'):
+            self.tracks.setdefault((track.record_id, track.title_key), track)
+
+        self.corrections = correction_keys()
+
+    @staticmethod
+    def collection_signature():
+        """
+        Return a cheap fingerprint of the collection that changes
+        whenever artists, records or tracks are added, edited or
+        removed, a record is (re)loaded from Discogs, or our
+        corrections change.
+        """
+        generations = caching.generations(
+            [caching.COLLECTION, caching.CORRECTIONS]
+        )
+        return tuple(
+            tuple(model.objects.aggregate(Count('id'), Max('id')).values())
+            for model in (Artist, Record, Track)
+        ) + (generations[caching.COLLECTION], generations[caching.CORRECTIONS])
+
+    def _match(self, artist, album, title):
+        """
+        Return matches if we have them or none
+        e.g. (The Hives, Veni Vidi Viscious, Main Offender)
+        or (None, None, None)
+
+        ARTIST, ALBUM and TITLE are match keys.
+        """
+        matching_artist = self.artists.get(artist)
+        if matching_artist is None:
+            return None, None, None
+
+        album_matches = self.records.get((matching_artist.id, album), [])
+
+        if len(album_matches) == 0:
+            return matching_artist, None, None
+
+        if len(album_matches) == 1:
+            match_album = album_matches[0]
+            return (
+                matching_artist,
+                match_album,
+                self.tracks.get((match_album.id, title))
+            )
 
-    matching_artist = match_artist(artist)
+        # E.g. Billie holiday with many "all or nothing at all" albums
+        for match_album in album_matches:
+            track = self.tracks.get((match_album.id, title))
+            if track:
+                return matching_artist, match_album, track
+
+        return matching_artist, None, None
+
+    def match(self, artist, album, title):
+        """
+        Given an ARTIST, ALBUM and track TITLE for a Last.fm scrobble,
+        match it against a Discogs record in our collection.
+        """
+        return self.match_keys(
+            utils.artist_key(artist), utils.match_key(album),
+            utils.match_key(title)
+        )
 
-    album_matches = Record.objects.filter(
-        title__iexact=album,
-        artist=matching_artist
-    )
+    def match_keys(self, artist, album, title):
+        """
+        Like match(), but given the match keys of ARTIST, ALBUM and
+        TITLE, as stored on a Scrobble.
 
-    if len(album_matches) == 0:
-        return matching_artist, match_album, match_track
+        If no complete match is found, try again with each of the
+        corrections for the artist in turn.
+        """
+        album  = self.corrections['album'].get(album, album)
 
-    if len(album_matches) == 1:
-        match_album = album_matches[0]
+        matching = self._match(artist, album, title)
 
-    if len(album_matches) > 1:
-        # E.g. Billie holiday with many "all or nothing at all" albums
-        for album in album_matches:
-            track = _match_track(album, title)
-            if track:
-                match_album = album
-                match_track = track
+        for alternative in self.corrections['artist'].get(artist, []):
+            if all(matching):
                 break
-    else:
-        match_track = _match_track(match_album, title)
+            matching = self._match(alternative, album, title)
 
-    return matching_artist, match_album, match_track
+        return matching
 
+    def match_scrobble(self, scrobble):
+        """
+        Given a Scrobble, match it against our Discogs collection.
+        """
+        return self.match(scrobble.artist, scrobble.album, scrobble.title)
 
-def match(artist, album, title):
-    """
-    Given an ARTIST, ALBUM and track TITLE for a Last.fm scrobble,
-    match it against a Discogs record in our collection.
 
-    Run the match queries multiple times if no matches are found but
-    there are corrections found in our hard coded list.
-    """
+_matcher = None
 
-    if album in LASTFM_CORRECTIONS['album']:
-        album = LASTFM_CORRECTIONS['album'][album]
 
-    matching = _match(artist, album, title)
+def get_matcher():
+    """
+    Return a CollectionMatcher for the current state of our collection,
+    only rebuilding it when the collection has changed.
 
-    if all(matching):
-        return matching
+    Checking for changes takes a few queries, so when matching many
+    scrobbles get a matcher once and pass it down.
+    """
+    global _matcher
 
-    if artist in LASTFM_CORRECTIONS['artist']:
-        artist = LASTFM_CORRECTIONS['artist'][artist]
+    signature = CollectionMatcher.collection_signature()
+    if _matcher is None or _matcher.signature != signature:
+        _matcher = CollectionMatcher(signature)
+    return _matcher
 
-        matching = _match(artist, album, title)
 
-    return matching
+def match(artist, album, title, matcher=None):
+    """
+    Given an ARTIST, ALBUM and track TITLE for a Last.fm scrobble,
+    match it against a Discogs record in our collection.
+    """
+    if matcher is None:
+        matcher = get_matcher()
+    return matcher.match(artist, album, title)
 
 
-def match_scrobble(scrobble):
+def match_scrobble(scrobble, matcher=None):
     """
     Given a Scrobble, match it against our Discogs collection.
 
     (Shorthand function to avoid having to split parameters to match() )
     """
-    return match(str(scrobble.artist), str(scrobble.album), str(scrobble.title))
+    return match(
+        str(scrobble.artist), str(scrobble.album), str(scrobble.title),
+        matcher=matcher
+    )
 
 
-def link_scrobble(scrobble):
+def _link(scrobble, matches):
     """
-    Given a scrobble, link it to an artist, track and record
+    Given a scrobble and an (artist, album, track) match, set the links
+    on the scrobble without saving it.
+
+    Return True if any of the links changed.
     """
-    matches = match_scrobble(scrobble)
     artist, album, track = matches
+    before = (
+        scrobble.isw_track_id, scrobble.isw_album_id, scrobble.isw_artist_id
+    )
 
     if track:
         scrobble.isw_track = track
@@ -331,64 +244,342 @@ def link_scrobble(scrobble):
     if album:
         scrobble.isw_artist = artist
 
-    scrobble.save()
+    after = (
+        scrobble.isw_track_id, scrobble.isw_album_id, scrobble.isw_artist_id
+    )
+    return before != after
+
 
+def link_scrobble(scrobble, matcher=None):
+    """
+    Given a scrobble, link it to an artist, track and record
+    """
+    previous = rollups.linked_ids([scrobble])
+    if _link(scrobble, match_scrobble(scrobble, matcher=matcher)):
+        scrobble.save()
+        rollups.refresh_scrobbles([scrobble], previous=previous)
+        caching.bump(caching.SCROBBLES)
 
 
-def save_scrobbles(scrobbles):
+def link_scrobbles(scrobbles, matcher=None):
     """
-    Given some scrobbles, save them to the database
+    Given an iterable of scrobbles, link them all to artists, tracks
+    and records without saving them.
+
+    Each distinct (artist, album, title) match key is only matched once.
+
+    Return a list of the scrobbles whose links changed.
     """
+    if matcher is None:
+        matcher = get_matcher()
+
+    matches = {}
+    changed = []
+
     for scrobble in scrobbles:
-        scrob, _ = Scrobble.objects.get_or_create(
-            timestamp=scrobble.timestamp,
-            title=scrobble.track.title
+        scrobble.set_match_keys()
+        key = (scrobble.artist_key, scrobble.album_key, scrobble.title_key)
+        if key not in matches:
+            matches[key] = matcher.match_keys(*key)
+        if _link(scrobble, matches[key]):
+            changed.append(scrobble)
+
+    return changed
+
+
+def scrobble_data(scrobble):
+    """
+    Given a pylast PlayedTrack, return a dict of the fields we store
+    on a Scrobble.
+    """
+    data = {
+        'artist'   : str(scrobble.track.artist),
+        'title'    : scrobble.track.title,
+        'album'    : scrobble.album,
+        'timestamp': int(scrobble.timestamp),
+        'datetime' : None
+    }
+    format_string = '%d %b %Y, %H:%M'
+    try:
+        data['datetime'] = timezone.make_aware(
+            datetime.datetime.strptime(scrobble.playback_date, format_string)
         )
-        scrob.artist = scrobble.track.artist
-        scrob.album  = scrobble.album
-        scrob.timestamp = int(scrobble.timestamp)
-        format_string = '%d %b %Y, %H:%M'
-        try:
-            scrob.datetime = timezone.make_aware(
-                datetime.datetime.strptime(scrobble.playback_date, format_string)
-            )
-        except NonExistentTimeError:
-            pass # We get this from last.fm when we play things while clocks
-                 # change
-        scrob.save()
-        link_scrobble(scrob)
+    except NonExistentTimeError:
+        # We get this from last.fm when we play things while clocks change
+        pass
+    return data
 
 
-def get_scrobble_page(when):
+def save_scrobble_rows(rows):
     """
-    Get a page of this user's scrobbles.
+    Given an iterable of dicts as returned by scrobble_data(), save them
+    to the database in bulk and link them to our collection.
+
+    Scrobbles are identified by (timestamp, title). Existing scrobbles
+    are looked up with a single range query, new ones are inserted with
+    bulk_create() and changed ones are written back with bulk_update().
+
+    Return a tuple of (created, updated) lists of Scrobbles.
+    """
+    rows = collections.OrderedDict(
+        ((row['timestamp'], row['title']), row) for row in rows
+    )
+    if not rows:
+        return [], []
+
+    timestamps = [timestamp for timestamp, _ in rows]
+    existing = {
+        (s.timestamp, s.title): s for s in Scrobble.objects.filter(
+            timestamp__gte=min(timestamps), timestamp__lte=max(timestamps)
+        )
+    }
+
+    created = []
+    updated = []
+
+    for key, row in rows.items():
+        scrobble = existing.get(key)
+
+        if scrobble is None:
+            created.append(Scrobble(**row))
+            continue
+
+        if row['datetime'] is None:
+            row = {k: v for k, v in row.items() if k != 'datetime'}
+
+        if any(getattr(scrobble, k) != v for k, v in row.items()):
+            for field, value in row.items():
+                setattr(scrobble, field, value)
+            updated.append(scrobble)
+
+    page     = [existing[k] for k in rows if k in existing]
+    previous = rollups.linked_ids(page)
+    matcher  = get_matcher()
+    relinked = link_scrobbles(page, matcher=matcher)
+    link_scrobbles(created, matcher=matcher)
+
+    seen = {id(s) for s in updated}
+    updated += [s for s in relinked if id(s) not in seen]
+
+    with transaction.atomic():
+        # The unique constraint on (timestamp, title) makes this safe
+        # against another import saving the same scrobbles meanwhile
+        Scrobble.objects.bulk_create(created, ignore_conflicts=True)
+        Scrobble.objects.bulk_update(
+            updated,
+            [
+                'artist', 'album', 'datetime',
+                'artist_key', 'album_key', 'title_key',
+                'isw_track', 'isw_album', 'isw_artist'
+            ]
+        )
+        rollups.refresh_scrobbles(created + updated, previous=previous)
+
+    caching.bump(caching.SCROBBLES)
+    return created, updated
+
+
+def save_scrobbles(scrobbles):
+    """
+    Given some scrobbles, save them to the database
+    """
+    return save_scrobble_rows(scrobble_data(s) for s in scrobbles)
+
+
+def get_scrobble_page(when, since=None, limit=1000):
+    """
+    Get a page of this user's scrobbles from before WHEN (and after
+    SINCE), newest first.
     """
     user = api.get_user(settings.LASTFM_USER)
 
     return user.get_recent_tracks(
-        limit=1000, time_to=when)
+        limit=limit, time_from=since, time_to=when)
 
 
-def load_scrobble_history():
+# Last.fm error codes worth retrying: operation failed, service offline,
+# temporarily unavailable and rate limit exceeded
+TRANSIENT_WS_ERRORS = {'8', '11', '16', '29'}
+
+# The most scrobbles Last.fm will return in a single request
+HISTORY_PAGE_SIZE = 200
+
+# How much of our history each checkpointed window covers
+HISTORY_WINDOW = datetime.timedelta(days=365)
+
+
+def is_transient(error):
     """
-    Load the entire history of the users scrobbles.
+    Is the Last.fm ERROR worth retrying?
     """
-    if Scrobble.objects.count() == 0:
-        # Start a little in the future
-        when = datetime.datetime.now() + datetime.timedelta(seconds=300)
-        when = time.mktime(when.timetuple())
-    else:
-        oldest = Scrobble.objects.all().order_by('timestamp').first()
-        when   = oldest.timestamp
-        when += 300
+    if isinstance(error, pylast.WSError):
+        return error.get_id() in TRANSIENT_WS_ERRORS
+    return True
+
+
+def plan_history(start, end, window=HISTORY_WINDOW):
+    """
+    Make sure there are HistoryWindows covering START to END (both
+    timestamps), and return the ones with scrobbles left to import.
+
+    Windows start and end on multiples of WINDOW since the epoch,
+    whatever START and END are, so every run plans the same windows and
+    resumes them. A finished window that was only complete up to some
+    time before END (the newest one, usually) is reopened to import
+    just the scrobbles since then.
+    """
+    step = int(window.total_seconds())
+    first, last = start // step, -(-end // step)
+    HistoryWindow.objects.bulk_create(
+        [
+            HistoryWindow(
+                start=k * step, end=(k + 1) * step, floor=k * step,
+                cursor=min((k + 1) * step, end),
+                synced=min((k + 1) * step, end)
+            )
+            for k in range(first, last)
+        ],
+        ignore_conflicts=True
+    )
+    windows = HistoryWindow.objects.filter(start__lt=end, end__gt=start)
 
-    scrobbles = get_scrobble_page(when)
+    for stale in windows.filter(status=HistoryWindow.DONE):
+        top = min(stale.end, end)
+        if stale.synced < top:
+            stale.status = HistoryWindow.PENDING
+            stale.floor  = stale.synced
+            stale.cursor = stale.synced = top
+            stale.save()
 
-    if len(scrobbles) > 0:
-        save_scrobbles(scrobbles)
-        print('We have {} scrobbles'.format(Scrobble.objects.count()))
-        print('Going again')
-        load_scrobble_history()
+    return list(windows.exclude(status=HistoryWindow.DONE).order_by('-end'))
+
+
+def import_window(window, progress=print, lock=None):
+    """
+    Import the scrobbles in WINDOW a page at a time, newest first,
+    checkpointing our cursor after each page.
+
+    Transient Last.fm errors are retried with backoff. If we give up
+    the window is marked failed and can be resumed by running it again.
+
+    If we are passed a LOCK we hold it while writing to the database.
+    """
+    if lock is None:
+        lock = contextlib.nullcontext()
+
+    def save():
+        with lock:
+            window.save()
+
+    window.status = HistoryWindow.RUNNING
+    window.error  = None
+    save()
+
+    try:
+        while True:
+            page = utils.retry(
+                lambda: get_scrobble_page(
+                    window.cursor, since=window.floor, limit=HISTORY_PAGE_SIZE
+                ),
+                (pylast.WSError, pylast.NetworkError,
+                 pylast.MalformedResponseError),
+                attempts=6, delay=2, giveup=lambda e: not is_transient(e)
+            )
+            # time_from is not always respected, so drop anything before
+            # the window
+            page = [t for t in page if int(t.timestamp) >= window.floor]
+            if not page:
+                window.status = HistoryWindow.DONE
+                save()
+                break
+
+            with lock:
+                save_scrobbles(page)
+
+            # Go back to (and including) the oldest second we saw, in
+            # case the page ended part way through it. Saving is
+            # idempotent, so seeing a scrobble twice does no harm. We
+            # always move back at least a second though.
+            oldest = min(int(t.timestamp) for t in page)
+            window.cursor = min(oldest + 1, window.cursor - 1)
+            window.pages += 1
+            window.scrobbles += len(page)
+            save()
+            progress('Window {}: {} scrobbles back to {}'.format(
+                window.id, window.scrobbles,
+                datetime.datetime.fromtimestamp(oldest)
+            ))
+    except Exception as err:
+        window.status = HistoryWindow.FAILED
+        window.error  = repr(err)
+        save()
+        raise
+
+    return window
+
+
+def import_history(start=None, end=None, workers=1, progress=print):
+    """
+    Import our scrobble history between the timestamps START (by default
+    when we joined Last.fm) and END (by default now).
+
+    The history is split into HistoryWindows which are imported by a
+    pool of WORKERS threads. Windows we have finished are skipped and
+    unfinished ones resume from their last page, so this can be run
+    again after an interruption.
+
+    SQLite only allows one writer at a time, so there our threads take
+    turns to write while fetching pages side by side.
+
+    Return a list of the windows that failed.
+    """
+    if start is None:
+        user  = api.get_user(settings.LASTFM_USER)
+        start = int(user.get_unixtime_registered())
+    if end is None:
+        end = int(time.time()) + 300
+
+    lock = None
+    if connection.vendor == 'sqlite':
+        lock = threading.Lock()
+
+    def run(window):
+        try:
+            return import_window(window, progress=progress, lock=lock)
+        finally:
+            connection.close()
+
+    windows = plan_history(start, end)
+    progress('{} windows to import'.format(len(windows)))
+
+    failed = []
+    if workers == 1:
+        for window in windows:
+            try:
+                import_window(window, progress=progress)
+            except Exception as err:
+                progress('Window {} failed: {}'.format(window.id, repr(err)))
+                failed.append(window)
+        return failed
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, window): window for window in windows}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as err:
+                progress('Window {} failed: {}'.format(
+                    futures[future].id, repr(err)
+                ))
+                failed.append(futures[future])
+    return failed
+
+
+def load_scrobble_history():
+    """
+    Load the entire history of the users scrobbles.
+    """
+    return import_history()
 
 
 def load_last_24_hours_of_scrobbles():
@@ -428,8 +619,9 @@ def prepare_artist(record):
     The Louis Armstrong Story vol 3. Louis Armstrong and Earl Hines.
     With love, Earl is not why we're here.
     """
-    if record.title in LASTFM_PRE_SUBMIT_ARTIST_CHOICES:
-        decision = LASTFM_PRE_SUBMIT_ARTIST_CHOICES[record.title]
+    choices = corrections.get_lookups().artist_choices
+    if record.title in choices:
+        decision = choices[record.title]
         if decision in [a.name for a in record.artist.all()]:
             return decision
     return record.artist.first().name
@@ -442,6 +634,7 @@ def prepare_tracks(tracks, artist, title, when):
     prepare them for scrobbling.
     """
     prepared_tracks = []
+    substitutions = corrections.get_lookups().substitutions
 
     start_time = time.mktime(when.timetuple())
 
@@ -454,8 +647,8 @@ def prepare_tracks(tracks, artist, title, when):
 
         for datatype in track_data:
             val = track_data[datatype]
-            if val in LASTFM_PRE_SUBMIT_SUBS[datatype]:
-                track_data[datatype] = LASTFM_PRE_SUBMIT_SUBS[datatype][val]
+            if val in substitutions[datatype]:
+                track_data[datatype] = substitutions[datatype][val]
 
         track_data['timestamp'] = start_time
         prepared_tracks.append(track_data)
@@ -496,13 +689,11 @@ def scrobble_record(record, when):
     track_set = record.track_set.all()
 
     # auto filtering of tracks e.g. bonus CDs
-    combined = ':'.join([record.title, artist])
-    if combined in LASTFM_PRE_SUBMIT_TRACKS:
-        for criteria in LASTFM_PRE_SUBMIT_TRACKS[combined]:
-            for method, args in  criteria.items():
-                meth = getattr(track_set, method)
-                print('{} {}'.format(str(meth), args))
-                track_set = meth(**args)
+    track_filters = corrections.get_lookups().track_filters
+    for method, args in track_filters.get((record.title, artist), []):
+        meth = getattr(track_set, method)
+        print('{} {}'.format(str(meth), args))
+        track_set = meth(**args)
 
     tracks = prepare_tracks(track_set, artist, record.title, when)
 
@@ -540,81 +731,189 @@ def filter_tracks(record, tracks):
 
 
 """
-Graphs
+Sessions
 """
 
-def scrobbles_by_day_for_queryset(queryset, min_values=0):
-    if queryset.count() == 0:
-        return []
+# The longest silence between two tracks of the same album play
+SESSION_GAP = 60 * 30
 
-    queryset = queryset.order_by('timestamp')
-    last  = queryset.last().ts_as_dt()
-    counts = []
 
-    for i in range(1, (last.day +1)):
-        start = time.mktime(
-            datetime.datetime(last.year, last.month, i, 0, 0, 0).timetuple()
-        )
-        end   = time.mktime(
-            datetime.datetime(last.year, last.month, i, 23, 59, 59).timetuple()
+class AlbumSession(object):
+    """
+    A run of consecutive scrobbles of the same record
+    """
+    def __init__(self, scrobble):
+        self.record = scrobble.isw_album
+        self.start  = scrobble.timestamp
+        self.end    = scrobble.timestamp
+        self.plays  = 1
+
+    def __str__(self):
+        return "{}: {} {}".format(
+            self.record.id, self.record.title, self.start
         )
 
-        counts.append(
-            [i, queryset.filter(
-                timestamp__gte=start,
-                timestamp__lte=end
-            ).count()]
-        )
+    def continues(self, scrobble, gap=SESSION_GAP):
+        """
+        Is SCROBBLE (played before this session) part of it?
+        """
+        same_record = scrobble.isw_album_id == self.record.id
+        return same_record and self.start - scrobble.timestamp <= gap
 
-    max_count = max([c[1] for c in counts])
+    def add(self, scrobble):
+        self.start = min(self.start, scrobble.timestamp)
+        self.end   = max(self.end, scrobble.timestamp)
+        self.plays += 1
 
-    for group in counts:
-        group.append(utils.percent_of(group[1], max_count))
+    @property
+    def started(self):
+        return datetime.datetime.fromtimestamp(self.start, tz=timezone.utc)
 
-    if len(counts) < min_values:
-        days = [i+1 for i in range(min_values)]
 
-        for d in days:
-            if len(counts) < d:
-                counts.append([d, 0, 0])
+def album_sessions(scrobbles=None, limit=300, chunk_size=500, gap=SESSION_GAP):
+    """
+    Return a list of up to LIMIT AlbumSessions from SCROBBLES (by
+    default all of them), most recent first.
 
-    counts.reverse()
-    return counts
+    Linked scrobbles are streamed newest first in chunks of CHUNK_SIZE
+    and grouped in a single pass, stopping as soon as we have LIMIT
+    sessions.
+    """
+    if scrobbles is None:
+        scrobbles = Scrobble.objects.all()
+    scrobbles = scrobbles.filter(
+        isw_album__isnull=False, timestamp__isnull=False
+    ).select_related('isw_album').order_by('-timestamp', '-id')
+
+    sessions = []
+    current  = None
+    for scrobble in scrobbles.iterator(chunk_size=chunk_size):
+        if current is not None and current.continues(scrobble, gap=gap):
+            current.add(scrobble)
+            continue
+        if len(sessions) == limit:
+            break
+        current = AlbumSession(scrobble)
+        sessions.append(current)
+
+    return sessions
 
 
-def scrobbles_by_month_for_queryset(queryset):
-    if queryset.count() == 0:
-        return []
+"""
+Graphs
+"""
 
-    queryset = queryset.order_by('timestamp')
-    first  = queryset.first().ts_as_dt()
-    counts = []
+GRANULARITIES = ['hour', 'day', 'week', 'month', 'year']
 
-    for i in range(1, 13):
-        start = time.mktime(
-            datetime.datetime(first.year, i, 1, 0, 0, 0).timetuple()
-        )
 
-        if i == 12:
-            end = time.mktime(
-                datetime.datetime((first.year + 1), 1, 1, 0, 0).timetuple()
-            )
-        else:
-            end   = time.mktime(
-                datetime.datetime(first.year, (i + 1), 1, 0, 0).timetuple()
-            )
+class ScrobbleBucket(Func):
+    """
+    The start of the GRANULARITY long bucket that a Scrobble's epoch
+    timestamp (or with EPOCH=False, a date column) falls in, in local
+    time, as an ISO formatted string.
+
+    This is the same string on SQLite and Postgres so that we can GROUP
+    BY it on either.
+    """
+    output_field = CharField()
+
+    SQLITE_FORMATS = {
+        'hour' : "strftime('%%Y-%%m-%%d %%H:00:00', {})",
+        'day'  : "strftime('%%Y-%%m-%%d', {})",
+        'week' : "date({}, 'weekday 0', '-6 days')",
+        'month': "strftime('%%Y-%%m-01', {})",
+        'year' : "strftime('%%Y-01-01', {})",
+    }
 
-        counts.append(
-            [i, queryset.filter(
-                timestamp__gte=start,
-                timestamp__lt=end
-            ).count()]
+    def __init__(self, expression, granularity, epoch=True):
+        if granularity not in GRANULARITIES:
+            raise ValueError('Unknown granularity {}'.format(granularity))
+        self.granularity = granularity
+        self.epoch = epoch
+        super().__init__(expression)
+
+    def as_sqlite(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        if self.epoch:
+            sql = "datetime({}, 'unixepoch', 'localtime')".format(sql)
+        return self.SQLITE_FORMATS[self.granularity].format(sql), params
+
+    def as_postgresql(self, compiler, connection):
+        sql, params = compiler.compile(self.source_expressions[0])
+        if self.epoch:
+            sql = 'to_timestamp({}) AT TIME ZONE %s'.format(sql)
+            params = list(params) + [settings.TIME_ZONE]
+        else:
+            sql = '{}::timestamp'.format(sql)
+        if self.granularity == 'hour':
+            fmt = 'YYYY-MM-DD HH24:00:00'
+        else:
+            fmt = 'YYYY-MM-DD'
+        return "to_char(date_trunc('{}', {}), '{}')".format(
+            self.granularity, sql, fmt
+        ), params
+
+
+def _parse_bucket(value, granularity):
+    if granularity == 'hour':
+        return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _next_bucket(bucket, granularity):
+    if granularity == 'hour':
+        return bucket + datetime.timedelta(hours=1)
+    if granularity == 'day':
+        return bucket + datetime.timedelta(days=1)
+    if granularity == 'week':
+        return bucket + datetime.timedelta(days=7)
+    if granularity == 'month':
+        return datetime.date(
+            bucket.year + bucket.month // 12, bucket.month % 12 + 1, 1
         )
+    return datetime.date(bucket.year + 1, 1, 1)
 
-    counts.reverse()
-    max_count = max([c[1] for c in counts])
 
-    print(counts)
+def histogram(queryset, granularity, start=None, end=None):
+    """
+    Given a QUERYSET of Scrobbles or DailyScrobbleCounts, count the
+    scrobbles in each GRANULARITY long bucket with a single GROUP BY.
+
+    Return an OrderedDict of bucket start -> count, with any empty
+    buckets between START (or the first bucket) and END (or the last
+    bucket) filled in with zeros.
+    """
+    if queryset.model is DailyScrobbleCount:
+        if granularity == 'hour':
+            raise ValueError('Daily scrobble counts have no hours')
+        bucket = ScrobbleBucket('day', granularity, epoch=False)
+        total  = Sum('count')
+    else:
+        bucket = ScrobbleBucket('timestamp', granularity)
+        total  = Count('id')
+
+    rows = queryset.annotate(bucket=bucket).values_list('bucket').annotate(
+        total=total
+    ).order_by()
+    counts = {
+        _parse_bucket(value, granularity): count
+        for value, count in rows if value is not None
+    }
+
+    if not counts:
+        return collections.OrderedDict()
+
+    bucket = start or min(counts)
+    end = end or max(counts)
+    filled = collections.OrderedDict()
+    while bucket <= end:
+        filled[bucket] = counts.get(bucket, 0)
+        bucket = _next_bucket(bucket, granularity)
+    return filled
+
+
+def _with_proportions(counts):
+    max_count = max([c[1] for c in counts])
 
     for group in counts:
         group.append(utils.percent_of(group[1], max_count))
@@ -622,57 +921,55 @@ def scrobbles_by_month_for_queryset(queryset):
     return counts
 
 
-def scrobbles_by_year_for_queryset(queryset):
-    if queryset.count() == 0:
+def scrobbles_by_day_for_queryset(queryset, min_values=0):
+    by_day = histogram(queryset, 'day')
+    if not by_day:
         return []
-    queryset = queryset.order_by('timestamp')
-    first = queryset.first().datetime.year
-    last  = queryset.last().datetime.year
-    counts = []
-
-    for i in range(first, (last +1)):
-        start = datetime.datetime(i, 1, 1, 0, 0, 0)
-        end   = datetime.datetime(i, 12, 31, 23, 59, 59)
-
-        counts.append(
-            [i, queryset.filter(
-                datetime__gte=start,
-                datetime__lte=end
-            ).count()]
-        )
 
-    counts.reverse()
-    max_count = max([c[1] for c in counts])
+    last   = max(by_day)
+    counts = [
+        [i, by_day.get(datetime.date(last.year, last.month, i), 0)]
+        for i in range(1, (last.day + 1))
+    ]
 
-    for group in counts:
-        group.append(utils.percent_of(group[1], max_count))
+    _with_proportions(counts)
+
+    if len(counts) < min_values:
+        days = [i+1 for i in range(min_values)]
 
+        for d in days:
+            if len(counts) < d:
+                counts.append([d, 0, 0])
+
+    counts.reverse()
     return counts
 
 
-def total_scrobbles_by_year():
-    by_year = Scrobble.objects.all().order_by('timestamp')
-    first = by_year.first().datetime.year
-    last = by_year.last().datetime.year
-    counts = []
+def scrobbles_by_month_for_queryset(queryset):
+    by_month = histogram(queryset, 'month')
+    if not by_month:
+        return []
+
+    first  = min(by_month)
+    counts = [
+        [i, by_month.get(datetime.date(first.year, i, 1), 0)]
+        for i in range(1, 13)
+    ]
 
-    for i in range(first, (last + 1)):
+    counts.reverse()
+    return _with_proportions(counts)
 
-        start = datetime.datetime(i, 1, 1, 0, 0, 0)
-        end   = datetime.datetime(i, 12, 31, 23, 59, 59)
 
-        counts.append(
-            [i, Scrobble.objects.filter(
-                datetime__gte=start,
-                datetime__lte=end
-            ).count()]
-        )
+def scrobbles_by_year_for_queryset(queryset):
+    by_year = histogram(queryset, 'year')
+    if not by_year:
+        return []
+
+    counts = [[year.year, count] for year, count in by_year.items()]
 
     counts.reverse()
-    max_count = max([c[1] for c in counts])
+    return _with_proportions(counts)
 
-    for group in counts:
-        perc = int(100 * (group[1] / float(max_count)))
-        group.append(perc)
 
-    return counts
+def total_scrobbles_by_year():
+    return scrobbles_by_year_for_queryset(DailyScrobbleCount.objects.all())
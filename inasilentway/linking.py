@@ -0,0 +1,455 @@
+"""
+Relinking scrobbles to our collection in bulk.
+
+Rather than matching and saving scrobbles one at a time we match each
+distinct (artist, album, title) match key once - optionally across a
+pool of processes - and write the results back with one
+UPDATE ... WHERE id IN per distinct set of links.
+
+relink_in_database() goes further and does the matching itself in a
+handful of set based SQL statements.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import time
+
+from django.db import connection, connections, transaction
+
+from inasilentway import caching, lastfm, rollups
+from inasilentway.models import Artist, Record, Scrobble, Track
+
+# How many scrobble ids go in each UPDATE
+IDS_PER_UPDATE = 500
+
+# How many distinct tracks we hand a worker process at once
+MATCH_CHUNK_SIZE = 200
+
+# How many rows we read from the database at a time
+ROWS_PER_READ = 5000
+
+# What match_ids() returns when nothing matched
+NO_MATCH = (None, None, None)
+
+ScrobbleLinks = collections.namedtuple(
+    'ScrobbleLinks',
+    ['id', 'timestamp', 'isw_track_id', 'isw_album_id', 'isw_artist_id']
+)
+
+
+def match_ids(matcher, triple):
+    """
+    Match an (artist, album, title) match key TRIPLE with MATCHER,
+    returning the (artist, album, track) ids so they can cross process
+    boundaries.
+    """
+    return tuple(
+        None if instance is None else instance.id
+        for instance in matcher.match_keys(*triple)
+    )
+
+
+def new_links(current, matched):
+    """
+    Given the CURRENT (track, album, artist) ids of a scrobble and the
+    MATCHED (artist, album, track) ids, return the ids it should link
+    to, just as lastfm._link() would set them.
+    """
+    track_id, album_id, artist_id = current
+    matched_artist, matched_album, matched_track = matched
+    if matched_track:
+        track_id = matched_track
+    if matched_artist:
+        album_id = matched_album
+    if matched_album:
+        artist_id = matched_artist
+    return track_id, album_id, artist_id
+
+
+_worker_matcher = None
+
+
+def _start_worker():
+    global _worker_matcher
+    _worker_matcher = lastfm.get_matcher()
+
+
+def _match_in_worker(triple):
+    return match_ids(_worker_matcher, triple)
+
+
+def match_triples(triples, workers=1):
+    """
+    Match each of the distinct (artist, album, title) key TRIPLES, in a
+    pool of WORKERS processes if there is more than one.
+
+    Return a dict of triple -> (artist, album, track) ids.
+    """
+    if workers > 1:
+        # Each process has to open its own database connection
+        connections.close_all()
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=_start_worker) as pool:
+            results = pool.map(
+                _match_in_worker, triples, chunksize=MATCH_CHUNK_SIZE
+            )
+            return dict(zip(triples, results))
+
+    matcher = lastfm.get_matcher()
+    return {triple: match_ids(matcher, triple) for triple in triples}
+
+
+def relink(scrobbles=None, workers=1, progress=print):
+    """
+    Try to link SCROBBLES (by default every scrobble without a track)
+    to our collection again.
+
+    Return the number of scrobbles whose links changed.
+    """
+    if scrobbles is None:
+        scrobbles = Scrobble.objects.filter(isw_track__isnull=True)
+    started = time.monotonic()
+
+    triples = list(scrobbles.values_list(
+        'artist_key', 'album_key', 'title_key'
+    ).distinct())
+    progress('Matching {} distinct tracks'.format(len(triples)))
+    matches = match_triples(triples, workers=workers)
+    progress('Matched {} distinct tracks in {:.1f}s'.format(
+        len(triples), time.monotonic() - started
+    ))
+    return save_matches(scrobbles, matches, started=started, progress=progress)
+
+
+def save_matches(scrobbles, matches, started=None, progress=print):
+    """
+    Link each of SCROBBLES to what MATCHES, a dict of (artist, album,
+    title) key triple -> (artist, album, track) ids, says it plays.
+    Scrobbles whose triple isn't in MATCHES are left alone.
+
+    Return the number of scrobbles whose links changed.
+    """
+    if started is None:
+        started = time.monotonic()
+
+    targets  = collections.defaultdict(list)
+    previous = set(), set()
+    rows = scrobbles.values_list(
+        'id', 'artist_key', 'album_key', 'title_key', 'timestamp',
+        'isw_track_id', 'isw_album_id', 'isw_artist_id'
+    ).iterator(chunk_size=ROWS_PER_READ)
+
+    for pk, artist, album, title, timestamp, *current in rows:
+        links = new_links(
+            current, matches.get((artist, album, title), NO_MATCH)
+        )
+        if links == tuple(current):
+            continue
+        targets[links].append(ScrobbleLinks(pk, timestamp, *links))
+        previous[0].add(current[1])
+        previous[1].add(current[2])
+
+    changed = [row for rows in targets.values() for row in rows]
+    with transaction.atomic():
+        for (track_id, album_id, artist_id), rows in targets.items():
+            ids = [row.id for row in rows]
+            for i in range(0, len(ids), IDS_PER_UPDATE):
+                batch = ids[i:i + IDS_PER_UPDATE]
+                Scrobble.objects.filter(id__in=batch).update(
+                    isw_track_id=track_id,
+                    isw_album_id=album_id,
+                    isw_artist_id=artist_id
+                )
+        rollups.refresh_scrobbles(
+            changed, previous=(previous[0] - {None}, previous[1] - {None})
+        )
+    caching.bump(caching.SCROBBLES)
+
+    elapsed = time.monotonic() - started
+    progress('Relinked {} scrobbles in {:.1f}s ({:.0f} a second)'.format(
+        len(changed), elapsed, len(changed) / elapsed if elapsed else 0
+    ))
+    return len(changed)
+
+
+"""
+Linking in the database
+"""
+
+# Our working tables, which only live as long as the connection
+CORRECTIONS_TABLE = 'linking_corrections'
+MATCHES_TABLE     = 'linking_matches'
+AFFECTED_TABLE    = 'linking_scrobbles'
+WORKING_TABLES    = [CORRECTIONS_TABLE, MATCHES_TABLE, AFFECTED_TABLE]
+
+# The distinct things played by unlinked scrobbles, and the album title
+# to look for after applying any correction
+MATCHES_SQL = """
+    INSERT INTO {matches} (
+        artist_key, album_key, title_key, lookup_artist, lookup_album
+    )
+    SELECT DISTINCT s.artist_key, s.album_key, s.title_key, s.artist_key,
+           COALESCE(
+               (SELECT c.discogs_key FROM {corrections} c
+                WHERE c.kind = 'album' AND c.lastfm_key = s.album_key),
+               s.album_key
+           )
+    FROM {scrobble} s
+    WHERE s.isw_track_id IS NULL
+"""
+
+# Match (artist, record, track) for the rows of the matches table
+# WHERE selects. This mirrors CollectionMatcher._match(): if the
+# artist has several records with that title we take the first that
+# has the track.
+MATCH_SQL = [
+    """
+    UPDATE {matches} SET artist_id = (
+        SELECT MIN(a.id) FROM {artist} a
+        WHERE a.name_key = {matches}.lookup_artist AND a.name_key <> ''
+    )
+    WHERE {where}
+    """,
+    """
+    UPDATE {matches} SET record_id = CASE
+        WHEN (
+            SELECT COUNT(*) FROM {record} r
+            JOIN {record_artist} ra ON ra.record_id = r.id
+            WHERE ra.artist_id = {matches}.artist_id
+              AND r.title_key = {matches}.lookup_album AND r.title_key <> ''
+        ) = 1 THEN (
+            SELECT MIN(r.id) FROM {record} r
+            JOIN {record_artist} ra ON ra.record_id = r.id
+            WHERE ra.artist_id = {matches}.artist_id
+              AND r.title_key = {matches}.lookup_album AND r.title_key <> ''
+        )
+        ELSE (
+            SELECT MIN(r.id) FROM {record} r
+            JOIN {record_artist} ra ON ra.record_id = r.id
+            WHERE ra.artist_id = {matches}.artist_id
+              AND r.title_key = {matches}.lookup_album AND r.title_key <> ''
+              AND EXISTS (
+                  SELECT 1 FROM {track} t
+                  WHERE t.record_id = r.id
+                    AND t.title_key = {matches}.title_key
+              )
+        )
+    END
+    WHERE {where}
+    """,
+    """
+    UPDATE {matches} SET track_id = (
+        SELECT MIN(t.id) FROM {track} t
+        WHERE t.record_id = {matches}.record_id
+          AND t.title_key = {matches}.title_key
+    )
+    WHERE {where}
+    """,
+]
+
+# Like CollectionMatcher.match_keys(), try again with the next artist
+# correction when we didn't match everything
+CORRECT_ARTIST_SQL = """
+    UPDATE {matches} SET lookup_artist = (
+        SELECT c.discogs_key FROM {corrections} c
+        WHERE c.kind = 'artist' AND c.lastfm_key = {matches}.artist_key
+          AND c.position = {position}
+    )
+    WHERE (artist_id IS NULL OR record_id IS NULL OR track_id IS NULL)
+      AND EXISTS (
+          SELECT 1 FROM {corrections} c
+          WHERE c.kind = 'artist' AND c.lastfm_key = {matches}.artist_key
+            AND c.position = {position}
+      )
+"""
+
+# The scrobbles whose links will change: those whose artist we matched,
+# unless all we would do is unlink the album they don't have
+AFFECTED_SQL = """
+    INSERT INTO {affected} (id)
+    SELECT id FROM {scrobble}
+    WHERE isw_track_id IS NULL AND EXISTS (
+        SELECT 1 FROM {matches} m
+        WHERE {same_keys} AND m.artist_id IS NOT NULL AND (
+            m.track_id IS NOT NULL
+            OR COALESCE(m.record_id, -1)
+               <> COALESCE({scrobble}.isw_album_id, -1)
+            OR (m.record_id IS NOT NULL
+                AND m.artist_id <> COALESCE({scrobble}.isw_artist_id, -1))
+        )
+    )
+"""
+
+# The same links lastfm._link() would set
+APPLY_SQL = """
+    UPDATE {scrobble} SET
+        isw_track_id = COALESCE((
+            SELECT m.track_id FROM {matches} m WHERE {same_keys}
+        ), isw_track_id),
+        isw_album_id = (
+            SELECT m.record_id FROM {matches} m WHERE {same_keys}
+        ),
+        isw_artist_id = COALESCE((
+            SELECT CASE WHEN m.record_id IS NULL THEN NULL ELSE m.artist_id END
+            FROM {matches} m WHERE {same_keys}
+        ), isw_artist_id)
+    WHERE id IN (SELECT id FROM {affected})
+"""
+
+LINKED_TO_SQL = """
+    SELECT s.timestamp, s.isw_album_id, s.isw_artist_id
+    FROM {scrobble} s JOIN {affected} a ON a.id = s.id
+"""
+
+SAME_KEYS = (
+    'm.artist_key = {scrobble}.artist_key '
+    'AND m.album_key = {scrobble}.album_key '
+    'AND m.title_key = {scrobble}.title_key'
+)
+
+
+def linking_sql(statement, **kwargs):
+    """
+    Fill in the table names in STATEMENT
+    """
+    qn = connection.ops.quote_name
+    tables = {
+        'scrobble'     : qn(Scrobble._meta.db_table),
+        'artist'       : qn(Artist._meta.db_table),
+        'record'       : qn(Record._meta.db_table),
+        'record_artist': qn(Record.artist.through._meta.db_table),
+        'track'        : qn(Track._meta.db_table),
+        'matches'      : qn(MATCHES_TABLE),
+        'corrections'  : qn(CORRECTIONS_TABLE),
+        'affected'     : qn(AFFECTED_TABLE),
+    }
+    tables['same_keys'] = SAME_KEYS.format(**tables)
+    return statement.format(**dict(tables, **kwargs))
+
+
+def create_linking_tables(cursor):
+    """
+    Create our working tables, loading the corrections into one.
+
+    Return the most alternatives any artist has.
+    """
+    drop_linking_tables(cursor)
+    cursor.execute(linking_sql("""
+        CREATE TEMPORARY TABLE {corrections} (
+            kind VARCHAR(10), lastfm_key VARCHAR(255),
+            discogs_key VARCHAR(255), position INTEGER
+        )
+    """))
+    cursor.execute(linking_sql(
+        'CREATE INDEX linking_corrections_key '
+        'ON {corrections} (kind, lastfm_key, position)'
+    ))
+    corrections = lastfm.correction_keys()
+    rows = [
+        ('album', lastfm_key, discogs_key, 0)
+        for lastfm_key, discogs_key in corrections['album'].items()
+    ]
+    rows += [
+        ('artist', lastfm_key, discogs_key, position)
+        for lastfm_key, alternatives in corrections['artist'].items()
+        for position, discogs_key in enumerate(alternatives)
+    ]
+    cursor.executemany(
+        linking_sql(
+            'INSERT INTO {corrections} '
+            '(kind, lastfm_key, discogs_key, position) '
+            'VALUES (%s, %s, %s, %s)'
+        ),
+        rows
+    )
+    cursor.execute(linking_sql("""
+        CREATE TEMPORARY TABLE {matches} (
+            artist_key VARCHAR(255), album_key VARCHAR(255),
+            title_key VARCHAR(255), lookup_artist VARCHAR(255),
+            lookup_album VARCHAR(255), artist_id INTEGER,
+            record_id INTEGER, track_id INTEGER
+        )
+    """))
+    cursor.execute(linking_sql(
+        'CREATE INDEX linking_matches_keys '
+        'ON {matches} (artist_key, album_key, title_key)'
+    ))
+    cursor.execute(linking_sql(
+        'CREATE TEMPORARY TABLE {affected} (id INTEGER PRIMARY KEY)'
+    ))
+    return max([len(a) for a in corrections['artist'].values()] + [0])
+
+
+def drop_linking_tables(cursor):
+    for table in WORKING_TABLES:
+        cursor.execute(
+            'DROP TABLE IF EXISTS {}'.format(connection.ops.quote_name(table))
+        )
+
+
+def linked_to(cursor):
+    """
+    Return the days, record ids and artist ids that the scrobbles in
+    our affected table are played on and linked to, for refreshing our
+    rollups.
+    """
+    days, records, artists = set(), set(), set()
+    cursor.execute(linking_sql(LINKED_TO_SQL))
+    while True:
+        rows = cursor.fetchmany(ROWS_PER_READ)
+        if not rows:
+            break
+        for timestamp, record_id, artist_id in rows:
+            if timestamp is not None:
+                days.add(rollups.scrobble_day(timestamp))
+            records.add(record_id)
+            artists.add(artist_id)
+    return days, records - {None}, artists - {None}
+
+
+def relink_in_database(progress=print):
+    """
+    Link every unlinked scrobble to our collection with a few set based
+    statements, in one transaction.
+
+    Gives the same links as CollectionMatcher, but never brings a
+    scrobble into Python.
+
+    Return the number of scrobbles whose links changed.
+    """
+    started = time.monotonic()
+    with transaction.atomic(), connection.cursor() as cursor:
+        alternatives = create_linking_tables(cursor)
+        try:
+            cursor.execute(linking_sql(MATCHES_SQL))
+            for statement in MATCH_SQL:
+                cursor.execute(linking_sql(statement, where='1 = 1'))
+            for position in range(alternatives):
+                cursor.execute(linking_sql(
+                    CORRECT_ARTIST_SQL, position=position
+                ))
+                for statement in MATCH_SQL:
+                    cursor.execute(linking_sql(
+                        statement, where='lookup_artist <> artist_key'
+                    ))
+            progress('Matched unlinked scrobbles in {:.1f}s'.format(
+                time.monotonic() - started
+            ))
+
+            cursor.execute(linking_sql(AFFECTED_SQL))
+            days, previous_records, previous_artists = linked_to(cursor)
+            cursor.execute(linking_sql(APPLY_SQL))
+            updated = cursor.rowcount
+            _, records, artists = linked_to(cursor)
+        finally:
+            drop_linking_tables(cursor)
+
+        rollups.refresh_days(days)
+        rollups.refresh_play_stats(
+            records=records | previous_records,
+            artists=artists | previous_artists
+        )
+    caching.bump(caching.SCROBBLES)
+
+    elapsed = time.monotonic() - started
+    progress('Relinked {} scrobbles in {:.1f}s'.format(updated, elapsed))
+    return updated
@@ -0,0 +1,28 @@
+"""
+Management command to import a Last.fm export file
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from inasilentway import exports
+
+
+class Command(BaseCommand):
+    """
+    Import every scrobble in a CSV or JSON export of our Last.fm history
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The .csv or .json export to import')
+        parser.add_argument(
+            '--batch-size', type=int, default=exports.BATCH_SIZE,
+            help='How many scrobbles to save at once'
+        )
+
+    def handle(self, *args, **kwargs):
+        print("Importing {}".format(kwargs['path']))
+        try:
+            total = exports.import_export(
+                kwargs['path'], batch_size=kwargs['batch_size']
+            )
+        except (OSError, exports.ExportError) as err:
+            raise CommandError(str(err))
+        print('Imported {} scrobbles'.format(total))
@@ -0,0 +1,38 @@
+"""
+Management command to import our whole Last.fm history
+"""
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+
+from inasilentway import lastfm
+
+
+class Command(BaseCommand):
+    """
+    Import (or carry on importing) every scrobble since a date
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since',
+            help='Import from this date (YYYY-MM-DD) rather than when we '
+                 'joined Last.fm (rounded back to the start of its window)'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='How many windows of history to import at once'
+        )
+
+    def handle(self, *args, **kwargs):
+        start = None
+        if kwargs['since']:
+            since = datetime.datetime.strptime(kwargs['since'], '%Y-%m-%d')
+            start = int(time.mktime(since.timetuple()))
+
+        print("Importing Last.fm history")
+        failed = lastfm.import_history(start=start, workers=kwargs['workers'])
+        if failed:
+            print('{} windows failed, run again to resume them'.format(
+                len(failed)
+            ))
@@ -10,9 +10,20 @@ class Command(BaseCommand):
     """
     Commandline entrypoint for initial load of data into the application
     """
-    def handle(*args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Walk the whole collection rather than stopping at the '
+                 'last sync'
+        )
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Remove records that are no longer in the collection'
+        )
+
+    def handle(self, *args, **kwargs):
         print("Loading Discogs Collection")
-        discogs.load_collection()
+        discogs.load_collection(full=kwargs['full'], prune=kwargs['prune'])
 
         # print("Loading Last.fm Scrobble History")
         # lastfm.load_scrobble_history()
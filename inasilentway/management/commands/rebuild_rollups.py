@@ -0,0 +1,17 @@
+"""
+Management command to rebuild our pre-aggregated listening data
+"""
+from django.core.management.base import BaseCommand
+
+from inasilentway import caching, rollups
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the daily scrobble rollup from scratch
+    """
+    def handle(self, *args, **kwargs):
+        print("Rebuilding daily scrobble counts")
+        count = rollups.rebuild()
+        caching.bump(caching.SCROBBLES)
+        print('{} daily scrobble counts'.format(count))
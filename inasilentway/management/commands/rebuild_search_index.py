@@ -0,0 +1,16 @@
+"""
+Management command to rebuild our full text search index
+"""
+from django.core.management.base import BaseCommand
+
+from inasilentway import search
+
+
+class Command(BaseCommand):
+    """
+    Reindex every record in the collection
+    """
+    def handle(self, *args, **kwargs):
+        print("Rebuilding search index")
+        count = search.index_all()
+        print('{} records indexed'.format(count))
@@ -0,0 +1,17 @@
+"""
+Management command to recompute the play stats of records and artists
+"""
+from django.core.management.base import BaseCommand
+
+from inasilentway import caching, rollups
+
+
+class Command(BaseCommand):
+    """
+    Recompute play_count, first_played and last_played from scratch
+    """
+    def handle(self, *args, **kwargs):
+        print("Recomputing play stats")
+        rollups.rebuild_play_stats()
+        caching.bump(caching.SCROBBLES)
+        print("Done")
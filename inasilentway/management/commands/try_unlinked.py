@@ -6,13 +6,34 @@ import sys
 
 from django.core.management.base import BaseCommand
 
-from inasilentway import models, lastfm
+from inasilentway import caching, fuzzy, linking, models, lastfm, rollups
+
+# How many scrobbles we read and link at a time
+PAGE_SIZE = 1000
 
 
 class Command(BaseCommand):
     """
     Pull all scrobbles without a match and then attempt to link them.
     """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch', action='store_true',
+            help='Match each distinct track once and update links in bulk'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='How many processes to match with in batch mode'
+        )
+        parser.add_argument(
+            '--sql', action='store_true',
+            help='Match and link in the database with set based SQL'
+        )
+        parser.add_argument(
+            '--fuzzy', action='store_true',
+            help='Then fuzzy match what is left, linking or suggesting links'
+        )
+
     def report_unlinked_count(self):
         """
         Print a report of how many unlinked scrobbles we have
@@ -22,20 +43,59 @@ class Command(BaseCommand):
         print('{} unlinked Scrobbles'.format(count))
         return count
 
+    def save_links(self, scrobbles, previous):
+        """
+        Write the links for SCROBBLES back to the database.
+
+        PREVIOUS is the (record ids, artist ids) they used to link to.
+        """
+        models.Scrobble.objects.bulk_update(
+            scrobbles, ['isw_track', 'isw_album', 'isw_artist']
+        )
+        rollups.refresh_scrobbles(scrobbles, previous=previous)
+        caching.bump(caching.SCROBBLES)
+
     def handle(self, *a, **k):
         print("Starting status:")
         start = self.report_unlinked_count()
 
         print("Starting link attempt")
-        unlinked = models.Scrobble.objects.filter(isw_track__isnull=True)
-        for i, scrobble in enumerate(unlinked):
-            lastfm.link_scrobble(scrobble)
-            if i % 50 == 0:
-                sys.stdout.write('.')
-            if i % 2000 == 0:
-                sys.stdout.write('{}\n'.format(i))
+        if k['sql']:
+            linking.relink_in_database()
+        elif k['batch']:
+            linking.relink(workers=k['workers'])
+        else:
+            self.link_one_at_a_time()
+        if k['fuzzy']:
+            fuzzy.link()
 
         print("Attempt finished")
         print("New status:")
         end = self.report_unlinked_count()
         print('({})'.format(start - end))
+
+    def link_one_at_a_time(self):
+        """
+        Link unlinked scrobbles a page at a time.
+
+        We read each page in full, by id, before writing any of it back,
+        rather than writing to the table while a cursor over it is open.
+        """
+        matcher = lastfm.get_matcher()
+        unlinked = models.Scrobble.objects.filter(
+            isw_track__isnull=True
+        ).order_by('id')
+        last_id = 0
+        seen = 0
+        while True:
+            page = list(unlinked.filter(id__gt=last_id)[:PAGE_SIZE])
+            if not page:
+                break
+            last_id = page[-1].id
+            seen += len(page)
+
+            previous = rollups.linked_ids(page)
+            changed = lastfm.link_scrobbles(page, matcher=matcher)
+            if changed:
+                self.save_links(changed, previous)
+            sys.stdout.write('{}\n'.format(seen))
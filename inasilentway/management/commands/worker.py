@@ -0,0 +1,25 @@
+"""
+Management command to run queued background jobs
+"""
+from django.core.management.base import BaseCommand
+
+from inasilentway import jobs
+
+
+class Command(BaseCommand):
+    """
+    Run jobs from the queue as they arrive
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Stop when the queue is empty'
+        )
+        parser.add_argument(
+            '--poll', type=int, default=jobs.POLL_INTERVAL,
+            help='Seconds to wait between checks of an empty queue'
+        )
+
+    def handle(self, *args, **kwargs):
+        print("Waiting for jobs")
+        jobs.work(once=kwargs['once'], poll=kwargs['poll'])
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0002_artistimage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionSync',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('high_water_mark', models.DateTimeField(blank=True, null=True)),
+                ('added', models.IntegerField(default=0)),
+                ('removed', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:41
+
+import collections
+import datetime
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_rollup(apps, schema_editor):
+    Scrobble = apps.get_model('inasilentway', 'Scrobble')
+    DailyScrobbleCount = apps.get_model('inasilentway', 'DailyScrobbleCount')
+
+    counts = collections.Counter()
+    scrobbles = Scrobble.objects.filter(timestamp__isnull=False).values_list(
+        'timestamp', 'artist', 'isw_artist_id', 'isw_album_id'
+    )
+    for timestamp, artist, artist_id, album_id in scrobbles.iterator():
+        day = datetime.date.fromtimestamp(timestamp)
+        counts[(day, artist, artist_id, album_id)] += 1
+
+    DailyScrobbleCount.objects.bulk_create(
+        [
+            DailyScrobbleCount(
+                day=day, artist=artist, isw_artist_id=artist_id,
+                isw_album_id=album_id, count=count
+            )
+            for (day, artist, artist_id, album_id), count in counts.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0003_collectionsync'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyScrobbleCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('artist', models.CharField(max_length=200)),
+                ('count', models.IntegerField(default=0)),
+                ('isw_album', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inasilentway.Record')),
+                ('isw_artist', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inasilentway.Artist')),
+            ],
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,151 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SQLITE_FORWARDS = [
+    """
+    CREATE VIRTUAL TABLE inasilentway_searchindex USING fts5(
+        title, artists, tracks, labels, genres, styles,
+        content='inasilentway_searchdocument', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER inasilentway_searchdocument_ai
+    AFTER INSERT ON inasilentway_searchdocument BEGIN
+        INSERT INTO inasilentway_searchindex(
+            rowid, title, artists, tracks, labels, genres, styles
+        ) VALUES (
+            new.id, new.title, new.artists, new.tracks,
+            new.labels, new.genres, new.styles
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER inasilentway_searchdocument_ad
+    AFTER DELETE ON inasilentway_searchdocument BEGIN
+        INSERT INTO inasilentway_searchindex(
+            inasilentway_searchindex,
+            rowid, title, artists, tracks, labels, genres, styles
+        ) VALUES (
+            'delete', old.id, old.title, old.artists, old.tracks,
+            old.labels, old.genres, old.styles
+        );
+    END
+    """,
+    """
+    CREATE TRIGGER inasilentway_searchdocument_au
+    AFTER UPDATE ON inasilentway_searchdocument BEGIN
+        INSERT INTO inasilentway_searchindex(
+            inasilentway_searchindex,
+            rowid, title, artists, tracks, labels, genres, styles
+        ) VALUES (
+            'delete', old.id, old.title, old.artists, old.tracks,
+            old.labels, old.genres, old.styles
+        );
+        INSERT INTO inasilentway_searchindex(
+            rowid, title, artists, tracks, labels, genres, styles
+        ) VALUES (
+            new.id, new.title, new.artists, new.tracks,
+            new.labels, new.genres, new.styles
+        );
+    END
+    """,
+]
+
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS inasilentway_searchdocument_au",
+    "DROP TRIGGER IF EXISTS inasilentway_searchdocument_ad",
+    "DROP TRIGGER IF EXISTS inasilentway_searchdocument_ai",
+    "DROP TABLE IF EXISTS inasilentway_searchindex",
+]
+
+POSTGRES_FORWARDS = [
+    """
+    CREATE INDEX inasilentway_searchdocument_fts
+    ON inasilentway_searchdocument USING GIN ((
+        setweight(to_tsvector('simple', title), 'A') ||
+        setweight(to_tsvector('simple', artists), 'A') ||
+        setweight(to_tsvector('simple', labels || ' ' || genres || ' ' || styles), 'B') ||
+        setweight(to_tsvector('simple', tracks), 'C')
+    ))
+    """,
+    """
+    CREATE INDEX inasilentway_searchdocument_tracks_fts
+    ON inasilentway_searchdocument USING GIN (to_tsvector('simple', tracks))
+    """,
+]
+
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS inasilentway_searchdocument_tracks_fts",
+    "DROP INDEX IF EXISTS inasilentway_searchdocument_fts",
+]
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+create_index = run_sql(
+    {'sqlite': SQLITE_FORWARDS, 'postgresql': POSTGRES_FORWARDS}
+)
+drop_index = run_sql(
+    {'sqlite': SQLITE_BACKWARDS, 'postgresql': POSTGRES_BACKWARDS}
+)
+
+
+def build_documents(apps, schema_editor):
+    Record = apps.get_model('inasilentway', 'Record')
+    SearchDocument = apps.get_model('inasilentway', 'SearchDocument')
+
+    def lines(names):
+        return '\n'.join(n for n in names if n)
+
+    records = Record.objects.select_related('label').prefetch_related(
+        'artist', 'genres', 'styles', 'track_set'
+    )
+    SearchDocument.objects.bulk_create(
+        [
+            SearchDocument(
+                record=record,
+                title=record.title or '',
+                artists=lines(a.name for a in record.artist.all()),
+                tracks=lines(t.title for t in record.track_set.all()),
+                labels=record.label.name if record.label else '',
+                genres=lines(g.name for g in record.genres.all()),
+                styles=lines(s.name for s in record.styles.all()),
+            )
+            for record in records
+        ],
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0004_dailyscrobblecount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.TextField(blank=True, default='')),
+                ('artists', models.TextField(blank=True, default='')),
+                ('tracks', models.TextField(blank=True, default='')),
+                ('labels', models.TextField(blank=True, default='')),
+                ('genres', models.TextField(blank=True, default='')),
+                ('styles', models.TextField(blank=True, default='')),
+                ('record', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='search_document', to='inasilentway.Record')),
+            ],
+        ),
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(build_documents, migrations.RunPython.noop),
+    ]
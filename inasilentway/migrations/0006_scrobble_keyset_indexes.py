@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0005_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='scrobble',
+            index=models.Index(fields=['timestamp', 'id'], name='scrobble_timestamp_id'),
+        ),
+        migrations.AddIndex(
+            model_name='scrobble',
+            index=models.Index(condition=models.Q(isw_track__isnull=True), fields=['timestamp', 'id'], name='unlinked_timestamp_id'),
+        ),
+    ]
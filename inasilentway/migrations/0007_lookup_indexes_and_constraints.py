@@ -0,0 +1,212 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:48
+
+import collections
+import datetime
+import time
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def duplicates(queryset, *fields):
+    """
+    Yield (keeper_id, [duplicate ids]) for each group of rows in
+    QUERYSET sharing FIELDS.
+    """
+    groups = queryset.values(*fields).annotate(
+        keeper=Min('id'), n=Count('id')
+    ).filter(n__gt=1)
+    for group in groups:
+        keeper = group.pop('keeper')
+        group.pop('n')
+        dupes = queryset.filter(**group).exclude(id=keeper)
+        yield keeper, list(dupes.values_list('id', flat=True))
+
+
+def merge_discogs_duplicates(apps, schema_editor):
+    Artist = apps.get_model('inasilentway', 'Artist')
+    Label = apps.get_model('inasilentway', 'Label')
+    Record = apps.get_model('inasilentway', 'Record')
+    Scrobble = apps.get_model('inasilentway', 'Scrobble')
+    Track = apps.get_model('inasilentway', 'Track')
+    DailyScrobbleCount = apps.get_model('inasilentway', 'DailyScrobbleCount')
+    RecordArtist = Record.artist.through
+
+    # Rows we created without a Discogs id get NULL so they don't clash
+    for model in [Artist, Label, Record]:
+        model.objects.filter(discogs_id='').update(discogs_id=None)
+
+    ids = models.Q(discogs_id__isnull=False)
+
+    for keeper, dupes in duplicates(Record.objects.filter(ids), 'discogs_id'):
+        # Duplicate tracks go with their record, so move their scrobbles
+        # to the keeper's track of the same title and position
+        tracks = {}
+        for track_id, title, position in Track.objects.filter(
+                record_id=keeper
+        ).order_by('-id').values_list('id', 'title', 'position'):
+            tracks[title, position] = track_id
+        for track_id, title, position in Track.objects.filter(
+                record__in=dupes
+        ).values_list('id', 'title', 'position'):
+            if (title, position) in tracks:
+                Scrobble.objects.filter(isw_track_id=track_id).update(
+                    isw_track_id=tracks[title, position]
+                )
+        # The keeper doesn't have the rest, so leave them for relinking
+        Scrobble.objects.filter(isw_track__record__in=dupes).update(
+            isw_track=None, isw_artist=None
+        )
+        Scrobble.objects.filter(isw_album__in=dupes).update(isw_album=keeper)
+        DailyScrobbleCount.objects.filter(isw_album__in=dupes).update(
+            isw_album=keeper
+        )
+        Record.objects.filter(id__in=dupes).delete()
+
+    for keeper, dupes in duplicates(Artist.objects.filter(ids), 'discogs_id'):
+        linked = set(RecordArtist.objects.filter(
+            artist_id=keeper
+        ).values_list('record_id', flat=True))
+        records = set(RecordArtist.objects.filter(
+            artist_id__in=dupes
+        ).values_list('record_id', flat=True))
+        RecordArtist.objects.bulk_create([
+            RecordArtist(record_id=record_id, artist_id=keeper)
+            for record_id in records - linked
+        ])
+        Scrobble.objects.filter(isw_artist__in=dupes).update(isw_artist=keeper)
+        DailyScrobbleCount.objects.filter(isw_artist__in=dupes).update(
+            isw_artist=keeper
+        )
+        Artist.objects.filter(id__in=dupes).delete()
+
+    for keeper, dupes in duplicates(Label.objects.filter(ids), 'discogs_id'):
+        Record.objects.filter(label__in=dupes).update(label=keeper)
+        Label.objects.filter(id__in=dupes).delete()
+
+
+def delete_duplicate_scrobbles(apps, schema_editor):
+    Scrobble = apps.get_model('inasilentway', 'Scrobble')
+    DailyScrobbleCount = apps.get_model('inasilentway', 'DailyScrobbleCount')
+
+    days = set()
+    scrobbles = Scrobble.objects.filter(timestamp__isnull=False)
+    for keeper, dupes in duplicates(scrobbles, 'timestamp', 'title'):
+        keep = Scrobble.objects.get(id=keeper)
+        days.add(datetime.date.fromtimestamp(keep.timestamp))
+        Scrobble.objects.filter(id__in=dupes).delete()
+
+    # Recount the rollup for the days we changed
+    for day in days:
+        start = time.mktime(day.timetuple())
+        end = time.mktime((day + datetime.timedelta(days=1)).timetuple())
+        DailyScrobbleCount.objects.filter(day=day).delete()
+        counts = collections.Counter(
+            Scrobble.objects.filter(
+                timestamp__gte=start, timestamp__lt=end
+            ).values_list('artist', 'isw_artist_id', 'isw_album_id')
+        )
+        DailyScrobbleCount.objects.bulk_create([
+            DailyScrobbleCount(
+                day=day, artist=artist, isw_artist_id=artist_id,
+                isw_album_id=album_id, count=count
+            )
+            for (artist, artist_id, album_id), count in counts.items()
+        ])
+
+
+CASE_INSENSITIVE_INDEXES = {
+    # SQLite uses a NOCASE index for LIKE, which is how Django does iexact
+    'sqlite': (
+        "CREATE INDEX inasilentway_artist_name_nocase "
+        "ON inasilentway_artist (name COLLATE NOCASE)"
+    ),
+    # Postgres iexact compares UPPER("name"::text)
+    'postgresql': (
+        "CREATE INDEX inasilentway_artist_name_upper "
+        "ON inasilentway_artist (UPPER(name::text))"
+    ),
+}
+
+DROP_CASE_INSENSITIVE_INDEXES = {
+    'sqlite': "DROP INDEX IF EXISTS inasilentway_artist_name_nocase",
+    'postgresql': "DROP INDEX IF EXISTS inasilentway_artist_name_upper",
+}
+
+
+def run_sql(statements):
+    def run(apps, schema_editor):
+        sql = statements.get(schema_editor.connection.vendor, None)
+        if sql is not None:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    # Postgres won't ALTER a table with pending trigger events, which the
+    # deferred foreign key checks of our data cleanup leave behind. So
+    # each data step gets its own transaction rather than sharing one
+    # with the unique constraints that follow it.
+    atomic = False
+
+    dependencies = [
+        ('inasilentway', '0006_scrobble_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='artist',
+            name='discogs_id',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='label',
+            name='discogs_id',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='discogs_id',
+            field=models.CharField(blank=True, max_length=200, null=True),
+        ),
+        migrations.RunPython(
+            merge_discogs_duplicates, migrations.RunPython.noop, atomic=True
+        ),
+        migrations.RunPython(
+            delete_duplicate_scrobbles, migrations.RunPython.noop, atomic=True
+        ),
+        migrations.AlterField(
+            model_name='artist',
+            name='discogs_id',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='artist',
+            name='name',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AlterField(
+            model_name='label',
+            name='discogs_id',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='discogs_id',
+            field=models.CharField(blank=True, max_length=200, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='record',
+            name='title',
+            field=models.CharField(blank=True, db_index=True, max_length=200, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='scrobble',
+            constraint=models.UniqueConstraint(fields=('timestamp', 'title'), name='unique_scrobble'),
+        ),
+        migrations.RunPython(
+            run_sql(CASE_INSENSITIVE_INDEXES),
+            run_sql(DROP_CASE_INSENSITIVE_INDEXES)
+        ),
+    ]
@@ -0,0 +1,91 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:50
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+
+def as_datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def compute_play_stats(apps, schema_editor):
+    Scrobble = apps.get_model('inasilentway', 'Scrobble')
+
+    for name, link in [('Record', 'isw_album'), ('Artist', 'isw_artist')]:
+        model = apps.get_model('inasilentway', name)
+        plays = Scrobble.objects.filter(
+            **{'{}__isnull'.format(link): False}
+        ).values(link).annotate(
+            count=Count('id'), first=Min('timestamp'), last=Max('timestamp')
+        )
+        model.objects.bulk_update(
+            [
+                model(
+                    id=p[link], play_count=p['count'],
+                    first_played=as_datetime(p['first']),
+                    last_played=as_datetime(p['last'])
+                )
+                for p in plays
+            ],
+            ['play_count', 'first_played', 'last_played'],
+            batch_size=500
+        )
+
+
+def restore_artist_name_index(apps, schema_editor):
+    # Adding fields on SQLite rebuilds the table, which drops the
+    # NOCASE index we created by hand in 0007
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS inasilentway_artist_name_nocase "
+            "ON inasilentway_artist (name COLLATE NOCASE)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0007_lookup_indexes_and_constraints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='first_played',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='last_played',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='artist',
+            name='play_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='first_played',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='last_played',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='play_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(
+            restore_artist_name_index, migrations.RunPython.noop
+        ),
+        migrations.RunPython(compute_play_stats, migrations.RunPython.noop),
+    ]
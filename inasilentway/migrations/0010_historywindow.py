@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0009_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryWindow',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.IntegerField()),
+                ('end', models.IntegerField()),
+                ('cursor', models.IntegerField()),
+                ('floor', models.IntegerField(default=0)),
+                ('synced', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=20)),
+                ('pages', models.IntegerField(default=0)),
+                ('scrobbles', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='historywindow',
+            constraint=models.UniqueConstraint(fields=('start', 'end'), name='unique_history_window'),
+        ),
+    ]
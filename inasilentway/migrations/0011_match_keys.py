@@ -0,0 +1,122 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:03
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+ROWS_PER_UPDATE = 2000
+
+# A snapshot of the normalisation in inasilentway.utils as of this
+# migration, so later changes to it don't change what we fill in here
+MATCH_KEY_LENGTH = 255
+PUNCTUATION      = re.compile(r'[^\w\s]|_')
+WHITESPACE       = re.compile(r'\s+')
+DISAMBIGUATION   = re.compile(r'\s*\(\d+\)\s*$')
+
+
+def match_key(value):
+    if value is None:
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    value = value.casefold().replace('&', ' and ')
+    value = PUNCTUATION.sub(' ', value)
+    return WHITESPACE.sub(' ', value).strip()[:MATCH_KEY_LENGTH]
+
+
+def artist_key(value):
+    if value is None:
+        return ''
+    return match_key(DISAMBIGUATION.sub('', str(value)))
+
+
+def fill(model, keys):
+    """
+    Set the match KEYS of every row of MODEL, where KEYS is a dict of
+    key field -> (source field, normalising function).
+    """
+    batch = []
+    for instance in model.objects.order_by('id').iterator(chunk_size=ROWS_PER_UPDATE):
+        for key, (source, normalise) in keys.items():
+            setattr(instance, key, normalise(getattr(instance, source)))
+        batch.append(instance)
+        if len(batch) == ROWS_PER_UPDATE:
+            model.objects.bulk_update(batch, list(keys))
+            batch = []
+    model.objects.bulk_update(batch, list(keys))
+
+
+def fill_match_keys(apps, schema_editor):
+    fill(apps.get_model('inasilentway', 'Artist'), {
+        'name_key': ('name', artist_key)
+    })
+    fill(apps.get_model('inasilentway', 'Record'), {
+        'title_key': ('title', match_key)
+    })
+    fill(apps.get_model('inasilentway', 'Track'), {
+        'title_key': ('title', match_key)
+    })
+    fill(apps.get_model('inasilentway', 'Scrobble'), {
+        'artist_key': ('artist', artist_key),
+        'album_key' : ('album', match_key),
+        'title_key' : ('title', match_key),
+    })
+
+
+def restore_artist_name_index(apps, schema_editor):
+    # Adding fields on SQLite rebuilds the table, which drops the
+    # NOCASE index we created by hand in 0007
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS inasilentway_artist_name_nocase "
+            "ON inasilentway_artist (name COLLATE NOCASE)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0010_historywindow'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='artist',
+            name='name_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='record',
+            name='title_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='scrobble',
+            name='album_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='scrobble',
+            name='artist_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='scrobble',
+            name='title_key',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='title_key',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='scrobble',
+            index=models.Index(fields=['artist_key', 'album_key', 'title_key'], name='scrobble_match_keys'),
+        ),
+        migrations.RunPython(
+            restore_artist_name_index, migrations.RunPython.noop
+        ),
+        migrations.RunPython(fill_match_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,200 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:07
+
+import json
+
+from django.db import migrations, models
+
+# The corrections we used to keep in lastfm.py
+
+# (kind, Last.fm name, Discogs name, note)
+CORRECTIONS = [
+    ('album', 'Desafinado: Bossa Nova & Jazz Samba', 'Desafinado Coleman Hawkins Plays Bossa Nova & Jazz Samba', ''),
+    ('album', 'Oscar Peterson Plays the Duke Ellington Songbook', 'The Duke Ellington Songbook', ''),
+    ('album', 'Thelonious Monk Plays Duke Ellington', 'Plays Duke Ellington', ''),
+    ('album', 'Birth of the Cool', 'The Birth Of The Cool', ''),
+    ('album', 'Genius of Modern Music, Volume 1', 'genius of modern music volume one', ''),
+    ('album', 'Genius Of Modern Music: Vol. 1', 'genius of modern music volume one', ''),
+    ('album', '801 / 801 Live', '801 Live', ''),
+    ('album', 'Ella Fitzgerald Sings the Cole Porter Song Book', 'Sings The Cole Porter Songbook', ''),
+    ('album', 'Ella Fitzgerald Sings The Cole Porter Songbook', 'Sings The Cole Porter Songbook', ''),
+    ('artist', 'Miles Davis Quintet', 'The Miles Davis Quintet', "Cookin'"),
+    ('artist', 'Mark Lanegan', 'Mark Lanegan Band', ''),
+    ('artist', 'Oscar Peterson Trio', 'The Oscar Peterson Trio', ''),
+    ('artist', 'Miles Davis', 'Miles Davis All Stars', "Walkin'"),
+    ('artist', 'The Miles Davis Quartet', 'Miles Davis', 'The Musings Of Miles'),
+    ('artist', 'Bill Evans Trio', 'The Bill Evans Trio', ''),
+    ('artist', 'Bill Evans', 'The Bill Evans Trio', ''),
+    ('artist', 'Modern Jazz Quartet', 'The Modern Jazz Quartet', ''),
+    ('artist', 'Duke Ellington', 'Duke Ellington And His Orchestra', ''),
+    ('artist', 'Sonny Rollins', 'Sonny Rollins Quartet', ''),
+    ('artist', 'Thelonious Monk', 'The Thelonious Monk Orchestra', ''),
+    ('artist', 'Thelonious Monk', 'Thelonious Monk Septet', ''),
+    ('artist', 'Phil Manzanera', '801', ''),
+]
+
+# (kind, original, substitute)
+SUBSTITUTIONS = [
+    ('album', "Getz & J.J. 'Live' - Stan Getz & J.J. Johnson", "Getz & J.J. 'Live'"),
+]
+
+# (record title, artist name, method, criteria)
+TRACK_FILTERS = [
+    ('Wave', 'Antonio Carlos Jobim', 'exclude', {'position__startswith': 'CD'}),
+    ('It Takes A Nation Of Millions To Hold Us Back', 'Public Enemy', 'exclude', {'title__icontains': 'side'}),
+    ('Live At Carnegie Hall', 'Ryan Adams', 'exclude', {'title': 'Untitled'}),
+    ('Live At Carnegie Hall', 'Ryan Adams', 'exclude', {'title__contains': 'November'}),
+    ('Mess', 'Liars', 'exclude', {'position__startswith': 'CD'}),
+    ('O Amor, O Sorriso E A Flor', 'João Gilberto', 'exclude', {'position__startswith': 'CD'}),
+    ('Bad As Me', 'Tom Waits', 'exclude', {'position__startswith': 'CD'}),
+    ('Comedown Machine', 'The Strokes', 'exclude', {'position__startswith': 'CD'}),
+    ('Ballads', 'The John Coltrane Quartet', 'exclude', {'position': ''}),
+    ('Ghosteen', 'Nick Cave & The Bad Seeds', 'exclude', {'position': ''}),
+    ('Are You Experienced / Axis: Bold As Love', 'The Jimi Hendrix Experience', 'exclude', {'position': ''}),
+    ('The Modern Jazz Quartet', 'The Modern Jazz Quartet', 'exclude', {'position': ''}),
+    ('Chapter Four: Alive In New York', 'Gato Barbieri', 'exclude', {'position': ''}),
+    ('Bird / The Savoy Recordings (Master Takes)', 'Charlie Parker', 'exclude', {'position': ''}),
+    ('Memorial', 'Clifford Brown', 'exclude', {'position': ''}),
+    ('Misterioso', 'The Thelonious Monk Quartet', 'exclude', {'title__icontains': 'bonus'}),
+    ('... And Star Power', 'Foxygen', 'exclude', {'position': ''}),
+    ("This One's For Blanton", 'Duke Ellington', 'exclude', {'position': ''}),
+    ('Africa / Brass', 'The John Coltrane Quartet', 'exclude', {'position': ''}),
+    ('Highlights From La Damnation De Faust', 'Hector Berlioz', 'exclude', {'position': ''}),
+    ('Automatic For The People', 'R.E.M.', 'exclude', {'position': ''}),
+    ('A Drum Is A Woman', 'Duke Ellington And His Orchestra', 'exclude', {'position': ''}),
+    ('Ellington At Newport', 'Duke Ellington And His Orchestra', 'exclude', {'position': ''}),
+    ('Bossa Nova!', 'João Gilberto', 'exclude', {'position__startswith': 'CD'}),
+    ('Absolutely Free', 'The Mothers', 'exclude', {'position': ''}),
+    ('Imitations', 'Mark Lanegan', 'exclude', {'position__startswith': 'CD'}),
+    ('Journey To The Mountain Of Forever', 'Binker And Moses', 'exclude', {'position': ''}),
+    ('Sings The Cole Porter Songbook', 'Ella Fitzgerald', 'exclude', {'position': ''}),
+    ('Ruth Is Stranger Than Richard', 'Robert Wyatt', 'exclude', {'position': ''}),
+    ('Centipede Hz', 'Animal Collective', 'exclude', {'position__startswith': 'DVD'}),
+    ('Centipede Hz', 'Animal Collective', 'exclude', {'position': ''}),
+    ('IX', '...And You Will Know Us By The Trail Of Dead', 'exclude', {'position__startswith': 'CD'}),
+    ('Comicopera', 'Robert Wyatt', 'exclude', {'position': ''}),
+    ('Enter The Wu-Tang (36 Chambers)', 'Wu-Tang Clan', 'exclude', {'position': ''}),
+    ('Abattoir Blues / The Lyre Of Orpheus', 'Nick Cave & The Bad Seeds', 'exclude', {'position': ''}),
+    ('Cheetah EP', 'Aphex Twin', 'exclude', {'position': ''}),
+    ('The Crackdown', 'Cabaret Voltaire', 'exclude', {'position': ''}),
+    ('Mingus At Monterey', 'Charles Mingus', 'exclude', {'title': '-'}),
+    ('Let Go', 'Nada Surf', 'exclude', {'position': 'D'}),
+    ('Orfeo Ed Euridice (Abridged Version)', 'Christoph Willibald Gluck', 'exclude', {'position': ''}),
+    ('Penthouse And Pavement', 'Heaven 17', 'exclude', {'position': ''}),
+    ('OK Computer', 'Radiohead', 'exclude', {'position': ''}),
+    ('Illmatic', 'Nas', 'exclude', {'position': ''}),
+    ('Astral Weeks', 'Van Morrison', 'exclude', {'position': ''}),
+    ('Cuckooland', 'Robert Wyatt', 'exclude', {'position': ''}),
+    ('Yankee Hotel Foxtrot', 'Wilco', 'exclude', {'position__startswith': 'CD'}),
+    ('Evermore', 'Taylor Swift', 'exclude', {'position': ''}),
+    ('Folklore', 'Taylor Swift', 'exclude', {'position': ''}),
+    ('The Tortured Poets Department', 'Taylor Swift', 'exclude', {'position': ''}),
+    ('Wednesdays', 'Ryan Adams', 'exclude', {'position': 'C'}),
+    ('Wednesdays', 'Ryan Adams', 'exclude', {'position': 'D'}),
+    ('Hello Everything', 'Squarepusher', 'exclude', {'position': ''}),
+    ('Hello Everything', 'Squarepusher', 'exclude', {'title__contains': '4026'}),
+]
+
+# (record title, artist name)
+ARTIST_CHOICES = [
+    ('The Louis Armstrong Story - Vol. 3', 'Louis Armstrong'),
+    ('The Greatest Trumpet Of Them All', 'The Dizzy Gillespie Octet'),
+    ('Things Are Getting Better', 'Cannonball Adderley'),
+    ('Oleo', 'Grant Green Quartet'),
+    ('In Orbit', 'Clark Terry'),
+    ('Der Ring Des Nibelungen', 'Richard Wagner'),
+    ('The All-Star Sessions', 'Elmo Hope'),
+    ('Violin Concerto', 'Johannes Brahms'),
+    ('Finlandia, Karelia, The Swan Of Tuonela, Valse Triste', 'Jean Sibelius'),
+    ('Piano Concertos Nos.1 And 2', 'Sergei Vasilyevich Rachmaninoff'),
+    ('Eine Kleine Nachtmusik, Divertimento KV 287', 'Wolfgang Amadeus Mozart'),
+    ('Symphony Number 6 In F Major, Op. 68 "Pastoral"', 'Ludwig Van Beethoven'),
+    ('High Pressure', 'The Red Garland Quintet'),
+]
+
+
+def seed_corrections(apps, schema_editor):
+    Correction = apps.get_model('inasilentway', 'Correction')
+    Substitution = apps.get_model('inasilentway', 'Substitution')
+    TrackFilter = apps.get_model('inasilentway', 'TrackFilter')
+    ArtistChoice = apps.get_model('inasilentway', 'ArtistChoice')
+
+    Correction.objects.bulk_create([
+        Correction(kind=kind, lastfm_name=lastfm_name,
+                   discogs_name=discogs_name, note=note)
+        for kind, lastfm_name, discogs_name, note in CORRECTIONS
+    ])
+    Substitution.objects.bulk_create([
+        Substitution(kind=kind, original=original, substitute=substitute)
+        for kind, original, substitute in SUBSTITUTIONS
+    ])
+    TrackFilter.objects.bulk_create([
+        TrackFilter(record_title=title, artist_name=artist, method=method,
+                    criteria=json.dumps(criteria))
+        for title, artist, method, criteria in TRACK_FILTERS
+    ])
+    ArtistChoice.objects.bulk_create([
+        ArtistChoice(record_title=title, artist_name=artist)
+        for title, artist in ARTIST_CHOICES
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0011_match_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArtistChoice',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_title', models.CharField(max_length=200, unique=True)),
+                ('artist_name', models.CharField(max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Correction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('album', 'Album'), ('artist', 'Artist')], max_length=10)),
+                ('lastfm_name', models.CharField(max_length=200)),
+                ('discogs_name', models.CharField(max_length=200)),
+                ('note', models.CharField(blank=True, default='', max_length=200)),
+            ],
+            options={
+                'ordering': ['kind', 'lastfm_name', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Substitution',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('album', 'Album'), ('artist', 'Artist'), ('title', 'Title')], max_length=10)),
+                ('original', models.CharField(max_length=200)),
+                ('substitute', models.CharField(max_length=200)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrackFilter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('record_title', models.CharField(max_length=200)),
+                ('artist_name', models.CharField(max_length=200)),
+                ('method', models.CharField(choices=[('exclude', 'Exclude'), ('filter', 'Filter')], default='exclude', max_length=10)),
+                ('criteria', models.TextField(default='{}')),
+            ],
+            options={
+                'ordering': ['record_title', 'artist_name', 'id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='substitution',
+            constraint=models.UniqueConstraint(fields=('kind', 'original'), name='unique_substitution'),
+        ),
+        migrations.AddConstraint(
+            model_name='correction',
+            constraint=models.UniqueConstraint(fields=('kind', 'lastfm_name', 'discogs_name'), name='unique_correction'),
+        ),
+        migrations.RunPython(seed_corrections, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inasilentway', '0012_corrections'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkSuggestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('artist_key', models.CharField(max_length=255)),
+                ('album_key', models.CharField(max_length=255)),
+                ('title_key', models.CharField(max_length=255)),
+                ('artist', models.CharField(max_length=200)),
+                ('album', models.CharField(max_length=200)),
+                ('title', models.CharField(max_length=200)),
+                ('score', models.FloatField()),
+                ('scrobbles', models.IntegerField(default=0)),
+                ('isw_artist', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inasilentway.Artist')),
+                ('isw_track', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inasilentway.Track')),
+            ],
+            options={
+                'ordering': ['-scrobbles', '-score', 'id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='linksuggestion',
+            constraint=models.UniqueConstraint(fields=('artist_key', 'album_key', 'title_key'), name='unique_link_suggestion'),
+        ),
+    ]
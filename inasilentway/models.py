@@ -4,10 +4,15 @@ Models for inasilentway
 import datetime
 
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 
+from inasilentway import caching
+from inasilentway.utils import MATCH_KEY_LENGTH, artist_key, match_key
+
 
 class Genre(models.Model):
     """
@@ -35,17 +40,40 @@ class Artist(models.Model):
     """
     An Artist
     """
-    discogs_id = models.CharField(max_length=200)
-    name       = models.CharField(max_length=200)
+    discogs_id = models.CharField(
+        max_length=200, unique=True, blank=True, null=True
+    )
+    name       = models.CharField(max_length=200, db_index=True)
     images     = models.TextField(blank=True, null=True)
     url        = models.URLField(blank=True, null=True)
     # What are these?
     profile    = models.TextField(blank=True, null=True)
     urls       = models.TextField(blank=True, null=True)
 
+    # utils.artist_key(name), which we match scrobbles on
+    name_key   = models.CharField(
+        max_length=MATCH_KEY_LENGTH, blank=True, default='', db_index=True
+    )
+
+    # Denormalised from our scrobbles by rollups.refresh_play_stats()
+    play_count   = models.IntegerField(default=0, db_index=True)
+    first_played = models.DateTimeField(blank=True, null=True)
+    last_played  = models.DateTimeField(blank=True, null=True, db_index=True)
+
     def __str__(self):
         return "{}: {}".format(self.id, self.name)
 
+    def set_match_keys(self):
+        """
+        Fill in our match keys. Call this before bulk_create() or
+        bulk_update(), which don't call save().
+        """
+        self.name_key = artist_key(self.name)
+
+    def save(self, *args, **kwargs):
+        self.set_match_keys()
+        return super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('artist', args=[self.id, slugify(self.name)])
 
@@ -81,7 +109,9 @@ class Label(models.Model):
     """
     A record label
     """
-    discogs_id = models.CharField(max_length=200)
+    discogs_id = models.CharField(
+        max_length=200, unique=True, blank=True, null=True
+    )
     name       = models.CharField(max_length=200)
 
     def get_absolute_url(self):
@@ -92,7 +122,9 @@ class Record(models.Model):
     """
     An individual record
     """
-    discogs_id = models.CharField(max_length=200)
+    discogs_id = models.CharField(
+        max_length=200, unique=True, blank=True, null=True
+    )
     artist  = models.ManyToManyField(Artist)
     genres  = models.ManyToManyField(Genre)
     styles  = models.ManyToManyField(Style)
@@ -100,7 +132,9 @@ class Record(models.Model):
     label   = models.ForeignKey(
         Label, on_delete=models.CASCADE, blank=True, null=True
     )
-    title   = models.CharField(max_length=200, blank=True, null=True)
+    title   = models.CharField(
+        max_length=200, blank=True, null=True, db_index=True
+    )
     year    = models.CharField(max_length=200, blank=True, null=True)
     thumb   = models.CharField(max_length=200, blank=True, null=True)
     images  = models.TextField(blank=True, null=True)
@@ -112,9 +146,26 @@ class Record(models.Model):
     status  = models.CharField(max_length=200, blank=True, null=True)
     added   = models.DateField(blank=True, null=True)
 
+    # utils.match_key(title), which we match scrobbles on
+    title_key = models.CharField(
+        max_length=MATCH_KEY_LENGTH, blank=True, default='', db_index=True
+    )
+
+    # Denormalised from our scrobbles by rollups.refresh_play_stats()
+    play_count   = models.IntegerField(default=0, db_index=True)
+    first_played = models.DateTimeField(blank=True, null=True)
+    last_played  = models.DateTimeField(blank=True, null=True, db_index=True)
+
     def __str__(self):
         return "{}: {}".format(self.id, self.title)
 
+    def set_match_keys(self):
+        self.title_key = match_key(self.title)
+
+    def save(self, *args, **kwargs):
+        self.set_match_keys()
+        return super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         return reverse('record', args=[self.id, slugify(self.title)])
 
@@ -122,6 +173,34 @@ class Record(models.Model):
         return self.scrobble_set.order_by('timestamp').last()
 
 
+class CollectionSync(models.Model):
+    """
+    A sync of our Discogs collection.
+
+    We remember the date_added of the newest release we have seen so
+    that the next sync can stop as soon as it reaches it.
+    """
+    started         = models.DateTimeField(auto_now_add=True)
+    finished        = models.DateTimeField(blank=True, null=True)
+    high_water_mark = models.DateTimeField(blank=True, null=True)
+    added           = models.IntegerField(default=0)
+    removed         = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "{}: {}".format(self.id, self.high_water_mark)
+
+    @classmethod
+    def last_high_water_mark(klass):
+        """
+        Return the high water mark of the last finished sync, or None
+        """
+        last = klass.objects.filter(
+            finished__isnull=False
+        ).order_by('-finished').first()
+        if last:
+            return last.high_water_mark
+
+
 class Track(models.Model):
     """
     A track on a record
@@ -131,9 +210,21 @@ class Track(models.Model):
     position = models.CharField(max_length=200)
     title    = models.CharField(max_length=200)
 
+    # utils.match_key(title), which we match scrobbles on
+    title_key = models.CharField(
+        max_length=MATCH_KEY_LENGTH, blank=True, default='', db_index=True
+    )
+
     def __str__(self):
         return "{}: {}".format(self.id, self.title)
 
+    def set_match_keys(self):
+        self.title_key = match_key(self.title)
+
+    def save(self, *args, **kwargs):
+        self.set_match_keys()
+        return super().save(*args, **kwargs)
+
 
 class Scrobble(models.Model):
     """
@@ -160,12 +251,60 @@ class Scrobble(models.Model):
         on_delete=models.DO_NOTHING
     )
 
+    # utils.match_key() of the fields above, which we match on
+    artist_key = models.CharField(
+        max_length=MATCH_KEY_LENGTH, blank=True, default=''
+    )
+    album_key  = models.CharField(
+        max_length=MATCH_KEY_LENGTH, blank=True, default=''
+    )
+    title_key  = models.CharField(
+        max_length=MATCH_KEY_LENGTH, blank=True, default=''
+    )
+
+    class Meta:
+        constraints = [
+            # A scrobble is identified by when we listened to what
+            models.UniqueConstraint(
+                fields=['timestamp', 'title'], name='unique_scrobble'
+            ),
+        ]
+        indexes = [
+            # For keyset pagination of scrobble lists (see pagination.py)
+            # and the timestamp range filters on the history pages
+            models.Index(
+                fields=['timestamp', 'id'], name='scrobble_timestamp_id'
+            ),
+            models.Index(
+                fields=['timestamp', 'id'], name='unlinked_timestamp_id',
+                condition=models.Q(isw_track__isnull=True)
+            ),
+            # For grouping and joining scrobbles on what was played
+            models.Index(
+                fields=['artist_key', 'album_key', 'title_key'],
+                name='scrobble_match_keys'
+            ),
+        ]
+
     def __str__(self):
         return "{}: {} {} {} {}".format(
             self.id, self.artist, self.title, self.album,
             self.ts_as_str()
         )
 
+    def set_match_keys(self):
+        """
+        Fill in our match keys. Call this before bulk_create() or
+        bulk_update(), which don't call save().
+        """
+        self.artist_key = artist_key(self.artist)
+        self.album_key  = match_key(self.album)
+        self.title_key  = match_key(self.title)
+
+    def save(self, *args, **kwargs):
+        self.set_match_keys()
+        return super().save(*args, **kwargs)
+
     def ts_as_dt(self):
         return timezone.make_aware(
             datetime.datetime.fromtimestamp(self.timestamp)
@@ -173,3 +312,362 @@ class Scrobble(models.Model):
 
     def ts_as_str(self):
         return self.ts_as_dt().strftime('%d %b %y %H:%M')
+
+
+class HistoryWindow(models.Model):
+    """
+    A window of time in our Last.fm history that we are importing
+    (see lastfm.import_history).
+
+    We walk back through the window a page at a time from END to FLOOR,
+    saving our CURSOR as we go, so an import can stop at any point and
+    pick up where it left off. FLOOR is START unless we are catching up
+    on scrobbles since SYNCED, the time up to which a finished window
+    was complete.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE    = 'done'
+    FAILED  = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Timestamps - START is inclusive, END exclusive
+    start     = models.IntegerField()
+    end       = models.IntegerField()
+    # The timestamp we fetch the next page back from, and back to
+    cursor    = models.IntegerField()
+    floor     = models.IntegerField(default=0)
+    # Once we reach FLOOR we have everything from START to here
+    synced    = models.IntegerField(default=0)
+    status    = models.CharField(
+        max_length=20, choices=STATUSES, default=PENDING, db_index=True
+    )
+    pages     = models.IntegerField(default=0)
+    scrobbles = models.IntegerField(default=0)
+    error     = models.TextField(blank=True, null=True)
+    updated   = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['start', 'end'], name='unique_history_window'
+            ),
+        ]
+
+    def __str__(self):
+        return "{}: {}-{} {}".format(
+            self.id, self.start, self.end, self.status
+        )
+
+
+class DailyScrobbleCount(models.Model):
+    """
+    A pre-aggregated count of scrobbles per day, artist and record.
+
+    Kept up to date by lastfm.save_scrobbles() and rebuilt from scratch
+    with the rebuild_rollups management command.
+    """
+    day        = models.DateField(db_index=True)
+    artist     = models.CharField(max_length=200)
+    isw_artist = models.ForeignKey(
+        Artist, blank=True, null=True,
+        on_delete=models.SET_NULL
+    )
+    isw_album  = models.ForeignKey(
+        Record, blank=True, null=True,
+        on_delete=models.SET_NULL
+    )
+    count      = models.IntegerField(default=0)
+
+    def __str__(self):
+        return "{}: {} {} {}".format(
+            self.id, self.day, self.artist, self.count
+        )
+
+
+class SearchDocument(models.Model):
+    """
+    The searchable text of a Record, denormalised into one row.
+
+    This is the content table for our full text index (see search.py).
+    """
+    record  = models.OneToOneField(
+        Record, on_delete=models.CASCADE, related_name='search_document'
+    )
+    title   = models.TextField(blank=True, default='')
+    artists = models.TextField(blank=True, default='')
+    tracks  = models.TextField(blank=True, default='')
+    labels  = models.TextField(blank=True, default='')
+    genres  = models.TextField(blank=True, default='')
+    styles  = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return "{}: {}".format(self.id, self.title)
+
+
+class Generation(models.Model):
+    """
+    The generation counter of a caching namespace (see caching.py).
+
+    These live in the database rather than the cache so that every
+    process - web and worker - sees a bump as soon as it is committed,
+    whichever cache backend is configured.
+    """
+    namespace = models.CharField(max_length=50, unique=True)
+    value     = models.BigIntegerField()
+
+    def __str__(self):
+        return "{}: {}".format(self.namespace, self.value)
+
+
+class Job(models.Model):
+    """
+    A piece of slow work (e.g. syncing with Discogs) for the worker
+    management command to run outside of a web request.
+
+    See jobs.py
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE    = 'done'
+    FAILED  = 'failed'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+    ACTIVE = [PENDING, RUNNING]
+
+    name       = models.CharField(max_length=200)
+    arguments  = models.TextField(default='{}')
+    # Only one active job may have a given key
+    dedupe_key = models.CharField(max_length=200)
+    status     = models.CharField(
+        max_length=20, choices=STATUSES, default=PENDING, db_index=True
+    )
+    progress   = models.CharField(max_length=200, blank=True, default='')
+    error      = models.TextField(blank=True, null=True)
+    created    = models.DateTimeField(auto_now_add=True)
+    started    = models.DateTimeField(blank=True, null=True)
+    finished   = models.DateTimeField(blank=True, null=True)
+    heartbeat  = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'], name='unique_active_job',
+                condition=models.Q(status__in=['pending', 'running'])
+            ),
+        ]
+
+    def __str__(self):
+        return "{}: {} {}".format(self.id, self.name, self.status)
+
+    def get_absolute_url(self):
+        return reverse('job', args=[self.id])
+
+    def is_active(self):
+        return self.status in self.ACTIVE
+
+    def report(self, progress):
+        """
+        Record PROGRESS (a short message) for this job
+        """
+        print(progress)
+        self.progress  = str(progress)[:200]
+        self.heartbeat = timezone.now()
+        Job.objects.filter(id=self.id).update(
+            progress=self.progress, heartbeat=self.heartbeat
+        )
+
+
+"""
+Hand maintained corrections for talking to Last.fm.
+
+These are compiled into lookups by corrections.py, which are cached
+until one of them changes.
+"""
+
+
+class Correction(models.Model):
+    """
+    A name Last.fm uses for an album or artist, and the name Discogs
+    uses for it.
+
+    Last.fm names can have several Discogs alternatives (e.g. the same
+    artist leading different groups), which we try in order.
+    """
+    ALBUM  = 'album'
+    ARTIST = 'artist'
+    KINDS  = [
+        (ALBUM, 'Album'),
+        (ARTIST, 'Artist'),
+    ]
+
+    kind         = models.CharField(max_length=10, choices=KINDS)
+    lastfm_name  = models.CharField(max_length=200)
+    discogs_name = models.CharField(max_length=200)
+    note         = models.CharField(max_length=200, blank=True, default='')
+
+    class Meta:
+        ordering = ['kind', 'lastfm_name', 'id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'lastfm_name', 'discogs_name'],
+                name='unique_correction'
+            ),
+        ]
+
+    def __str__(self):
+        return "{}: {} -> {}".format(
+            self.kind, self.lastfm_name, self.discogs_name
+        )
+
+
+class Substitution(models.Model):
+    """
+    A value we replace before scrobbling, because the Last.fm scrobble
+    API throws the original away.
+
+    Scrobbles we get back with the substitute are matched to the
+    original.
+    """
+    ALBUM  = 'album'
+    ARTIST = 'artist'
+    TITLE  = 'title'
+    KINDS  = [
+        (ALBUM, 'Album'),
+        (ARTIST, 'Artist'),
+        (TITLE, 'Title'),
+    ]
+
+    kind       = models.CharField(max_length=10, choices=KINDS)
+    original   = models.CharField(max_length=200)
+    substitute = models.CharField(max_length=200)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'original'], name='unique_substitution'
+            ),
+        ]
+
+    def __str__(self):
+        return "{}: {} -> {}".format(self.kind, self.original, self.substitute)
+
+
+class TrackFilter(models.Model):
+    """
+    Tracks of a record to leave out when we scrobble it, e.g. a bonus
+    CD, or a 'track' for the title of a side.
+
+    CRITERIA is a JSON object of Track queryset lookups passed to
+    METHOD, e.g. {"position__startswith": "CD"}
+    """
+    EXCLUDE = 'exclude'
+    FILTER  = 'filter'
+    METHODS = [
+        (EXCLUDE, 'Exclude'),
+        (FILTER, 'Filter'),
+    ]
+
+    record_title = models.CharField(max_length=200)
+    artist_name  = models.CharField(max_length=200)
+    method       = models.CharField(
+        max_length=10, choices=METHODS, default=EXCLUDE
+    )
+    criteria     = models.TextField(default='{}')
+
+    class Meta:
+        ordering = ['record_title', 'artist_name', 'id']
+
+    def __str__(self):
+        return "{}:{} {} {}".format(
+            self.record_title, self.artist_name, self.method, self.criteria
+        )
+
+
+class ArtistChoice(models.Model):
+    """
+    Which of the artists of a record we scrobble it as.
+
+    e.g. Discogs lists Earl Hines as the first artist on The Louis
+    Armstrong Story vol 3.
+    """
+    record_title = models.CharField(max_length=200, unique=True)
+    artist_name  = models.CharField(max_length=200)
+
+    def __str__(self):
+        return "{}: {}".format(self.record_title, self.artist_name)
+
+
+class LinkSuggestion(models.Model):
+    """
+    A track in our collection that the unlinked scrobbles with these
+    match keys might be, that fuzzy.link() wasn't confident enough to
+    link them to by itself.
+
+    ARTIST, ALBUM and TITLE are as scrobbled, for display.
+    """
+    artist_key = models.CharField(max_length=MATCH_KEY_LENGTH)
+    album_key  = models.CharField(max_length=MATCH_KEY_LENGTH)
+    title_key  = models.CharField(max_length=MATCH_KEY_LENGTH)
+    artist     = models.CharField(max_length=200)
+    album      = models.CharField(max_length=200)
+    title      = models.CharField(max_length=200)
+
+    isw_artist = models.ForeignKey(Artist, on_delete=models.CASCADE)
+    isw_track  = models.ForeignKey(Track, on_delete=models.CASCADE)
+    score      = models.FloatField()
+    scrobbles  = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-scrobbles', '-score', 'id']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['artist_key', 'album_key', 'title_key'],
+                name='unique_link_suggestion'
+            ),
+        ]
+
+    def __str__(self):
+        return "{} - {} ({}) -> {}".format(
+            self.artist, self.title, self.album, self.isw_track
+        )
+
+    @property
+    def keys(self):
+        return self.artist_key, self.album_key, self.title_key
+
+
+CORRECTION_MODELS = (Correction, Substitution, TrackFilter, ArtistChoice)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def corrections_changed(sender, **kwargs):
+    """
+    Make every process recompile its corrections when one changes
+    """
+    if sender in CORRECTION_MODELS:
+        caching.bump(caching.CORRECTIONS)
+
+
+COLLECTION_MODELS = (Artist, Record, Track)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def collection_changed(sender, **kwargs):
+    """
+    Make every process rebuild its matchers when an artist, record or
+    track is added, renamed or removed
+    """
+    if sender in COLLECTION_MODELS:
+        caching.bump(caching.COLLECTION)
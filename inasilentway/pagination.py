@@ -0,0 +1,122 @@
+"""
+Cursor based pagination for long lists of scrobbles.
+
+Rather than OFFSET into the scrobble table we remember the
+(timestamp, id) of the first and last scrobble on a page and seek
+past them, so every page costs the same however deep it is.
+"""
+from django.core.cache import cache
+
+from inasilentway import caching
+
+# How long we trust a cached total before counting again
+TOTAL_CACHE_SECONDS = 60 * 5
+
+
+class InvalidCursor(ValueError):
+    """
+    Raised when we are passed a cursor we cannot parse
+    """
+
+
+class KeysetPage(object):
+    """
+    One page of results from keyset_page().
+
+    Quacks enough like a Django Page for our templates.
+    """
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list     = object_list
+        self.next_cursor     = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def make_cursor(scrobble):
+    """
+    Return the cursor that points at SCROBBLE
+    """
+    return '{}.{}'.format(scrobble.timestamp, scrobble.id)
+
+
+def parse_cursor(cursor):
+    """
+    Given a CURSOR string, return a (timestamp, id) tuple
+    """
+    try:
+        timestamp, pk = cursor.split('.')
+        return int(timestamp), int(pk)
+    except ValueError:
+        raise InvalidCursor('Invalid cursor {}'.format(cursor))
+
+
+def keyset_page(queryset, page_size, after=None, before=None):
+    """
+    Return a KeysetPage of PAGE_SIZE scrobbles from QUERYSET, newest
+    first.
+
+    If AFTER is passed, return the scrobbles that come after (are older
+    than) that cursor. If BEFORE is passed, return those that come
+    before it.
+
+    Scrobbles without a timestamp are not included.
+    """
+    queryset = queryset.filter(timestamp__isnull=False)
+
+    if before is not None:
+        timestamp, pk = parse_cursor(before)
+        newer = queryset.filter(timestamp__gte=timestamp).exclude(
+            timestamp=timestamp, id__lte=pk
+        ).order_by('timestamp', 'id')
+        rows = list(newer[:page_size + 1])
+        if rows:
+            has_previous = len(rows) > page_size
+            rows = list(reversed(rows[:page_size]))
+            return KeysetPage(
+                rows,
+                next_cursor=make_cursor(rows[-1]),
+                previous_cursor=make_cursor(rows[0]) if has_previous else None
+            )
+        # Nothing is newer than the cursor, so show the first page
+        after = None
+
+    if after is not None:
+        timestamp, pk = parse_cursor(after)
+        queryset = queryset.filter(timestamp__lte=timestamp).exclude(
+            timestamp=timestamp, id__gte=pk
+        )
+
+    rows = list(queryset.order_by('-timestamp', '-id')[:page_size + 1])
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    has_previous = after is not None and bool(rows)
+    return KeysetPage(
+        rows,
+        next_cursor=make_cursor(rows[-1]) if has_next else None,
+        previous_cursor=make_cursor(rows[0]) if has_previous else None
+    )
+
+
+def cached_count(key, queryset):
+    """
+    Return the number of rows in QUERYSET, counting at most once every
+    TOTAL_CACHE_SECONDS or whenever we load new scrobbles.
+    """
+    return cache.get_or_set(
+        caching.make_key([caching.SCROBBLES], 'count', key),
+        queryset.count, TOTAL_CACHE_SECONDS
+    )
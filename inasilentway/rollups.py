@@ -0,0 +1,207 @@
+"""
+Pre-aggregated listening data for Inasilentway
+"""
+import collections
+import datetime
+import time
+
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+
+from inasilentway.models import Artist, DailyScrobbleCount, Record, Scrobble
+
+# How many days to recompute per query when refreshing the rollup
+DAYS_PER_QUERY = 100
+
+# How many records or artists to recompute play stats for per query
+IDS_PER_QUERY = 500
+
+
+def scrobble_day(timestamp):
+    """
+    Given the TIMESTAMP of a scrobble, return the date it was played on
+    """
+    return datetime.date.fromtimestamp(timestamp)
+
+
+def day_start(day):
+    """
+    Return the timestamp of the start of DAY
+    """
+    return time.mktime(day.timetuple())
+
+
+def count_scrobbles(rows, days=None):
+    """
+    Given an iterable of (timestamp, artist, isw_artist_id, isw_album_id)
+    rows, return unsaved DailyScrobbleCounts for them.
+
+    If DAYS is passed, ignore rows that were not played on one of them.
+    """
+    counts = collections.Counter()
+    for timestamp, artist, artist_id, album_id in rows:
+        if timestamp is None:
+            continue
+        day = scrobble_day(timestamp)
+        if days is not None and day not in days:
+            continue
+        counts[(day, artist, artist_id, album_id)] += 1
+
+    return [
+        DailyScrobbleCount(
+            day=day, artist=artist, isw_artist_id=artist_id,
+            isw_album_id=album_id, count=count
+        )
+        for (day, artist, artist_id, album_id), count in counts.items()
+    ]
+
+
+def _rollup_fields(queryset):
+    return queryset.values_list(
+        'timestamp', 'artist', 'isw_artist_id', 'isw_album_id'
+    )
+
+
+def day_runs(days):
+    """
+    Given a sorted list of DAYS, return a list of (first, last) for each
+    run of consecutive days in it.
+    """
+    runs = []
+    for day in days:
+        if runs and day - runs[-1][1] == datetime.timedelta(days=1):
+            runs[-1] = (runs[-1][0], day)
+        else:
+            runs.append((day, day))
+    return runs
+
+
+def refresh_days(days):
+    """
+    Recompute the rollup for an iterable of DAYS from our scrobbles.
+
+    We only read the scrobbles played on DAYS, so refreshing a handful
+    of days years apart doesn't scan everything in between.
+    """
+    days = sorted(set(days))
+
+    with transaction.atomic():
+        for i in range(0, len(days), DAYS_PER_QUERY):
+            chunk = days[i:i + DAYS_PER_QUERY]
+            DailyScrobbleCount.objects.filter(day__in=chunk).delete()
+
+            played = Q()
+            for first, last in day_runs(chunk):
+                played |= Q(
+                    timestamp__gte=day_start(first),
+                    timestamp__lt=day_start(last + datetime.timedelta(days=1))
+                )
+            scrobbles = Scrobble.objects.filter(played)
+            DailyScrobbleCount.objects.bulk_create(
+                count_scrobbles(_rollup_fields(scrobbles), days=set(chunk))
+            )
+
+
+def linked_ids(scrobbles):
+    """
+    Return a tuple of the (record ids, artist ids) that an iterable of
+    SCROBBLES are linked to.
+    """
+    records, artists = set(), set()
+    for scrobble in scrobbles:
+        records.add(scrobble.isw_album_id)
+        artists.add(scrobble.isw_artist_id)
+    return records - {None}, artists - {None}
+
+
+def as_datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+def refresh_play_stats(records=(), artists=()):
+    """
+    Recompute play_count, first_played and last_played for the Record
+    and Artist ids in RECORDS and ARTISTS from our scrobbles.
+    """
+    targets = [
+        (Record, 'isw_album', sorted(set(records))),
+        (Artist, 'isw_artist', sorted(set(artists))),
+    ]
+    with transaction.atomic():
+        for model, link, ids in targets:
+            for i in range(0, len(ids), IDS_PER_QUERY):
+                chunk = ids[i:i + IDS_PER_QUERY]
+                plays = Scrobble.objects.filter(
+                    **{'{}__in'.format(link): chunk}
+                ).values(link).annotate(
+                    count=Count('id'),
+                    first=Min('timestamp'),
+                    last=Max('timestamp')
+                )
+                stats = {p[link]: p for p in plays}
+                model.objects.bulk_update(
+                    [
+                        model(
+                            id=pk,
+                            play_count=stats.get(pk, {}).get('count', 0),
+                            first_played=as_datetime(
+                                stats.get(pk, {}).get('first')
+                            ),
+                            last_played=as_datetime(
+                                stats.get(pk, {}).get('last')
+                            )
+                        )
+                        for pk in chunk
+                    ],
+                    ['play_count', 'first_played', 'last_played']
+                )
+
+
+def refresh_scrobbles(scrobbles, previous=None):
+    """
+    Recompute the rollup for the days an iterable of SCROBBLES were
+    played on, and the play stats of the records and artists they are
+    linked to.
+
+    If the scrobbles have been relinked, PREVIOUS is the (record ids,
+    artist ids) they used to be linked to, which also need refreshing.
+    """
+    scrobbles = list(scrobbles)
+    refresh_days(
+        scrobble_day(s.timestamp) for s in scrobbles if s.timestamp is not None
+    )
+    records, artists = linked_ids(scrobbles)
+    if previous is not None:
+        records |= set(previous[0])
+        artists |= set(previous[1])
+    refresh_play_stats(records=records, artists=artists)
+
+
+def rebuild():
+    """
+    Rebuild the rollup from scratch
+    """
+    scrobbles = _rollup_fields(Scrobble.objects.all()).iterator(
+        chunk_size=5000
+    )
+
+    with transaction.atomic():
+        DailyScrobbleCount.objects.all().delete()
+        DailyScrobbleCount.objects.bulk_create(
+            count_scrobbles(scrobbles), batch_size=1000
+        )
+
+    return DailyScrobbleCount.objects.count()
+
+
+def rebuild_play_stats():
+    """
+    Recompute the play stats of every record and artist
+    """
+    refresh_play_stats(
+        records=Record.objects.values_list('id', flat=True),
+        artists=Artist.objects.values_list('id', flat=True)
+    )
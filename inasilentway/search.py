@@ -0,0 +1,205 @@
+"""
+Full text search over the records in our collection.
+
+Each Record has a SearchDocument holding its title, artists, tracks,
+labels, genres and styles as plain text. On SQLite an FTS5 table
+(kept in sync with those documents by triggers) indexes them, on
+Postgres we use GIN indexes over tsvector expressions. Both are
+created in migration 0005_searchdocument.
+"""
+import re
+
+from django.db import connection
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from inasilentway.models import Record, SearchDocument
+
+FIELDS = ['title', 'artists', 'tracks', 'labels', 'genres', 'styles']
+
+SQLITE_TABLE = 'inasilentway_searchindex'
+RECORD_TABLE = '"{}"'.format(Record._meta.db_table)
+
+# Weights for bm25() in the order of FIELDS - a hit in the title or
+# artist counts for more than one somewhere in the tracklist
+SQLITE_WEIGHTS = (10.0, 10.0, 1.0, 2.0, 2.0, 2.0)
+
+# These must match the index expressions in the migration exactly or
+# Postgres won't use the indexes
+POSTGRES_DOCUMENT = (
+    "(setweight(to_tsvector('simple', title), 'A') || "
+    "setweight(to_tsvector('simple', artists), 'A') || "
+    "setweight(to_tsvector("
+    "'simple', labels || ' ' || genres || ' ' || styles), 'B') || "
+    "setweight(to_tsvector('simple', tracks), 'C'))"
+)
+POSTGRES_TRACKS = "to_tsvector('simple', tracks)"
+
+
+def document_fields(record):
+    """
+    Return the text we index for RECORD as a dict of SearchDocument
+    fields.
+    """
+    def lines(names):
+        return '\n'.join(n for n in names if n)
+
+    return dict(
+        title=record.title or '',
+        artists=lines(record.artist.values_list('name', flat=True)),
+        tracks=lines(record.track_set.values_list('title', flat=True)),
+        labels=record.label.name if record.label else '',
+        genres=lines(record.genres.values_list('name', flat=True)),
+        styles=lines(record.styles.values_list('name', flat=True)),
+    )
+
+
+def index_record(record):
+    """
+    Create or update the search document for RECORD
+    """
+    document, _ = SearchDocument.objects.update_or_create(
+        record=record, defaults=document_fields(record)
+    )
+    return document
+
+
+def index_all():
+    """
+    (Re)index every record in the collection.
+
+    Return the number of records indexed.
+    """
+    records = Record.objects.select_related('label')
+    count = 0
+    for record in records.iterator():
+        index_record(record)
+        count += 1
+    return count
+
+
+def terms(query):
+    """
+    Split the user's QUERY into lowercase words
+    """
+    return re.findall(r'\w+', query.lower())
+
+
+def sqlite_match(words, field=None):
+    """
+    Return an FTS5 MATCH expression finding documents containing all
+    of WORDS (as prefixes), optionally only within FIELD.
+    """
+    match = ' AND '.join('"{}"*'.format(w) for w in words)
+    if field is not None:
+        match = '{} : ({})'.format(field, match)
+    return match
+
+
+def postgres_tsquery(words):
+    """
+    Return a to_tsquery() string finding documents containing all of
+    WORDS (as prefixes).
+    """
+    return ' & '.join('{}:*'.format(w) for w in words)
+
+
+def matching_records(sql, params):
+    """
+    Return a queryset of the records whose ids SQL selects
+    """
+    # (Not filter(id__in=RawSQL()), which Django 2.2 makes a scalar
+    # subquery)
+    return Record.objects.extra(
+        where=['{}.id IN ({})'.format(RECORD_TABLE, sql)], params=params
+    )
+
+
+def _sqlite_search(words, field):
+    match = sqlite_match(words, field=field)
+    matching = """
+    SELECT doc.record_id
+    FROM {table}
+    JOIN inasilentway_searchdocument doc ON doc.id = {table}.rowid
+    WHERE {table} MATCH %s
+    """
+    rank = """
+    SELECT bm25({table}, {weights})
+    FROM {table}
+    WHERE {table} MATCH %s AND {table}.rowid = (
+        SELECT doc.id FROM inasilentway_searchdocument doc
+        WHERE doc.record_id = {record}.id
+    )
+    """
+    tables = dict(
+        table=SQLITE_TABLE, record=RECORD_TABLE,
+        weights=', '.join(str(w) for w in SQLITE_WEIGHTS)
+    )
+    return (
+        matching_records(matching.format(**tables), [match]),
+        RawSQL(rank.format(**tables), [match])
+    )
+
+
+def _postgres_search(words, field):
+    tsquery = postgres_tsquery(words)
+    document = POSTGRES_TRACKS if field == 'tracks' else POSTGRES_DOCUMENT
+    matching = """
+    SELECT record_id
+    FROM inasilentway_searchdocument
+    WHERE {document} @@ to_tsquery('simple', %s)
+    """
+    # Best first, as we order by rank ascending
+    rank = """
+    SELECT -ts_rank({document}, to_tsquery('simple', %s))
+    FROM inasilentway_searchdocument doc
+    WHERE doc.record_id = {record}.id
+    """
+    tables = dict(document=document, record=RECORD_TABLE)
+    return (
+        matching_records(matching.format(**tables), [tsquery]),
+        RawSQL(rank.format(**tables), [tsquery])
+    )
+
+
+def _unindexed_search(words, field):
+    """
+    For databases we have no index for, fall back to LIKE over the
+    search documents. Results are not ranked.
+    """
+    fields = [field] if field else FIELDS
+    documents = SearchDocument.objects.all()
+    for word in words:
+        match = Q()
+        for name in fields:
+            match |= Q(**{'{}__icontains'.format(name): word})
+        documents = documents.filter(match)
+    return (
+        Record.objects.filter(id__in=documents.values('record_id')),
+        Value(0, output_field=FloatField())
+    )
+
+
+def search(query, field=None):
+    """
+    Return a queryset of records matching QUERY ordered by rank.
+
+    If FIELD is passed (e.g. 'tracks') only search that field.
+
+    Matching and ranking both happen in the query, so it can be
+    counted and paginated like any other.
+    """
+    words = terms(query)
+    if not words:
+        return Record.objects.none()
+    if field is not None and field not in FIELDS:
+        raise ValueError('Unknown search field {}'.format(field))
+
+    if connection.vendor == 'sqlite':
+        records, rank = _sqlite_search(words, field)
+    elif connection.vendor == 'postgresql':
+        records, rank = _postgres_search(words, field)
+    else:
+        records, rank = _unindexed_search(words, field)
+
+    return records.annotate(search_rank=rank).order_by('search_rank', 'id')
@@ -107,6 +107,31 @@ if 'RDS_HOSTNAME' in os.environ:
         'PORT': os.environ['RDS_PORT']
     }
 
+# Caches
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+#
+# Local memory is per process. That is fine for correctness, because the
+# generations that invalidate cached values live in the database (see
+# caching.py), but a shared cache such as memcached or the database
+# cache (CACHE_BACKEND/CACHE_LOCATION, or CACHES in local_settings)
+# lets the web and worker processes share the cached values as well.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'inasilentway'),
+    }
+}
+
+# Raw Discogs API responses for releases, artists and labels are kept
+# here and replayed for DISCOGS_CACHE_TTL seconds before we ask Discogs
+# whether they have changed. Set DISCOGS_CACHE_DIR to '' to turn this off.
+DISCOGS_CACHE_DIR = os.environ.get(
+    'DISCOGS_CACHE_DIR', os.path.join(BASE_DIR, '.discogs-cache')
+)
+DISCOGS_CACHE_TTL = int(os.environ.get('DISCOGS_CACHE_TTL', 60 * 60 * 24 * 7))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
@@ -13,9 +13,12 @@ def this_url_replace(context, **kwargs):
     """
     Return the current path, replacing any GET
     params passed in with KWARGS
+
+    Params passed as None are removed.
     """
     query = context['request'].GET.dict()
     query.update(kwargs)
+    query = {k: v for k, v in query.items() if v is not None}
     return '{}?{}'.format(
         context['view'].request.META['PATH_INFO'],
         urlencode(query)
@@ -0,0 +1,69 @@
+"""
+Unittests for inasilentway.caching
+"""
+from django.core.cache import cache
+from django.db.models import F
+from django.test import TestCase
+
+from inasilentway import caching, models
+
+
+class View(object):
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.calls = 0
+
+    @caching.cached(caching.SCROBBLES)
+    def get_total(self, extra=0):
+        self.calls += 1
+        return self.kwargs.get('year', 0) + extra
+
+
+class CachedTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_caches_until_bumped(self):
+        view = View(year=2020)
+        self.assertEqual(2020, view.get_total())
+        self.assertEqual(2020, view.get_total())
+        self.assertEqual(1, view.calls)
+
+        caching.bump(caching.SCROBBLES)
+        self.assertEqual(2020, view.get_total())
+        self.assertEqual(2, view.calls)
+
+    def test_other_namespaces_are_not_invalidated(self):
+        view = View()
+        view.get_total()
+        caching.bump(caching.COLLECTION)
+        view.get_total()
+        self.assertEqual(1, view.calls)
+
+    def test_keyed_on_arguments_and_view_kwargs(self):
+        self.assertEqual(2020, View(year=2020).get_total())
+        self.assertEqual(2019, View(year=2019).get_total())
+        self.assertEqual(2021, View(year=2019).get_total(extra=2))
+
+    def test_generations_outlive_the_cache(self):
+        before = caching.generation(caching.SCROBBLES)
+        cache.clear()
+        self.assertEqual(before, caching.generation(caching.SCROBBLES))
+
+    def test_sees_bumps_from_other_processes(self):
+        view = View()
+        view.get_total()
+        # As the worker would bump it, without touching our cache
+        models.Generation.objects.filter(
+            namespace=caching.SCROBBLES
+        ).update(value=F('value') + 1)
+        view.get_total()
+        self.assertEqual(2, view.calls)
+
+    def test_bump_creates_missing_counters(self):
+        caching.bump(caching.COLLECTION)
+        self.assertTrue(models.Generation.objects.filter(
+            namespace=caching.COLLECTION
+        ).exists())
@@ -0,0 +1,83 @@
+"""
+Unittests for inasilentway.corrections
+"""
+from django.db.models import F
+from django.test import TestCase
+
+from inasilentway import caching, corrections, lastfm, linking, models
+
+
+class LookupsTestCase(TestCase):
+
+    def test_seeded_with_every_alternative(self):
+        lookups = corrections.get_lookups()
+        self.assertEqual(
+            ['the thelonious monk orchestra', 'thelonious monk septet'],
+            lookups.corrections['artist']['thelonious monk']
+        )
+        original = "Getz & J.J. 'Live' - Stan Getz & J.J. Johnson"
+        self.assertEqual(
+            "Getz & J.J. 'Live'", lookups.substitutions['album'][original]
+        )
+
+    def test_recompiled_when_edited(self):
+        before = corrections.get_lookups()
+        self.assertIs(before, corrections.get_lookups())
+
+        models.Correction.objects.create(
+            kind=models.Correction.ALBUM, lastfm_name='Kind of Blue (Legacy)',
+            discogs_name='Kind Of Blue'
+        )
+
+        after = corrections.get_lookups()
+        self.assertIsNot(before, after)
+        self.assertEqual(
+            'kind of blue', after.corrections['album']['kind of blue legacy']
+        )
+
+    def test_recompiled_when_edited_by_another_process(self):
+        before = corrections.get_lookups()
+        signature = lastfm.CollectionMatcher.collection_signature()
+
+        # Another process saves a correction, which bumps the database
+        # generation but not anything in our memory
+        models.Correction.objects.bulk_create([models.Correction(
+            kind=models.Correction.ARTIST, lastfm_name='Bird',
+            discogs_name='Charlie Parker'
+        )])
+        models.Generation.objects.filter(
+            namespace=caching.CORRECTIONS
+        ).update(value=F('value') + 1)
+
+        after = corrections.get_lookups()
+        self.assertIsNot(before, after)
+        self.assertEqual(
+            ['charlie parker'], after.corrections['artist']['bird']
+        )
+        self.assertNotEqual(
+            signature, lastfm.CollectionMatcher.collection_signature()
+        )
+
+    def test_artist_alternatives(self):
+        lastfm._matcher = None
+        septet = models.Artist.objects.create(
+            discogs_id=1, name='Thelonious Monk Septet'
+        )
+        record = models.Record.objects.create(
+            discogs_id=1, title='Monk\'s Music'
+        )
+        record.artist.add(septet)
+        track = models.Track.objects.create(record=record, title='Epistrophy')
+        scrobble = models.Scrobble.objects.create(
+            artist='Thelonious Monk', album="Monk's Music", title='Epistrophy',
+            timestamp=1500000000
+        )
+
+        self.assertEqual(
+            (septet, record, track),
+            lastfm.get_matcher().match_scrobble(scrobble)
+        )
+
+        linking.relink_in_database(progress=lambda m: None)
+        scrobble.refresh_from_db()
+        self.assertEqual(track.id, scrobble.isw_track_id)
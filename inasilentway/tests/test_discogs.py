@@ -1,10 +1,264 @@
 """
 Unittests for our Discogs functionality
 """
-from django.test import TestCase
+from types import SimpleNamespace
+import shutil
+import tempfile
 
-from inasilentway import discogs
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+import mock
 
+from inasilentway import discogs, models
 
+
+@override_settings(DISCOGS_USER='larry')
 class LoadCollectionTestCase(TestCase):
-    pass
+
+    def collection_item(self, discogs_id, date_added):
+        item = mock.MagicMock(name='Collection item {}'.format(discogs_id))
+        item.release.id = discogs_id
+        item.data = {'date_added': date_added}
+        return item
+
+    def load(self, items, **kwargs):
+        def fetch_release(item):
+            return item.release, 'thumb.jpg', None
+
+        def save(release, added=None, thumb=None):
+            return models.Record.objects.create(
+                discogs_id=release.id, title=str(release.id), thumb=thumb
+            )
+
+        with mock.patch.object(discogs, 'api') as api:
+            releases = api.user.return_value.collection_folders[0].releases
+            releases.sort.return_value = items
+            with mock.patch.object(discogs, 'fetch_release', fetch_release):
+                with mock.patch.object(
+                    discogs, 'save_record_from_discogs_data', side_effect=save
+                ) as saver:
+                    discogs.load_collection(workers=1, **kwargs)
+                    releases.sort.assert_called_with('added', 'desc')
+                    return saver.call_count
+
+    def test_first_load(self):
+        items = [
+            self.collection_item(2, '2020-02-01T10:00:00-08:00'),
+            self.collection_item(1, '2020-01-01T10:00:00-08:00'),
+        ]
+        self.assertEqual(2, self.load(items))
+        self.assertEqual(2, models.Record.objects.count())
+
+    def test_incremental_load_stops_at_high_water_mark(self):
+        self.load([self.collection_item(1, '2020-01-01T10:00:00-08:00')])
+
+        old = mock.MagicMock(name='Already seen')
+        type(old).data = mock.PropertyMock(
+            return_value={'date_added': '2020-01-01T10:00:00-08:00'}
+        )
+        items = [
+            self.collection_item(2, '2020-02-01T10:00:00-08:00'),
+            old,
+            self.collection_item(3, '2019-01-01T10:00:00-08:00'),
+        ]
+
+        self.assertEqual(1, self.load(items))
+        self.assertEqual(
+            {'1', '2'},
+            set(models.Record.objects.values_list('discogs_id', flat=True))
+        )
+
+    def test_prune_removes_missing_records(self):
+        self.load([
+            self.collection_item(2, '2020-02-01T10:00:00-08:00'),
+            self.collection_item(1, '2020-01-01T10:00:00-08:00'),
+        ])
+
+        self.load(
+            [self.collection_item(2, '2020-02-01T10:00:00-08:00')],
+            prune=True
+        )
+
+        self.assertEqual(
+            ['2'],
+            list(models.Record.objects.values_list('discogs_id', flat=True))
+        )
+
+    def test_bounds_releases_in_flight(self):
+        in_flight = []
+
+        def items():
+            for submitted, i in enumerate(range(10, 0, -1)):
+                saved = models.Record.objects.count()
+                in_flight.append(submitted - saved)
+                yield self.collection_item(
+                    i, '2020-01-{:02d}T10:00:00-08:00'.format(i)
+                )
+
+        self.assertEqual(10, self.load(items()))
+        self.assertEqual(discogs.RELEASES_PER_WORKER, max(in_flight))
+
+
+class RateLimiterTestCase(TestCase):
+
+    def test_acquire_takes_a_token(self):
+        limiter = discogs.RateLimiter(rate=60)
+        limiter.acquire()
+        self.assertLess(limiter.tokens, 60)
+
+    def test_update_follows_remaining_header(self):
+        limiter = discogs.RateLimiter(rate=60)
+        limiter.update({
+            'X-Discogs-Ratelimit': '60',
+            'X-Discogs-Ratelimit-Remaining': '3'
+        })
+        self.assertLess(limiter.tokens, 3.1)
+
+    def test_update_never_raises_tokens(self):
+        limiter = discogs.RateLimiter(rate=60)
+        limiter.tokens = 2
+        limiter.update({'X-Discogs-Ratelimit-Remaining': '50'})
+        self.assertLess(limiter.tokens, 3)
+
+    def test_acquire_waits_when_empty(self):
+        limiter = discogs.RateLimiter(rate=60)
+        limiter.tokens = 0
+        with mock.patch.object(discogs.time, 'sleep') as sleep:
+            sleep.side_effect = lambda s: setattr(limiter, 'tokens', 1)
+            limiter.acquire()
+        self.assertTrue(sleep.called)
+
+
+class IsTransientTestCase(TestCase):
+
+    def test_rate_limited(self):
+        err = discogs.discogs_client.exceptions.HTTPError('Slow down', 429)
+        self.assertTrue(discogs.is_transient(err))
+
+    def test_not_found(self):
+        err = discogs.discogs_client.exceptions.HTTPError('Not found', 404)
+        self.assertFalse(discogs.is_transient(err))
+
+
+class ResponseCacheTestCase(TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = discogs.ResponseCache(directory, ttl=60)
+        self.url = 'https://api.discogs.com/releases/1'
+
+    def response(self, status_code=200, content=b'{"id": 1}', headers=None):
+        response = mock.MagicMock(name='Response')
+        response.status_code = status_code
+        response.content = content
+        response.headers = headers or {}
+        return response
+
+    def test_replays_fresh_responses(self):
+        request = mock.MagicMock(return_value=self.response(
+            headers={'ETag': '"abc"'}
+        ))
+        self.assertEqual(
+            (b'{"id": 1}', 200), self.cache.fetch(self.url, request)
+        )
+        self.assertEqual(
+            (b'{"id": 1}', 200), self.cache.fetch(self.url, request)
+        )
+        self.assertEqual(1, request.call_count)
+
+    def test_revalidates_stale_responses(self):
+        self.cache.fetch(self.url, mock.MagicMock(return_value=self.response(
+            headers={'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Jan 2018'}
+        )))
+        self.cache.ttl = 0
+        request = mock.MagicMock(return_value=self.response(
+            status_code=304, content=b''
+        ))
+        self.assertEqual(
+            (b'{"id": 1}', 200), self.cache.fetch(self.url, request)
+        )
+        request.assert_called_once_with({
+            'If-None-Match': '"abc"', 'If-Modified-Since': 'Mon, 01 Jan 2018'
+        })
+
+    def test_does_not_cache_errors(self):
+        request = mock.MagicMock(return_value=self.response(
+            status_code=404, content=b'{"message": "Not found"}'
+        ))
+        self.cache.fetch(self.url, request)
+        self.cache.fetch(self.url, request)
+        self.assertEqual(2, request.call_count)
+
+
+class SaveRecordTestCase(TestCase):
+
+    def artist(self, discogs_id, name):
+        return SimpleNamespace(
+            id=discogs_id, name=name, url='http://example.com', profile='',
+            urls=None, images=[{
+                'uri': 'http://example.com/a.jpg', 'uri150': 'small.jpg',
+                'height': 600, 'width': 600, 'type': 'primary',
+                'resource_url': 'http://example.com/a.jpg'
+            }]
+        )
+
+    def release(self, discogs_id, tracks=3):
+        return SimpleNamespace(
+            id=discogs_id, title='Kind Of Blue', year=1959, images=None,
+            country='US', notes='', url='http://example.com',
+            status='Accepted',
+            formats=[{'name': 'Vinyl', 'descriptions': ['LP']}],
+            labels=[SimpleNamespace(id=10, name='Columbia')],
+            artists=[
+                self.artist(1, 'Miles Davis'), self.artist(2, 'John Coltrane')
+            ],
+            genres=['Jazz'], styles=['Modal', 'Hard Bop'],
+            tracklist=[
+                SimpleNamespace(duration='9:22', position='A{}'.format(i),
+                                title='Track {}'.format(i))
+                for i in range(tracks)
+            ]
+        )
+
+    def test_save_record(self):
+        rec = discogs.save_record_from_discogs_data(
+            self.release(5), thumb='t.jpg'
+        )
+        self.assertEqual('Kind Of Blue', rec.title)
+        self.assertEqual('t.jpg', rec.thumb)
+        self.assertEqual('Columbia', rec.label.name)
+        self.assertEqual(
+            ['John Coltrane', 'Miles Davis'],
+            sorted(rec.artist.values_list('name', flat=True))
+        )
+        self.assertEqual(
+            ['Jazz'], list(rec.genres.values_list('name', flat=True))
+        )
+        self.assertEqual(2, rec.styles.count())
+        self.assertEqual(3, rec.track_set.count())
+        self.assertEqual(2, models.ArtistImage.objects.count())
+        self.assertEqual(
+            'primary', models.ArtistImage.objects.first().category
+        )
+
+        # Saving again replaces rather than duplicates
+        discogs.save_record_from_discogs_data(self.release(5), thumb='t.jpg')
+        self.assertEqual(1, models.Record.objects.count())
+        self.assertEqual(2, models.Artist.objects.count())
+        self.assertEqual(2, models.Style.objects.count())
+        self.assertEqual(3, models.Track.objects.count())
+        self.assertEqual(2, models.ArtistImage.objects.count())
+
+    def test_queries_do_not_grow_with_release(self):
+        discogs.save_record_from_discogs_data(self.release(5), thumb='t.jpg')
+        with CaptureQueriesContext(connection) as small:
+            discogs.save_record_from_discogs_data(
+                self.release(6, tracks=1), thumb='t.jpg'
+            )
+        with CaptureQueriesContext(connection) as large:
+            discogs.save_record_from_discogs_data(
+                self.release(7, tracks=20), thumb='t.jpg'
+            )
+        self.assertEqual(len(small), len(large))
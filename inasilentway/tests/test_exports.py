@@ -0,0 +1,94 @@
+"""
+Unittests for inasilentway.exports
+"""
+import io
+import json
+import os
+import tempfile
+
+from django.test import TestCase
+
+from inasilentway import exports, models
+
+
+class ReadCSVTestCase(TestCase):
+
+    def test_header(self):
+        stream = io.StringIO(
+            'uts,utc_time,artist,artist_mbid,album,album_mbid,'
+            'track,track_mbid\n'
+            '1500000000,"14 Jul 2017, 02:40",'
+            'Miles Davis,,Kind Of Blue,,So What,\n'
+        )
+        rows = list(exports.read_csv(stream))
+        self.assertEqual(1, len(rows))
+        self.assertEqual('Miles Davis', rows[0]['artist'])
+        self.assertEqual('So What', rows[0]['title'])
+        self.assertEqual('Kind Of Blue', rows[0]['album'])
+        self.assertEqual(1500000000, rows[0]['timestamp'])
+        self.assertIsNotNone(rows[0]['datetime'])
+
+    def test_no_header(self):
+        stream = io.StringIO(
+            'Miles Davis,Kind Of Blue,So What,14 Jul 2017 02:40\n'
+        )
+        rows = list(exports.read_csv(stream))
+        self.assertEqual(1500000000, rows[0]['timestamp'])
+        self.assertEqual('So What', rows[0]['title'])
+
+
+class ReadJSONTestCase(TestCase):
+
+    def test_iter_json_array_across_chunks(self):
+        items = [{'n': i, 'text': 'x' * i} for i in range(50)]
+        stream = io.StringIO(' ' + json.dumps(items))
+        self.assertEqual(
+            items, list(exports.iter_json_array(stream, chunk_size=7))
+        )
+
+    def test_iter_json_array_truncated(self):
+        stream = io.StringIO('[{"n": 1}, {"n"')
+        with self.assertRaises(exports.ExportError):
+            list(exports.iter_json_array(stream, chunk_size=4))
+
+    def test_pages(self):
+        page = {'recenttracks': {'track': [
+            {
+                'artist': {'#text': 'Miles Davis'}, 'name': 'So What',
+                'album': {'#text': 'Kind Of Blue'},
+                'date': {'uts': '1500000000', '#text': '14 Jul 2017, 02:40'}
+            },
+            {
+                'artist': {'#text': 'Miles Davis'}, 'name': 'Now playing',
+                'album': {'#text': 'Kind Of Blue'},
+                '@attr': {'nowplaying': 'true'}
+            },
+        ]}}
+        rows = list(exports.read_json(io.StringIO(json.dumps([page]))))
+        self.assertEqual(1, len(rows))
+        self.assertEqual('Miles Davis', rows[0]['artist'])
+        self.assertEqual(1500000000, rows[0]['timestamp'])
+
+
+class ImportExportTestCase(TestCase):
+
+    def test_import_export(self):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w') as export:
+            export.write(
+                'Miles Davis,Kind Of Blue,So What,14 Jul 2017 02:40\n'
+                'Miles Davis,Kind Of Blue,Freddie Freeloader,'
+                '14 Jul 2017 02:50\n'
+                'Miles Davis,Kind Of Blue,Blue In Green,14 Jul 2017 03:00\n'
+            )
+
+        total = exports.import_export(
+            path, batch_size=2, progress=lambda m: None
+        )
+        self.assertEqual(3, total)
+        self.assertEqual(3, models.Scrobble.objects.count())
+
+        # Importing again doesn't duplicate anything
+        exports.import_export(path, batch_size=2, progress=lambda m: None)
+        self.assertEqual(3, models.Scrobble.objects.count())
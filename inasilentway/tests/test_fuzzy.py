@@ -0,0 +1,94 @@
+"""
+Unittests for inasilentway.fuzzy
+"""
+from django.test import TestCase
+
+from inasilentway import fuzzy, lastfm, models
+
+
+class TrigramIndexTestCase(TestCase):
+
+    def test_search(self):
+        index = fuzzy.TrigramIndex()
+        index.add('veni vidi vicious', 1)
+        index.add('veni vidi vicious', 2)
+        index.add('tyrannosaurus hives', 3)
+
+        found = index.search('veni vidi viscious')
+        self.assertEqual(1, len(found))
+        self.assertGreater(found[0][0], 0.8)
+        self.assertEqual([1, 2], found[0][1])
+
+        self.assertEqual([(1.0, [3])], index.search('tyrannosaurus hives'))
+        self.assertEqual([], index.search('kind of blue'))
+        self.assertEqual([], index.search(''))
+
+
+class LinkTestCase(TestCase):
+
+    def setUp(self):
+        # The collection signature can't tell our fixtures apart from
+        # another test's, so don't reuse its matchers
+        lastfm._matcher = None
+        fuzzy._matcher = None
+        self.artist = models.Artist.objects.create(
+            discogs_id=1, name='The Hives'
+        )
+        self.record = models.Record.objects.create(
+            discogs_id=1, title='Veni Vidi Vicious'
+        )
+        self.record.artist.add(self.artist)
+        self.track = models.Track.objects.create(
+            record=self.record, title='Main Offender'
+        )
+
+    def scrobble(self, timestamp, artist='The Hives',
+                 album='Veni Vidi Viscious', title='Main Offender'):
+        return models.Scrobble.objects.create(
+            artist=artist, album=album, title=title, timestamp=timestamp
+        )
+
+    def test_match_keys(self):
+        match = fuzzy.get_matcher().match_keys(
+            'the hives', 'veni vidi viscious', 'main offender'
+        )
+        self.assertEqual(
+            (self.artist.id, self.record.id, self.track.id), match[1:]
+        )
+        self.assertGreater(match.score, fuzzy.AUTO_LINK_SCORE)
+
+        self.assertIsNone(fuzzy.get_matcher().match_keys(
+            'miles davis', 'kind of blue', 'so what'
+        ))
+
+    def test_link(self):
+        typo = self.scrobble(1500000000)
+        self.scrobble(1500000600, artist='The Hive', title='Main Offenders')
+        self.scrobble(1500001200, artist='Hives', title='Main Offenders')
+        self.scrobble(1500001800, artist='Miles Davis', album='Kind Of Blue')
+
+        self.assertEqual(2, fuzzy.link(progress=lambda m: None))
+
+        typo.refresh_from_db()
+        self.assertEqual(self.track.id, typo.isw_track_id)
+        self.assertEqual(self.record.id, typo.isw_album_id)
+
+        suggestion = models.LinkSuggestion.objects.get()
+        self.assertEqual('Hives', suggestion.artist)
+        self.assertEqual(self.track, suggestion.isw_track)
+        self.assertLess(suggestion.score, fuzzy.AUTO_LINK_SCORE)
+
+        resp = self.client.get('/scrobbles/unlinked/')
+        self.assertEqual(
+            [suggestion], list(resp.context['view'].get_suggestions())
+        )
+        self.assertContains(resp, 'Suggested links')
+
+        self.assertEqual(
+            1, fuzzy.accept(models.LinkSuggestion.objects.all(),
+                            progress=lambda m: None)
+        )
+        self.assertFalse(models.LinkSuggestion.objects.exists())
+        self.assertEqual(
+            3, models.Scrobble.objects.filter(isw_track=self.track).count()
+        )
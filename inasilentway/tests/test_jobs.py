@@ -0,0 +1,111 @@
+"""
+Unittests for inasilentway.jobs
+"""
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+import mock
+
+from inasilentway import jobs, models
+
+
+class JobsTestCase(TestCase):
+
+    def test_enqueue(self):
+        job = jobs.enqueue('load_collection', full=True)
+        self.assertEqual('load_collection', job.name)
+        self.assertEqual(models.Job.PENDING, job.status)
+        self.assertEqual('{"full": true}', job.arguments)
+
+    def test_enqueue_unknown_task(self):
+        with self.assertRaises(ValueError):
+            jobs.enqueue('nope')
+
+    def test_enqueue_dedupes_active_jobs(self):
+        job = jobs.enqueue('load_scrobbles')
+        self.assertEqual(job, jobs.enqueue('load_scrobbles'))
+
+        models.Job.objects.filter(id=job.id).update(status=models.Job.RUNNING)
+        self.assertEqual(job, jobs.enqueue('load_scrobbles'))
+
+        models.Job.objects.filter(id=job.id).update(status=models.Job.DONE)
+        self.assertNotEqual(job, jobs.enqueue('load_scrobbles'))
+
+    def test_enqueue_different_arguments(self):
+        self.assertNotEqual(
+            jobs.enqueue('load_collection'),
+            jobs.enqueue('load_collection', full=True)
+        )
+
+    def test_claim(self):
+        first = jobs.enqueue('load_scrobbles')
+        second = jobs.enqueue('load_collection')
+
+        claimed = jobs.claim()
+        self.assertEqual(first, claimed)
+        self.assertEqual(models.Job.RUNNING, claimed.status)
+        self.assertIsNotNone(claimed.started)
+        self.assertEqual(second, jobs.claim())
+        self.assertIsNone(jobs.claim())
+
+    def test_run(self):
+        job = jobs.enqueue('load_collection', prune=True)
+        with mock.patch.object(jobs.discogs, 'load_collection') as load:
+            load.return_value = []
+            jobs.run(jobs.claim())
+
+        load.assert_called_once_with(
+            full=False, prune=True, progress=mock.ANY
+        )
+        job.refresh_from_db()
+        self.assertEqual(models.Job.DONE, job.status)
+        self.assertIsNotNone(job.finished)
+
+    def test_run_failure(self):
+        job = jobs.enqueue('load_scrobbles')
+        with mock.patch.object(
+                jobs.lastfm, 'load_last_24_hours_of_scrobbles'
+        ) as load:
+            load.side_effect = ValueError('Last.fm is down')
+            jobs.run(jobs.claim())
+
+        job.refresh_from_db()
+        self.assertEqual(models.Job.FAILED, job.status)
+        self.assertIn('Last.fm is down', job.error)
+        self.assertEqual('Loading recent scrobbles', job.progress)
+
+    def test_submit_scrobble(self):
+        record = models.Record.objects.create(title='Kind Of Blue')
+        jobs.enqueue(
+            'submit_scrobble', record_id=record.id, when='2020-01-01T12:30'
+        )
+        load = mock.patch.object(
+            jobs.lastfm, 'load_last_24_hours_of_scrobbles'
+        )
+        with mock.patch.object(jobs.lastfm, 'scrobble_record') as scrobble:
+            with load:
+                jobs.run(jobs.claim())
+
+        scrobble.assert_called_once_with(
+            record, datetime.datetime(2020, 1, 1, 12, 30)
+        )
+
+    def test_fail_stale_jobs(self):
+        job = jobs.enqueue('load_scrobbles')
+        models.Job.objects.filter(id=job.id).update(
+            status=models.Job.RUNNING,
+            heartbeat=timezone.now() - datetime.timedelta(hours=1)
+        )
+        self.assertEqual(1, jobs.fail_stale_jobs())
+        job.refresh_from_db()
+        self.assertEqual(models.Job.FAILED, job.status)
+
+    def test_work_once(self):
+        jobs.enqueue('load_scrobbles')
+        with mock.patch.object(jobs.lastfm, 'load_last_24_hours_of_scrobbles'):
+            jobs.work(once=True)
+        self.assertEqual(
+            [models.Job.DONE],
+            list(models.Job.objects.values_list('status', flat=True))
+        )
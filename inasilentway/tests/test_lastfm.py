@@ -1,10 +1,474 @@
 """
 Unittests for our Lastfm functionality
 """
+import datetime
+import time
+
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+import mock
+import pylast
 
-from inasilentway import lastfm
+from inasilentway import caching, lastfm, models, rollups
 
 
 class LoadScrobbleHistoryTestCase(TestCase):
     pass
+
+
+class SaveScrobblesTestCase(TestCase):
+
+    def setUp(self):
+        self.artist = models.Artist.objects.create(
+            discogs_id=1, name='Miles Davis'
+        )
+        self.record = models.Record.objects.create(
+            discogs_id=1, title='Kind Of Blue'
+        )
+        self.record.artist.add(self.artist)
+        self.track = models.Track.objects.create(
+            record=self.record, title='So What', position='A1', duration='9:22'
+        )
+
+    def played_track(self, title, timestamp, album='Kind Of Blue'):
+        return pylast.PlayedTrack(
+            track=pylast.Track('Miles Davis', title, None),
+            album=album,
+            playback_date='01 Jan 2020, 12:00',
+            timestamp=str(timestamp)
+        )
+
+    def test_creates_and_links(self):
+        lastfm.save_scrobbles([
+            self.played_track('So What', 1577880000),
+            self.played_track('Freddie Freeloader', 1577880600),
+        ])
+
+        self.assertEqual(2, models.Scrobble.objects.count())
+        linked = models.Scrobble.objects.get(title='So What')
+        self.assertEqual(self.track, linked.isw_track)
+        self.assertEqual(self.record, linked.isw_album)
+        self.assertEqual(self.artist, linked.isw_artist)
+        self.record.refresh_from_db()
+        self.assertEqual(1, self.record.play_count)
+        self.assertEqual(linked.ts_as_dt(), self.record.last_played)
+
+    def test_existing_scrobbles_are_updated_not_duplicated(self):
+        models.Scrobble.objects.create(
+            artist='Miles Davis', title='So What', timestamp=1577880000
+        )
+
+        created, updated = lastfm.save_scrobbles([
+            self.played_track('So What', 1577880000),
+        ])
+
+        self.assertEqual([], created)
+        self.assertEqual(1, len(updated))
+        scrobble = models.Scrobble.objects.get()
+        self.assertEqual('Kind Of Blue', scrobble.album)
+        self.assertEqual(self.track, scrobble.isw_track)
+
+    def test_scrobbles_are_unique(self):
+        models.Scrobble.objects.create(
+            artist='Miles Davis', title='So What', timestamp=1577880000
+        )
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                models.Scrobble.objects.create(
+                    artist='Miles Davis', title='So What', timestamp=1577880000
+                )
+
+    def test_concurrently_saved_scrobbles_are_not_duplicated(self):
+        # Another import saves the scrobble after we have looked for it
+        real_filter = models.Scrobble.objects.filter
+
+        def filter_then_race(*args, **kwargs):
+            found = [s.id for s in real_filter(*args, **kwargs)]
+            if not real_filter(timestamp=1577880000).exists():
+                models.Scrobble.objects.create(
+                    artist='Miles Davis', title='So What', timestamp=1577880000
+                )
+            return real_filter(id__in=found)
+
+        with mock.patch.object(
+            models.Scrobble.objects, 'filter', side_effect=filter_then_race
+        ):
+            lastfm.save_scrobbles([self.played_track('So What', 1577880000)])
+
+        self.assertEqual(1, models.Scrobble.objects.count())
+
+    def test_query_count_is_independent_of_page_size(self):
+        small = [
+            self.played_track('So What', 1577880000 + i) for i in range(2)
+        ]
+        # (SQLite splits inserts of more than 999 values, so stay under it)
+        large = [
+            self.played_track('So What', 1578090000 + i) for i in range(80)
+        ]
+
+        # Don't count building the matcher or our generation counters
+        lastfm.get_matcher()
+        caching.generations(caching.NAMESPACES)
+        with CaptureQueriesContext(connection) as small_queries:
+            lastfm.save_scrobbles(small)
+        with CaptureQueriesContext(connection) as large_queries:
+            lastfm.save_scrobbles(large)
+
+        self.assertEqual(len(small_queries), len(large_queries))
+        self.assertEqual(82, models.Scrobble.objects.count())
+
+
+class CollectionMatcherTestCase(TestCase):
+
+    def setUp(self):
+        self.artist = models.Artist.objects.create(
+            discogs_id=1, name='Billie Holiday'
+        )
+        self.first = models.Record.objects.create(
+            discogs_id=1, title='All Or Nothing At All'
+        )
+        self.second = models.Record.objects.create(
+            discogs_id=2, title='All Or Nothing At All'
+        )
+        for record in [self.first, self.second]:
+            record.artist.add(self.artist)
+        self.track = models.Track.objects.create(
+            record=self.second, title='Do Nothing Till You Hear From Me '
+        )
+
+    def test_match_ambiguous_album_by_track(self):
+        matcher = lastfm.CollectionMatcher()
+        self.assertEqual(
+            (self.artist, self.second, self.track),
+            matcher.match(
+                'billie holiday', 'All or Nothing at All',
+                'Do Nothing Till You Hear From Me'
+            )
+        )
+
+    def test_match_applies_corrections(self):
+        record = models.Record.objects.create(discogs_id=3, title='Soused ')
+        record.artist.add(self.artist)
+        track = models.Track.objects.create(record=record, title='Brandenburg')
+
+        matcher = lastfm.CollectionMatcher()
+        self.assertEqual(
+            (self.artist, record, track),
+            matcher.match('Billie Holiday', 'Soused', 'Brandenburg')
+        )
+
+    def test_match_ignores_accents_and_punctuation(self):
+        record = models.Record.objects.create(
+            discogs_id=3, title='Muito à Vontade '
+        )
+        record.artist.add(self.artist)
+        track = models.Track.objects.create(
+            record=record, title='Coisa Mais Linda'
+        )
+
+        matcher = lastfm.CollectionMatcher()
+        self.assertEqual(
+            (self.artist, record, track),
+            matcher.match(
+                'Billie Holiday', 'Muito À Vontade', 'Coisa mais linda'
+            )
+        )
+
+    def test_match_makes_no_queries(self):
+        matcher = lastfm.CollectionMatcher()
+        with self.assertNumQueries(0):
+            matcher.match('Billie Holiday', 'All Or Nothing At All', 'Nope')
+            matcher.match('Nobody', 'Nothing', 'Nope')
+
+    def test_get_matcher_rebuilds_when_collection_changes(self):
+        matcher = lastfm.get_matcher()
+        self.assertIs(matcher, lastfm.get_matcher())
+
+        models.Track.objects.create(record=self.first, title='Ill Wind')
+        self.assertIsNot(matcher, lastfm.get_matcher())
+
+    def test_get_matcher_rebuilds_when_collection_reloaded(self):
+        matcher = lastfm.get_matcher()
+        caching.bump(caching.COLLECTION)
+        self.assertIsNot(matcher, lastfm.get_matcher())
+
+    def test_get_matcher_rebuilds_when_renamed(self):
+        # Renames don't change the counts, but saving bumps the collection
+        for instance in (self.artist, self.second, self.track):
+            matcher = lastfm.get_matcher()
+            instance.save()
+            self.assertIsNot(matcher, lastfm.get_matcher())
+
+    def test_link_scrobble_with_matcher(self):
+        matcher = lastfm.get_matcher()
+        scrobble = models.Scrobble.objects.create(
+            artist='Billie Holiday', album='All Or Nothing At All',
+            title='Do Nothing Till You Hear From Me', timestamp=1577880000
+        )
+        self.assertEqual(
+            (self.artist, self.second, self.track),
+            lastfm.match_scrobble(scrobble, matcher=matcher)
+        )
+        # Without checking the collection for changes
+        with self.assertNumQueries(0):
+            lastfm.match_scrobble(scrobble, matcher=matcher)
+
+
+class HistogramTestCase(TestCase):
+
+    def scrobble(self, *when):
+        timestamp = time.mktime(datetime.datetime(*when).timetuple())
+        return models.Scrobble.objects.create(
+            artist='Cole Porter', title='Love For Sale', timestamp=timestamp
+        )
+
+    def setUp(self):
+        self.scrobble(2020, 1, 1, 10, 15)
+        self.scrobble(2020, 1, 1, 10, 45)
+        self.scrobble(2020, 1, 3, 23, 59)
+        self.scrobble(2020, 3, 2, 0, 1)
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            lastfm.histogram(models.Scrobble.objects.all(), 'day')
+
+    def test_hour(self):
+        counts = lastfm.histogram(
+            models.Scrobble.objects.filter(timestamp__lt=time.mktime(
+                datetime.datetime(2020, 1, 2).timetuple()
+            )),
+            'hour'
+        )
+        self.assertEqual(
+            {datetime.datetime(2020, 1, 1, 10): 2}, dict(counts)
+        )
+
+    def test_day_fills_gaps(self):
+        counts = lastfm.histogram(models.Scrobble.objects.all(), 'day')
+        self.assertEqual(2, counts[datetime.date(2020, 1, 1)])
+        self.assertEqual(0, counts[datetime.date(2020, 1, 2)])
+        self.assertEqual(1, counts[datetime.date(2020, 1, 3)])
+        self.assertEqual(datetime.date(2020, 3, 2), list(counts)[-1])
+
+    def test_week_starts_on_monday(self):
+        counts = lastfm.histogram(models.Scrobble.objects.all(), 'week')
+        self.assertEqual(3, counts[datetime.date(2019, 12, 30)])
+        self.assertEqual(1, counts[datetime.date(2020, 3, 2)])
+
+    def test_month(self):
+        counts = lastfm.histogram(models.Scrobble.objects.all(), 'month')
+        self.assertEqual(
+            [3, 0, 1], list(counts.values())
+        )
+
+    def test_year_with_bounds(self):
+        counts = lastfm.histogram(
+            models.Scrobble.objects.all(), 'year',
+            start=datetime.date(2019, 1, 1), end=datetime.date(2021, 1, 1)
+        )
+        self.assertEqual([0, 4, 0], list(counts.values()))
+
+    def test_rollup_matches_scrobbles(self):
+        rollups.rebuild()
+        self.assertEqual(
+            lastfm.histogram(models.Scrobble.objects.all(), 'week'),
+            lastfm.histogram(models.DailyScrobbleCount.objects.all(), 'week')
+        )
+
+
+class AlbumSessionsTestCase(TestCase):
+
+    def setUp(self):
+        self.kind_of_blue = models.Record.objects.create(title='Kind Of Blue')
+        self.milestones = models.Record.objects.create(title='Milestones')
+
+    def play(self, record, *timestamps):
+        for timestamp in timestamps:
+            models.Scrobble.objects.create(
+                artist='Miles Davis', title='Track {}'.format(timestamp),
+                timestamp=timestamp, isw_album=record
+            )
+
+    def test_groups_consecutive_scrobbles(self):
+        self.play(self.kind_of_blue, 1000, 1300, 1600)
+        self.play(self.milestones, 2000, 2300)
+        # Listened to again the next day
+        self.play(self.kind_of_blue, 90000, 90300)
+        models.Scrobble.objects.create(
+            artist='Someone', title='Unlinked', timestamp=1700
+        )
+
+        sessions = lastfm.album_sessions()
+
+        self.assertEqual(
+            [
+                (self.kind_of_blue, 90000, 2),
+                (self.milestones, 2000, 2),
+                (self.kind_of_blue, 1000, 3)
+            ],
+            [(s.record, s.start, s.plays) for s in sessions]
+        )
+
+    def test_stops_at_limit(self):
+        self.play(self.kind_of_blue, 1000, 1300)
+        self.play(self.milestones, 2000)
+        self.play(self.kind_of_blue, 90000)
+
+        sessions = lastfm.album_sessions(limit=2)
+
+        self.assertEqual(
+            [self.kind_of_blue, self.milestones], [s.record for s in sessions]
+        )
+
+    def test_returns_list_when_few_plays(self):
+        self.assertEqual([], lastfm.album_sessions())
+
+
+class ImportHistoryTestCase(TestCase):
+
+    def setUp(self):
+        # 450 scrobbles, every 10 minutes from when we joined
+        self.history = [
+            pylast.PlayedTrack(
+                track=pylast.Track('Miles Davis', 'Track {}'.format(i), None),
+                album='Kind Of Blue',
+                playback_date='01 Jan 2020, 12:00',
+                timestamp=str(1577880000 + i * 600)
+            )
+            for i in range(450)
+        ]
+        self.requests = 0
+
+    def fake_page(self, when, since=None, limit=1000):
+        self.requests += 1
+        tracks = [
+            t for t in reversed(self.history)
+            if int(t.timestamp) < when and int(t.timestamp) >= (since or 0)
+        ]
+        return tracks[:limit]
+
+    def test_plan_history(self):
+        step = int(lastfm.HISTORY_WINDOW.total_seconds())
+        start = 1577880000
+        end = start + step * 2 + 10
+        windows = lastfm.plan_history(start, end)
+        self.assertEqual(3, len(windows))
+        self.assertEqual(end, windows[0].cursor)
+        self.assertEqual(0, windows[-1].start % step)
+        self.assertLessEqual(windows[-1].start, start)
+
+        # Planning again, later or from another start, plans the same
+        # windows
+        self.assertEqual(
+            [w.id for w in windows],
+            [w.id for w in lastfm.plan_history(start + 1000, end + 1000)]
+        )
+        self.assertEqual(3, models.HistoryWindow.objects.count())
+
+    def test_catches_up_on_the_newest_window(self):
+        start, end = 1577880000, 1577880000 + 300 * 600
+        with mock.patch.object(
+                lastfm, 'get_scrobble_page', side_effect=self.fake_page
+        ):
+            lastfm.import_history(
+                start=start, end=end, progress=lambda m: None
+            )
+        self.assertEqual(300, models.Scrobble.objects.count())
+
+        calls = []
+
+        def record_calls(when, since=None, limit=1000):
+            calls.append((when, since))
+            return self.fake_page(when, since=since, limit=limit)
+
+        later = 1577880000 + 450 * 600
+        with mock.patch.object(
+                lastfm, 'get_scrobble_page', side_effect=record_calls
+        ):
+            lastfm.import_history(
+                start=start, end=later, progress=lambda m: None
+            )
+
+        # Only the scrobbles since the last run, not the whole window
+        self.assertEqual((later, end), calls[0])
+        self.assertEqual(450, models.Scrobble.objects.count())
+        window = models.HistoryWindow.objects.get()
+        self.assertEqual(models.HistoryWindow.DONE, window.status)
+        self.assertEqual(later, window.synced)
+
+    def test_import_history(self):
+        with mock.patch.object(
+                lastfm, 'get_scrobble_page', side_effect=self.fake_page
+        ):
+            failed = lastfm.import_history(
+                start=1577880000, end=1577880000 + 450 * 600,
+                progress=lambda m: None
+            )
+
+        self.assertEqual([], failed)
+        self.assertEqual(450, models.Scrobble.objects.count())
+        window = models.HistoryWindow.objects.get()
+        self.assertEqual(models.HistoryWindow.DONE, window.status)
+        # The last page just overlaps the oldest scrobble
+        self.assertEqual(4, window.pages)
+
+    def test_resumes_after_failure(self):
+        start, end = 1577880000, 1577880000 + 450 * 600
+        error = pylast.WSError(None, '10', 'Invalid API key')
+
+        def fail_second_page(*args, **kwargs):
+            if self.requests == 1:
+                raise error
+            return self.fake_page(*args, **kwargs)
+
+        with mock.patch.object(
+                lastfm, 'get_scrobble_page', side_effect=fail_second_page
+        ):
+            failed = lastfm.import_history(
+                start=start, end=end, progress=lambda m: None
+            )
+
+        self.assertEqual(1, len(failed))
+        window = models.HistoryWindow.objects.get()
+        self.assertEqual(models.HistoryWindow.FAILED, window.status)
+        self.assertEqual(200, models.Scrobble.objects.count())
+        cursor = window.cursor
+
+        calls = []
+
+        def record_calls(when, since=None, limit=1000):
+            calls.append(when)
+            return self.fake_page(when, since=since, limit=limit)
+
+        with mock.patch.object(
+                lastfm, 'get_scrobble_page', side_effect=record_calls
+        ):
+            lastfm.import_history(
+                start=start, end=end, progress=lambda m: None
+            )
+
+        self.assertEqual(cursor, calls[0])
+        self.assertEqual(450, models.Scrobble.objects.count())
+        window.refresh_from_db()
+        self.assertEqual(models.HistoryWindow.DONE, window.status)
+
+    def test_retries_transient_errors(self):
+        errors = [pylast.WSError(None, '29', 'Rate limit exceeded')]
+
+        def flaky(*args, **kwargs):
+            if errors:
+                raise errors.pop()
+            return self.fake_page(*args, **kwargs)
+
+        with mock.patch.object(
+                lastfm, 'get_scrobble_page', side_effect=flaky
+        ):
+            with mock.patch('time.sleep'):
+                failed = lastfm.import_history(
+                    start=1577880000, end=1577880000 + 450 * 600,
+                    progress=lambda m: None
+                )
+
+        self.assertEqual([], failed)
+        self.assertEqual(450, models.Scrobble.objects.count())
@@ -0,0 +1,163 @@
+"""
+Unittests for inasilentway.linking
+"""
+from django.core.management import call_command
+from django.test import TestCase
+import mock
+
+from inasilentway import lastfm, linking, models
+from inasilentway.management.commands import try_unlinked
+
+
+class RelinkTestCase(TestCase):
+
+    def setUp(self):
+        # The collection signature can't tell our fixtures apart from
+        # another test's, so don't reuse its matcher
+        lastfm._matcher = None
+        self.artist = models.Artist.objects.create(
+            discogs_id=1, name='Billie Holiday'
+        )
+        self.record = models.Record.objects.create(
+            discogs_id=1, title='All Or Nothing At All'
+        )
+        self.record.artist.add(self.artist)
+        self.track = models.Track.objects.create(
+            record=self.record, title='Ill Wind'
+        )
+
+    def scrobble(self, timestamp, title='Ill Wind'):
+        return models.Scrobble.objects.create(
+            artist='Billie Holiday', album='All Or Nothing At All',
+            title=title, timestamp=timestamp
+        )
+
+    def test_relink(self):
+        for i in range(3):
+            self.scrobble(1500000000 + i * 600)
+        missing = self.scrobble(1500010000, title='Not on the record')
+
+        relinked = linking.relink(progress=lambda m: None)
+
+        self.assertEqual(4, relinked)
+        self.assertEqual(
+            3, models.Scrobble.objects.filter(isw_track=self.track).count()
+        )
+        missing.refresh_from_db()
+        self.assertIsNone(missing.isw_track_id)
+        self.assertEqual(self.record.id, missing.isw_album_id)
+
+        self.record.refresh_from_db()
+        self.assertEqual(4, self.record.play_count)
+
+    def test_match_triples(self):
+        matches = linking.match_triples(
+            [('billie holiday', 'all or nothing at all', 'ill wind')]
+        )
+        self.assertEqual(
+            {('billie holiday', 'all or nothing at all', 'ill wind'):
+             (self.artist.id, self.record.id, self.track.id)},
+            matches
+        )
+
+    def test_nothing_to_do(self):
+        self.assertEqual(0, linking.relink(progress=lambda m: None))
+
+    def test_try_unlinked_one_at_a_time(self):
+        for i in range(5):
+            self.scrobble(1500000000 + i * 600)
+        missing = self.scrobble(1500010000, title='Not on the record')
+
+        with mock.patch.object(try_unlinked, 'PAGE_SIZE', 2):
+            with mock.patch('sys.stdout'):
+                call_command('try_unlinked')
+
+        self.assertEqual(
+            5, models.Scrobble.objects.filter(isw_track=self.track).count()
+        )
+        missing.refresh_from_db()
+        self.assertEqual(self.record.id, missing.isw_album_id)
+
+
+class RelinkInDatabaseTestCase(TestCase):
+
+    def setUp(self):
+        lastfm._matcher = None
+        self.artist = models.Artist.objects.create(
+            discogs_id=1, name='Billie Holiday'
+        )
+        self.first = models.Record.objects.create(
+            discogs_id=1, title='All Or Nothing At All'
+        )
+        self.second = models.Record.objects.create(
+            discogs_id=2, title='All Or Nothing At All'
+        )
+        for record in [self.first, self.second]:
+            record.artist.add(self.artist)
+        self.track = models.Track.objects.create(
+            record=self.second, title='Ill Wind'
+        )
+
+    def scrobble(self, title, timestamp, artist='Billie Holiday',
+                 album='All or Nothing at All'):
+        return models.Scrobble.objects.create(
+            artist=artist, album=album, title=title, timestamp=timestamp
+        )
+
+    def test_same_links_as_matcher(self):
+        scrobbles = [
+            # Ambiguous album, resolved by the track
+            self.scrobble('Ill Wind', 1500000000),
+            self.scrobble('ill wind ', 1500000600),
+            # Ambiguous album without the track
+            self.scrobble('Nope', 1500001200),
+            # Unknown artist
+            self.scrobble('Ill Wind', 1500001800, artist='Nobody'),
+        ]
+        expected = []
+        matcher = lastfm.CollectionMatcher()
+        for scrobble in scrobbles:
+            lastfm._link(scrobble, matcher.match_scrobble(scrobble))
+            expected.append((
+                scrobble.isw_track_id, scrobble.isw_album_id,
+                scrobble.isw_artist_id
+            ))
+
+        self.assertEqual(
+            2, linking.relink_in_database(progress=lambda m: None)
+        )
+
+        actual = [
+            models.Scrobble.objects.filter(id=s.id).values_list(
+                'isw_track_id', 'isw_album_id', 'isw_artist_id'
+            ).get()
+            for s in scrobbles
+        ]
+        self.assertEqual(expected, actual)
+        self.assertEqual(
+            (self.track.id, self.second.id, self.artist.id), actual[0]
+        )
+        self.second.refresh_from_db()
+        self.assertEqual(2, self.second.play_count)
+
+    def test_artist_corrections(self):
+        artist = models.Artist.objects.create(
+            discogs_id=2, name='The Bill Evans Trio'
+        )
+        record = models.Record.objects.create(
+            discogs_id=3, title='Sunday At The Village Vanguard'
+        )
+        record.artist.add(artist)
+        track = models.Track.objects.create(
+            record=record, title='Gloria\'s Step'
+        )
+        scrobble = self.scrobble(
+            "Gloria's Step", 1500000000, artist='Bill Evans Trio',
+            album='Sunday at the Village Vanguard'
+        )
+
+        linking.relink_in_database(progress=lambda m: None)
+
+        scrobble.refresh_from_db()
+        self.assertEqual(track.id, scrobble.isw_track_id)
+        self.assertEqual(artist.id, scrobble.isw_artist_id)
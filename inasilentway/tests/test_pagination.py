@@ -0,0 +1,72 @@
+"""
+Unittests for the inasilentway.pagination module
+"""
+from django.core.cache import cache
+from django.test import TestCase
+
+from inasilentway import models, pagination
+
+
+class KeysetPageTestCase(TestCase):
+
+    def setUp(self):
+        # Two scrobbles share each timestamp so that we have to tie
+        # break on id
+        self.scrobbles = [
+            models.Scrobble.objects.create(
+                artist='Miles Davis', title='Track {}'.format(i),
+                timestamp=i // 2
+            )
+            for i in range(10)
+        ]
+        self.newest_first = sorted(
+            self.scrobbles, key=lambda s: (s.timestamp, s.id), reverse=True
+        )
+        self.qs = models.Scrobble.objects.all()
+
+    def test_parse_cursor(self):
+        self.assertEqual((12, 3), pagination.parse_cursor('12.3'))
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.parse_cursor('12')
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.parse_cursor('a.b')
+
+    def test_first_page(self):
+        page = pagination.keyset_page(self.qs, 3)
+        self.assertEqual(self.newest_first[:3], page.object_list)
+        self.assertTrue(page.has_next())
+        self.assertFalse(page.has_previous())
+
+    def test_walk_forwards_and_back(self):
+        page = pagination.keyset_page(self.qs, 3)
+        seen = list(page)
+        while page.has_next():
+            page = pagination.keyset_page(self.qs, 3, after=page.next_cursor)
+            seen += list(page)
+        self.assertEqual(self.newest_first, seen)
+        self.assertFalse(page.has_next())
+        self.assertEqual(1, len(page))
+
+        page = pagination.keyset_page(self.qs, 3, before=page.previous_cursor)
+        self.assertEqual(self.newest_first[6:9], page.object_list)
+        self.assertTrue(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_before_first_row_shows_first_page(self):
+        cursor = pagination.make_cursor(self.newest_first[0])
+        page = pagination.keyset_page(self.qs, 3, before=cursor)
+        self.assertEqual(self.newest_first[:3], page.object_list)
+        self.assertFalse(page.has_previous())
+
+    def test_page_query_count(self):
+        cursor = pagination.make_cursor(self.newest_first[5])
+        with self.assertNumQueries(1):
+            pagination.keyset_page(self.qs, 3, after=cursor)
+
+    def test_cached_count(self):
+        cache.clear()
+        self.assertEqual(10, pagination.cached_count('test', self.qs))
+        # Just reading the generation
+        with self.assertNumQueries(1):
+            self.assertEqual(10, pagination.cached_count('test', self.qs))
+        cache.clear()
@@ -0,0 +1,137 @@
+"""
+Unittests for inasilentway.rollups
+"""
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from inasilentway import lastfm, models, rollups
+
+
+class RollupsTestCase(TestCase):
+
+    def scrobble(self, day, hour=12, **kwargs):
+        when = datetime.datetime.combine(day, datetime.time(hour))
+        kwargs.setdefault('artist', 'Cole Porter')
+        kwargs.setdefault('title', 'Love For Sale')
+        return models.Scrobble.objects.create(
+            timestamp=int(rollups.day_start(when)), **kwargs
+        )
+
+    def test_rebuild(self):
+        day = datetime.date(2020, 1, 1)
+        self.scrobble(day, hour=10)
+        self.scrobble(day, hour=11)
+        self.scrobble(day, artist='Nina Simone')
+
+        rollups.rebuild()
+
+        self.assertEqual(
+            {('Cole Porter', 2), ('Nina Simone', 1)},
+            set(models.DailyScrobbleCount.objects.filter(
+                day=day).values_list('artist', 'count'))
+        )
+
+    def test_refresh_days_only_touches_those_days(self):
+        first  = datetime.date(2020, 1, 1)
+        second = datetime.date(2020, 1, 2)
+        self.scrobble(first)
+        rollups.rebuild()
+
+        self.scrobble(first, hour=13)
+        self.scrobble(second)
+        rollups.refresh_days([second])
+
+        totals = dict(
+            models.DailyScrobbleCount.objects.values_list('day', 'count')
+        )
+        self.assertEqual({first: 1, second: 1}, totals)
+
+    def test_refresh_days_only_reads_those_days(self):
+        days = [datetime.date(2019, 3, 1), datetime.date(2020, 1, 1),
+                datetime.date(2020, 1, 2)]
+        for day in days:
+            self.scrobble(day)
+        self.scrobble(datetime.date(2019, 6, 1))
+
+        with CaptureQueriesContext(connection) as queries:
+            rollups.refresh_days(days)
+
+        self.assertEqual(
+            [(days[0], days[0]), (days[1], days[2])], rollups.day_runs(days)
+        )
+        self.assertEqual(3, models.DailyScrobbleCount.objects.count())
+        select = [
+            q['sql'] for q in queries if 'inasilentway_scrobble' in q['sql']
+        ]
+        self.assertEqual(1, len(select))
+        self.assertEqual(2, select[0].count('"timestamp" >='))
+
+    def test_graphs_read_from_rollup(self):
+        self.scrobble(datetime.date(2019, 3, 1))
+        self.scrobble(datetime.date(2020, 1, 1))
+        self.scrobble(datetime.date(2020, 1, 3))
+        rollups.rebuild()
+
+        counts = models.DailyScrobbleCount.objects.all()
+
+        self.assertEqual(
+            [[2020, 2, 100], [2019, 1, 50]],
+            lastfm.scrobbles_by_year_for_queryset(counts)
+        )
+        self.assertEqual(
+            [3, 1, 100],
+            lastfm.scrobbles_by_month_for_queryset(counts)[-3]
+        )
+        self.assertEqual(
+            [[3, 1, 100], [2, 0, 0], [1, 1, 100]],
+            lastfm.scrobbles_by_day_for_queryset(counts.filter(day__year=2020))
+        )
+
+
+class PlayStatsTestCase(TestCase):
+
+    def setUp(self):
+        self.artist = models.Artist.objects.create(name='Miles Davis')
+        self.record = models.Record.objects.create(title='Kind Of Blue')
+        self.other  = models.Record.objects.create(title='Milestones')
+        for timestamp in [100, 300, 200]:
+            models.Scrobble.objects.create(
+                artist='Miles Davis', title='So What {}'.format(timestamp),
+                timestamp=timestamp, isw_album=self.record,
+                isw_artist=self.artist
+            )
+
+    def test_refresh_play_stats(self):
+        rollups.refresh_play_stats(
+            records=[self.record.id, self.other.id], artists=[self.artist.id]
+        )
+        self.record.refresh_from_db()
+        self.assertEqual(3, self.record.play_count)
+        self.assertEqual(rollups.as_datetime(100), self.record.first_played)
+        self.assertEqual(rollups.as_datetime(300), self.record.last_played)
+        self.artist.refresh_from_db()
+        self.assertEqual(3, self.artist.play_count)
+        self.other.refresh_from_db()
+        self.assertEqual(0, self.other.play_count)
+        self.assertIsNone(self.other.last_played)
+
+    def test_relinking_refreshes_previous_links(self):
+        rollups.rebuild_play_stats()
+        scrobbles = list(models.Scrobble.objects.filter(timestamp=300))
+        previous = rollups.linked_ids(scrobbles)
+        models.Scrobble.objects.filter(timestamp=300).update(
+            isw_album=self.other
+        )
+        for scrobble in scrobbles:
+            scrobble.refresh_from_db()
+
+        rollups.refresh_scrobbles(scrobbles, previous=previous)
+
+        self.record.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(2, self.record.play_count)
+        self.assertEqual(rollups.as_datetime(200), self.record.last_played)
+        self.assertEqual(1, self.other.play_count)
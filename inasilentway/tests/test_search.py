@@ -0,0 +1,103 @@
+"""
+Unittests for the inasilentway.search module
+"""
+from django.test import TestCase
+
+from inasilentway import models, search
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        self.label = models.Label.objects.create(name='Blue Note')
+        self.miles = models.Artist.objects.create(name='Miles Davis')
+        self.kind_of_blue = self.make_record(
+            'Kind Of Blue', self.miles, ['So What', 'Freddie Freeloader']
+        )
+        self.milestones = self.make_record(
+            'Milestones', self.miles, ['Straight, No Chaser'],
+            label=self.label
+        )
+        self.elis = self.make_record(
+            'Elis & Tom', models.Artist.objects.create(name='Elis Regina'),
+            ['Águas De Março'], genre='Brazilian'
+        )
+
+    def make_record(self, title, artist, tracks, label=None, genre=None):
+        record = models.Record.objects.create(title=title, label=label)
+        record.artist.add(artist)
+        for track in tracks:
+            models.Track.objects.create(record=record, title=track)
+        if genre:
+            record.genres.add(models.Genre.objects.create(name=genre))
+        search.index_record(record)
+        return record
+
+    def test_terms(self):
+        self.assertEqual(['so', 'what'], search.terms('So, "What"'))
+        self.assertEqual([], search.terms(' :- '))
+
+    def test_search_title_and_artist(self):
+        self.assertEqual(
+            [self.kind_of_blue], list(search.search('kind of blue'))
+        )
+        self.assertEqual(
+            {self.kind_of_blue, self.milestones},
+            set(search.search('miles davis'))
+        )
+
+    def test_search_prefixes(self):
+        self.assertEqual([self.milestones], list(search.search('milest')))
+
+    def test_search_labels_and_genres(self):
+        self.assertEqual([self.milestones], list(search.search('blue note')))
+        self.assertEqual([self.elis], list(search.search('brazilian')))
+
+    def test_search_ignores_diacritics(self):
+        self.assertEqual([self.elis], list(search.search('aguas de marco')))
+
+    def test_search_ranks_titles_above_tracks(self):
+        self.make_record(
+            'Blues', models.Artist.objects.create(name='Other'), ['Milestones']
+        )
+        results = list(search.search('milestones'))
+        self.assertEqual(self.milestones, results[0])
+        self.assertEqual(2, len(results))
+
+    def test_search_field(self):
+        self.assertEqual(
+            [self.kind_of_blue], list(search.search('freddie', field='tracks'))
+        )
+        self.assertEqual([], list(search.search('miles', field='tracks')))
+
+    def test_search_is_not_truncated(self):
+        records = [
+            models.Record.objects.create(title='Live {}'.format(i))
+            for i in range(300)
+        ]
+        models.SearchDocument.objects.bulk_create([
+            models.SearchDocument(
+                record=record, title=record.title, artists='', tracks='',
+                labels='', genres='', styles=''
+            )
+            for record in records
+        ])
+        results = search.search('live')
+        self.assertEqual(300, results.count())
+        self.assertEqual(50, len(results[250:300]))
+
+    def test_search_empty_query(self):
+        self.assertEqual([], list(search.search('')))
+
+    def test_reindex_record(self):
+        self.kind_of_blue.title = 'Sketches Of Spain'
+        self.kind_of_blue.save()
+        search.index_record(self.kind_of_blue)
+        self.assertEqual([], list(search.search('kind of blue')))
+        self.assertEqual(
+            [self.kind_of_blue], list(search.search('sketches'))
+        )
+
+    def test_deleting_record_removes_it(self):
+        self.kind_of_blue.delete()
+        self.assertEqual([], list(search.search('freddie')))
@@ -0,0 +1,66 @@
+"""
+Unittests for inasilentway.utils
+"""
+from django.test import TestCase
+import mock
+
+from inasilentway import models, utils
+
+
+class RetryTestCase(TestCase):
+
+    def test_retries_until_success(self):
+        func = mock.MagicMock(side_effect=[ValueError, ValueError, 'ok'])
+        with mock.patch.object(utils.time, 'sleep') as sleep:
+            self.assertEqual('ok', utils.retry(func, ValueError, delay=1))
+        self.assertEqual([mock.call(1), mock.call(2)], sleep.call_args_list)
+
+    def test_gives_up_after_attempts(self):
+        func = mock.MagicMock(side_effect=ValueError)
+        with mock.patch.object(utils.time, 'sleep'):
+            with self.assertRaises(ValueError):
+                utils.retry(func, ValueError, attempts=3)
+        self.assertEqual(3, func.call_count)
+
+    def test_giveup(self):
+        func = mock.MagicMock(side_effect=ValueError)
+        with self.assertRaises(ValueError):
+            utils.retry(func, ValueError, giveup=lambda err: True)
+        self.assertEqual(1, func.call_count)
+
+
+class GetOrInsertTestCase(TestCase):
+
+    def test_get_or_insert(self):
+        label = utils.get_or_insert(models.Label, discogs_id='123')
+        self.assertEqual('123', label.discogs_id)
+        again = utils.get_or_insert(models.Label, discogs_id='123')
+        self.assertEqual(label.id, again.id)
+        self.assertEqual(1, models.Label.objects.count())
+
+
+class MatchKeyTestCase(TestCase):
+
+    def test_match_key(self):
+        self.assertEqual(
+            utils.match_key('Muito À Vontade'),
+            utils.match_key('Muito à Vontade')
+        )
+        self.assertEqual('soused', utils.match_key('Soused '))
+        self.assertEqual(
+            'nights of ballads and blues',
+            utils.match_key('Nights Of  Ballads & Blues')
+        )
+        self.assertEqual(
+            utils.match_key('…And Star Power'),
+            utils.match_key('... And Star Power')
+        )
+        self.assertEqual('', utils.match_key(None))
+
+    def test_artist_key(self):
+        self.assertEqual('haim', utils.artist_key('Haim (2)'))
+        self.assertEqual('haim', utils.artist_key('HAIM'))
+
+    def test_filled_on_save(self):
+        artist = models.Artist.objects.create(name='Antônio Carlos Jobim')
+        self.assertEqual('antonio carlos jobim', artist.name_key)
@@ -1,11 +1,13 @@
 """
 Unittests for views
 """
+from django.core.cache import cache
+from django.http import Http404
 from django.test import TestCase
 from django.test.client import RequestFactory
 import mock
 
-from inasilentway import models, views
+from inasilentway import caching, models, rollups, search, views
 
 
 class RecordListViewTestCase(TestCase):
@@ -29,6 +31,28 @@ class RecordListViewTestCase(TestCase):
 
         self.assertIn(redirect.url, potential_redirects)
 
+    def test_get_random_record_query_count(self):
+        for i in range(20):
+            models.Record.objects.create(title='Record {}'.format(i))
+
+        view = views.RecordListView()
+        mock_request = mock.MagicMock(name='Mock Request')
+        mock_request.GET = {}
+        view.request = mock_request
+
+        with self.assertNumQueries(2):
+            redirect = view.redirect_to_random_record()
+        self.assertTrue(redirect.url.startswith('/record/'))
+
+    def test_get_random_record_empty(self):
+        view = views.RecordListView()
+        mock_request = mock.MagicMock(name='Mock Request')
+        mock_request.GET = {}
+        view.request = mock_request
+
+        with self.assertRaises(Http404):
+            view.redirect_to_random_record()
+
     def test_dispatch_regular(self):
         view = views.RecordListView()
         mock_request = mock.MagicMock(name='Mock Request')
@@ -109,16 +133,23 @@ class LabelViewTestCase(TestCase):
 
 
 class ListeningHistoryViewTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caching.generations(caching.NAMESPACES)
+
     def test_get_top_lastfm_artists_all_time(self):
         scrobble = models.Scrobble.objects.create(
-            artist='Cole Porter', title='Love For Sale'
+            artist='Cole Porter', title='Love For Sale', timestamp=1577880000
         )
         scrobble = models.Scrobble.objects.create(
-            artist='Cole Porter', title='What Is This Thing Called Love'
+            artist='Cole Porter', title='What Is This Thing Called Love',
+            timestamp=1577880300
         )
         artist = models.Artist.objects.create(
             discogs_id=1, name='Cole Porter'
         )
+        rollups.rebuild()
 
         view = views.ListeningHistoryView()
 
@@ -132,3 +163,174 @@ class ListeningHistoryViewTestCase(TestCase):
 
         top_artists = view.get_top_lastfm_artists_all_time
         self.assertEqual(expected, list(top_artists))
+
+    def test_top_artists_query_count_is_fixed(self):
+        for i in range(30):
+            models.Artist.objects.create(name='Artist {}'.format(i))
+            for j in range(i + 1):
+                models.Scrobble.objects.create(
+                    artist='Artist {}'.format(i), title='Track {}'.format(j),
+                    timestamp=1577880000 + i * 100 + j
+                )
+        rollups.rebuild()
+        view = views.ListeningHistoryView()
+
+        # One for the generation, one for the counts and one for the artists
+        with self.assertNumQueries(3):
+            top_artists = view.get_top_lastfm_artists_all_time
+        self.assertEqual(25, len(top_artists))
+        self.assertEqual('Artist 29', top_artists[0]['artist'])
+        self.assertIn('url', top_artists[0])
+
+
+class RecordListQueryCountTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Each page reads our cache generations in one query, create
+        # them up front so that we count the same queries every time
+        caching.generations(caching.NAMESPACES)
+        self.genre = models.Genre.objects.create(name='Jazz')
+        self.style = models.Style.objects.create(name='Hard Bop')
+        self.label = models.Label.objects.create(name='Blue Note')
+        artists = [
+            models.Artist.objects.create(
+                discogs_id=i, name='Artist {}'.format(i)
+            )
+            for i in range(3)
+        ]
+        for i in range(10):
+            record = models.Record.objects.create(
+                discogs_id=i, title='Record {}'.format(i), label=self.label
+            )
+            record.artist.add(*artists)
+            record.genres.add(self.genre)
+            record.styles.add(self.style)
+            models.Track.objects.create(record=record, title='Track')
+            if i % 2:
+                models.Scrobble.objects.create(
+                    artist='Artist 1', title='Track', timestamp=i,
+                    isw_album=record
+                )
+        other = models.Record.objects.create(discogs_id=10, title='Other')
+        other.artist.add(*artists)
+        for record in models.Record.objects.all():
+            search.index_record(record)
+        rollups.rebuild_play_stats()
+
+    def assertListQueries(self, num, url):
+        cache.clear()
+        with self.assertNumQueries(num):
+            resp = self.client.get(url)
+        self.assertEqual(200, resp.status_code)
+
+    def test_collection(self):
+        self.assertListQueries(4, '/collection/')
+
+    def test_collection_count_is_cached(self):
+        self.assertListQueries(4, '/collection/')
+        with self.assertNumQueries(3):
+            self.client.get('/collection/')
+        caching.bump(caching.COLLECTION)
+        with self.assertNumQueries(4):
+            self.client.get('/collection/')
+
+    def test_collection_sorted(self):
+        self.assertListQueries(4, '/collection/?sort=artist')
+        self.assertListQueries(4, '/collection/?sort=oldest')
+
+    def test_genre(self):
+        self.assertListQueries(5, '/genre/{}/jazz/'.format(self.genre.id))
+        self.assertListQueries(
+            5, '/genre/{}/jazz/?exclude=True'.format(self.genre.id)
+        )
+
+    def test_style(self):
+        self.assertListQueries(5, '/style/{}/hard-bop/'.format(self.style.id))
+
+    def test_label(self):
+        self.assertListQueries(5, '/label/{}'.format(self.label.id))
+
+    def test_unplayed(self):
+        self.assertListQueries(4, '/unplayed/')
+
+    def test_oldest(self):
+        self.assertListQueries(4, '/oldest/')
+
+    def test_search(self):
+        # Searching and ranking happen in the page and count queries
+        self.assertListQueries(4, '/search/?query=record')
+        self.assertListQueries(4, '/search/?query=song:track')
+        self.assertListQueries(4, '/search/?query=record&sort=year')
+
+
+class ScrobbleListViewTestCase(TestCase):
+
+    def setUp(self):
+        for i in range(60):
+            models.Scrobble.objects.create(
+                artist='Miles Davis', title='So What', timestamp=i
+            )
+
+    def test_get_pages(self):
+        resp = self.client.get('/scrobbles/')
+        self.assertEqual(200, resp.status_code)
+        page = resp.context['page_obj']
+        self.assertEqual(50, len(page))
+        self.assertEqual(59, page.object_list[0].timestamp)
+
+        resp = self.client.get('/scrobbles/?after={}'.format(page.next_cursor))
+        page = resp.context['page_obj']
+        self.assertEqual(10, len(page))
+        self.assertFalse(page.has_next())
+        self.assertTrue(page.has_previous())
+
+    def test_bad_cursor(self):
+        resp = self.client.get('/scrobbles/?after=nope')
+        self.assertEqual(404, resp.status_code)
+
+    def test_unlinked(self):
+        resp = self.client.get('/scrobbles/unlinked/')
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(50, len(resp.context['page_obj']))
+
+
+class RecentlyScrobbledRecordsViewTestCase(TestCase):
+
+    def test_get(self):
+        artist = models.Artist.objects.create(name='Miles Davis')
+        for i in range(5):
+            record = models.Record.objects.create(title='Record {}'.format(i))
+            record.artist.add(artist)
+            models.Scrobble.objects.create(
+                artist='Miles Davis', title='Track', timestamp=i * 100000,
+                isw_album=record
+            )
+
+        # One for the scrobbles and one for the artists
+        with self.assertNumQueries(2):
+            resp = self.client.get('/scrobbles/recently-scrobbled-records/')
+        self.assertEqual(200, resp.status_code)
+        self.assertContains(resp, 'Record 4')
+
+
+class JobViewsTestCase(TestCase):
+
+    def test_load_collection_enqueues(self):
+        with mock.patch.object(views.jobs.discogs, 'load_collection') as load:
+            resp = self.client.get('/load-collection/')
+            again = self.client.get('/load-collection/')
+
+        self.assertFalse(load.called)
+        job = models.Job.objects.get()
+        self.assertEqual('load_collection', job.name)
+        self.assertRedirects(resp, job.get_absolute_url())
+        self.assertRedirects(again, job.get_absolute_url())
+
+    def test_job_page(self):
+        job = views.jobs.enqueue('load_scrobbles')
+        job.report('Halfway there')
+        resp = self.client.get(job.get_absolute_url())
+        self.assertEqual(200, resp.status_code)
+        self.assertContains(resp, 'Halfway there')
+        self.assertContains(resp, 'http-equiv="refresh"')
@@ -75,6 +75,7 @@ urlpatterns = [
         views.RetrieveCollectionView.as_view(),
         name='load-collection'
     ),
+    path('jobs/<int:pk>/', views.JobView.as_view(), name='job'),
     path(
         'collection-loading-error',
         views.CollectionLoadingErroView.as_view(),
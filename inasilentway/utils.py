@@ -1,6 +1,17 @@
 """
 Utilities
 """
+import re
+import time
+import unicodedata
+
+# Longest key we store for a 200 character name
+MATCH_KEY_LENGTH = 255
+
+PUNCTUATION    = re.compile(r'[^\w\s]|_')
+WHITESPACE     = re.compile(r'\s+')
+# Discogs tells apart artists with the same name like "Haim (2)"
+DISAMBIGUATION = re.compile(r'\s*\(\d+\)\s*$')
 
 
 def percent_of(value, total):
@@ -8,3 +19,63 @@ def percent_of(value, total):
     Return an integer that is VALUE % of TOTAL
     """
     return int(100 * (value / float(total)))
+
+
+def retry(func, exceptions, attempts=5, delay=1, max_delay=60, giveup=None):
+    """
+    Call FUNC, retrying up to ATTEMPTS times with exponential backoff
+    starting at DELAY seconds if it raises one of EXCEPTIONS.
+
+    If GIVEUP is passed it is called with the exception, and a truthy
+    result re-raises it straight away.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except exceptions as err:
+            if attempt == attempts or (giveup and giveup(err)):
+                raise
+            wait = min(max_delay, delay * 2 ** (attempt - 1))
+            print('{}, retrying in {}s'.format(repr(err), wait))
+            time.sleep(wait)
+
+
+def get_or_insert(model, **key):
+    """
+    Return the instance of MODEL with the unique KEY, inserting it
+    first if it doesn't exist.
+
+    Rather than checking and then inserting like get_or_create() we
+    let the unique constraint on KEY turn a repeated insert into a
+    no-op, so concurrent loaders can't race each other into duplicates.
+    """
+    model.objects.bulk_create([model(**key)], ignore_conflicts=True)
+    return model.objects.get(**key)
+
+
+def match_key(value):
+    """
+    Return the normalised form of the name VALUE that we match
+    scrobbles to our collection with.
+
+    Keys are casefolded, without accents or punctuation, spell '&' as
+    'and' and have their whitespace collapsed, so 'Muito À Vontade' and
+    'Muito à Vontade', or 'Soused' and 'Soused ', share a key.
+    """
+    if value is None:
+        return ''
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    value = value.casefold().replace('&', ' and ')
+    value = PUNCTUATION.sub(' ', value)
+    return WHITESPACE.sub(' ', value).strip()[:MATCH_KEY_LENGTH]
+
+
+def artist_key(value):
+    """
+    Return the match key for the artist name VALUE, ignoring any
+    Discogs disambiguation suffix.
+    """
+    if value is None:
+        return ''
+    return match_key(DISAMBIGUATION.sub('', str(value)))
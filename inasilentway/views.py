@@ -4,9 +4,9 @@ Views for inasilentway
 import collections
 import datetime
 import random
-import time
 
-from django.db.models import Count, Q, Max
+from django.db.models import Max, Min, Sum, prefetch_related_objects
+from django.http import Http404
 from django.shortcuts import redirect
 from django.urls import reverse_lazy, reverse
 from django.utils import timezone
@@ -14,8 +14,11 @@ from django.utils.functional import cached_property
 from django.views.generic import ListView, DetailView, TemplateView, View
 from django.views.generic.edit import DeleteView, FormView
 
-from inasilentway import discogs, forms, lastfm
-from inasilentway.models import Record, Artist, Genre, Label, Scrobble, Style
+from inasilentway import caching, forms, jobs, lastfm, pagination, search
+from inasilentway.models import (
+    Record, Artist, DailyScrobbleCount, Genre, Job, Label, LinkSuggestion,
+    Scrobble, Style
+)
 
 
 class HomeView(TemplateView):
@@ -33,49 +36,77 @@ class RecordListView(ListView):
 
     model       = Record
     paginate_by = 50
+    # Counting a big filtered list is expensive, so we cache the counts
+    paginator_class = caching.CachedCountPaginator
+
+    sorts = {
+        'artist': 'artist__name',
+        'title ': 'title',
+        'year'  : 'year',
+        'oldest': 'oldest'
+    }
 
     def redirect_to_random_record(self):
         """
         Redirect to a random record from the queryset for this
         ListView.
+
+        We pick a random offset into the records ordered by primary
+        key, so this costs a count and a single row fetch however many
+        records there are.
         """
-        qs = self.get_queryset()
-        ids = qs.values_list('id', flat=True)
-        record = Record.objects.get(pk=random.choice(ids))
+        qs = self.get_records().order_by('pk').distinct()
+        count = qs.count()
+        if count == 0:
+            raise Http404('No records to choose from')
+        record = qs.only('id', 'title')[random.randrange(count)]
         return redirect(record.get_absolute_url())
 
     def dispatch(self, *a, **k):
-        if self.request.GET.get('redirect', None == 'random'):
+        if self.request.GET.get('redirect', None) == 'random':
             return self.redirect_to_random_record()
         return super().dispatch(*a, **k)
 
-    def sort(self, queryset):
-        sorts = {
-            'artist': 'artist__name',
-            'title ': 'title',
-            'year'  : 'year',
-            'oldest': 'oldest'
-        }
+    def get_sort(self):
+        """
+        Return the field we should sort by for this request
+        """
+        sort = self.request.GET.get('sort', None)
+        if sort in self.sorts:
+            return self.sorts[sort]
+        return 'title'
 
-        if self.request.GET.get('sort', None) in sorts:
-            sort = sorts[self.request.GET['sort']]
-        else:
-            sort = 'title'
+    def sort(self, queryset):
+        sort = self.get_sort()
         if sort == 'oldest':
-            queryset = queryset.filter(scrobble__isnull=False)
-            queryset = queryset.annotate(last_scrobble=Max('scrobble__timestamp'))
-            queryset = queryset.order_by('last_scrobble').distinct()
+            queryset = queryset.filter(last_played__isnull=False)
+            queryset = queryset.order_by('last_played').distinct()
         else:
             queryset = queryset.order_by(sort).distinct()
         return queryset
 
-    def get_queryset(self):
-        qs = self.model.objects.filter(
+    def get_records(self):
+        """
+        Return the unsorted records for this list.
+
+        Subclasses override this rather than get_queryset() so that
+        they all share our sorting and prefetching.
+        """
+        return self.model.objects.filter(
             title__isnull=False
         )
-        qs = self.sort(qs)
-        self.num_records = qs.count()
-        return qs
+
+    def get_queryset(self):
+        qs = self.sort(self.get_records())
+        return qs.select_related('label').prefetch_related('artist')
+
+    def paginate_queryset(self, queryset, page_size):
+        paginated = super().paginate_queryset(queryset, page_size)
+        paginator = paginated[0]
+        # The paginator caches its count, so share it rather than
+        # counting the records again
+        self.num_records = paginator.count
+        return paginated
 
 
 class CollectionView(RecordListView):
@@ -94,18 +125,14 @@ class GenreView(RecordListView):
             self.page_subtitle = 'Genre: {}'.format(self.genre.name)
         return super().dispatch(*a, **k)
 
-    def get_queryset(self):
+    def get_records(self):
         if self.exclude:
-            qs = Record.objects.exclude(
+            return Record.objects.exclude(
                 genres=self.genre
             )
-        else:
-            qs = Record.objects.filter(
-                genres=self.genre
-            )
-        qs = self.sort(qs)
-        self.num_records = qs.count()
-        return qs
+        return Record.objects.filter(
+            genres=self.genre
+        )
 
 
 class StyleView(RecordListView):
@@ -119,13 +146,10 @@ class StyleView(RecordListView):
         self.page_subtitle = 'Style: {}'.format(self.style.name)
         return super().dispatch(*a, **k)
 
-    def get_queryset(self):
-        qs = Record.objects.filter(
+    def get_records(self):
+        return Record.objects.filter(
             styles=self.style
         )
-        qs = self.sort(qs)
-        self.num_records = qs.count()
-        return qs
 
 
 class LabelView(RecordListView):
@@ -135,13 +159,10 @@ class LabelView(RecordListView):
         self.page_subtitle = 'Label: {}'.format(self.label.name)
         return super().dispatch(*a, **k)
 
-    def get_queryset(self):
-        qs = Record.objects.filter(
+    def get_records(self):
+        return Record.objects.filter(
             label=self.label
         )
-        qs = self.sort(qs)
-        self.num_records = qs.count()
-        return qs
 
 
 class UnplayedView(RecordListView):
@@ -152,50 +173,53 @@ class UnplayedView(RecordListView):
     page_title    = 'Unplayed Records'
     page_subtitle = 'Unplayed Records'
 
-    def get_queryset(self):
+    def get_records(self):
         qs = self.model.objects.filter(
-            scrobble__isnull=True
+            play_count=0
         )
-        qs = qs.exclude(artist__name='Various')
-        qs = self.sort(qs)
-        self.num_records = qs.count()
-        return qs
+        return qs.exclude(artist__name='Various')
 
 
 class OldestView(RecordListView):
 
     page_subtitle = 'Least recently played records'
 
-    def get_queryset(self):
-        qs = self.model.objects.filter(
-            scrobble__isnull=False
+    def get_records(self):
+        return self.model.objects.filter(
+            last_played__isnull=False
         )
-        qs = qs.annotate(last_scrobble=Max('scrobble__timestamp'))
-        qs = qs.order_by('last_scrobble')
-        self.num_records = qs.count()
-        return qs
+
+    def sort(self, queryset):
+        return queryset.order_by('last_played')
 
 
 class SearchView(RecordListView):
+    """
+    Displays records matching the user's query, best match first.
 
-    def get_song_queryset(self, query):
-        operator, title = query.split(':')
-        return self.sort(self.model.objects.filter(
-            track__title__icontains=title
-        ))
+    Queries starting with "song:" only search track titles.
+    """
 
-    def get_queryset(self):
+    def get_search(self):
+        """
+        Return the query and the field (if any) we should search
+        """
         query = self.request.GET['query']
         if query.startswith('song:'):
-            qs = self.get_song_queryset(query)
-        else:
-            qs = self.model.objects.filter(
-                Q(title__icontains=query) | Q(artist__name__icontains=query)
-            )
-            qs = self.sort(qs)
+            operator, title = query.split(':', 1)
+            return title, 'tracks'
+        return query, None
 
-        self.num_records = qs.count()
-        return qs
+    def get_records(self):
+        query, field = self.get_search()
+        return search.search(query, field=field)
+
+    def sort(self, queryset):
+        # Search results are already ranked, so only re-sort them if
+        # the user asks us to
+        if self.request.GET.get('sort', None) in self.sorts:
+            return super().sort(queryset)
+        return queryset
 
 
 class RecordView(DetailView):
@@ -207,8 +231,8 @@ class RecordView(DetailView):
 
     def scrobbles_by_year(self):
         record = self.get_object()
-        scrobbles = record.scrobble_set.all()
-        return lastfm.scrobbles_by_year_for_queryset(scrobbles)
+        counts = DailyScrobbleCount.objects.filter(isw_album=record)
+        return lastfm.scrobbles_by_year_for_queryset(counts)
 
     def get_scrobble_form(self):
         today = timezone.make_aware(
@@ -234,30 +258,19 @@ class SubmitScrobbleView(FormView):
         hour, minute = [int(i) for i in data['time'].split(':')]
         date = datetime.datetime(year, month, day, hour, minute)
 
-        record = Record.objects.get(pk=data['record_id'])
-
-        if data['tracks'] == '*':
-            print('Scrobbling all tracks')
-            lastfm.scrobble_record(record, date)
-        else:
-            print('Scrobbling track subset from record')
-            tracks = lastfm.filter_tracks(record, data['tracks'])
-            lastfm.scrobble_tracks(tracks, date)
-
-        try:
-            lastfm.load_last_24_hours_of_scrobbles()
-        except lastfm.pylast.WSError:
-            return redirect(reverse('scrobble-retrieval-error'))
-        return super().form_valid(form)
+        job = jobs.enqueue(
+            'submit_scrobble',
+            record_id=data['record_id'],
+            when=date.strftime(jobs.DATETIME_FORMAT),
+            tracks=data['tracks']
+        )
+        return redirect(job.get_absolute_url())
 
 
 class RetrieveScrobblesView(View):
     def get(self, *a, **k):
-        try:
-            lastfm.load_last_24_hours_of_scrobbles()
-            return redirect(reverse('scrobble-list'))
-        except lastfm.pylast.WSError:
-            return redirect(reverse('scrobble-retrieval-error'))
+        job = jobs.enqueue('load_scrobbles')
+        return redirect(job.get_absolute_url())
 
 
 class ScrobbleRetrievalErroView(TemplateView):
@@ -266,11 +279,18 @@ class ScrobbleRetrievalErroView(TemplateView):
 
 class RetrieveCollectionView(View):
     def get(self, *a, **k):
-        try:
-            discogs.load_collection()
-            return redirect(reverse('record-list'))
-        except discogs.discogs_client.exceptions.HTTPError:
-            return redirect(reverse('collection-retrieval-error'))
+        job = jobs.enqueue('load_collection')
+        return redirect(job.get_absolute_url())
+
+
+class JobView(DetailView):
+    """
+    Shows the status and progress of a background job
+    """
+    model = Job
+
+    def page_title(self):
+        return 'Job {}'.format(self.get_object().name)
 
 
 class CollectionLoadingErroView(TemplateView):
@@ -287,67 +307,84 @@ class ArtistView(DetailView):
 
     def scrobbles_by_year(self):
         artist = self.get_object()
-        scrobbles = artist.scrobble_set.all()
-        return lastfm.scrobbles_by_year_for_queryset(scrobbles)
+        counts = DailyScrobbleCount.objects.filter(isw_artist=artist)
+        return lastfm.scrobbles_by_year_for_queryset(counts)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Paginate a ListView of scrobbles with ?before= and ?after= cursors
+    rather than page numbers, so that deep pages are as fast as the
+    first one.
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = pagination.keyset_page(
+                queryset, page_size,
+                after=self.request.GET.get('after', None) or None,
+                before=self.request.GET.get('before', None) or None
+            )
+        except pagination.InvalidCursor as err:
+            raise Http404(str(err))
+        return (None, page, page.object_list, page.has_other_pages())
 
 
-class ScrobbleListView(ListView):
+class ScrobbleListView(KeysetPaginationMixin, ListView):
     model = Scrobble
     paginate_by = 50
     page_class = 'scrobbles'
     page_title = 'Scrobbles'
 
     def get_queryset(self):
-        return Scrobble.objects.all().order_by('-timestamp')
+        return Scrobble.objects.select_related('isw_artist', 'isw_album')
 
     def num_scrobbles(self):
-        return Scrobble.objects.count()
+        return pagination.cached_count('scrobbles', Scrobble.objects.all())
 
     def get_scrobbles_by_year(self):
         return lastfm.total_scrobbles_by_year()
 
 
-class UnlinkedScrobbleView(ListView):
+class UnlinkedScrobbleView(KeysetPaginationMixin, ListView):
     template_name = 'inasilentway/unlinked_scrobbles.html'
     model = Scrobble
     paginate_by = 50
 
     def total_scrobbles(self):
-        return Scrobble.objects.count()
+        return pagination.cached_count('scrobbles', Scrobble.objects.all())
 
     def get_queryset(self):
-        qs = Scrobble.objects.filter(
+        return Scrobble.objects.filter(
             isw_track__isnull=True,
             title__isnull=False
-        ).order_by('-timestamp')
-        self.num_scrobbles = qs.count()
-        return qs
+        ).select_related('isw_artist', 'isw_album')
+
+    def num_scrobbles(self):
+        return pagination.cached_count(
+            'unlinked-scrobbles', self.get_queryset()
+        )
+
+    def get_suggestions(self):
+        """
+        Return the links fuzzy matching suggested for the most played
+        of our unlinked scrobbles
+        """
+        return LinkSuggestion.objects.select_related(
+            'isw_artist', 'isw_track__record'
+        )[:50]
 
 
 class RecentlyScrobbledRecordsView(TemplateView):
     template_name = 'inasilentway/recently_scrobbled_record_list.html'
 
     def get_recent_scrobbles(self):
-        seen    = set()
-        recents = []
-        recently_scrobbled = Scrobble.objects.filter(
-            isw_album__isnull=False
-        ).order_by('-timestamp')
-
-        for scrobble in recently_scrobbled:
-
-            play = (
-                scrobble.isw_album.title,
-                scrobble.datetime.strftime('%d %m %y')
-            )
-
-            if play not in seen:
-                recents.append(scrobble.isw_album)
-                seen.add(play)
-
-            if len(recents) == 300:
-                print(seen)
-                return recents
+        """
+        Return the 300 most recent album plays
+        """
+        sessions = lastfm.album_sessions(limit=300)
+        prefetch_related_objects([s.record for s in sessions], 'artist')
+        return sessions
 
 
 class ListeningHistoryView(TemplateView):
@@ -358,35 +395,57 @@ class ListeningHistoryView(TemplateView):
     template_name = 'inasilentway/listening_history.html'
     page_title = 'Listening history'
 
-    def _get_scrobbles_between(self, start, end):
+    def _get_counts_between(self, start, end):
         """
-        Return a queryset of scrobbles between two dates
+        Return a queryset of daily scrobble counts between two dates
         """
-        return Scrobble.objects.filter(
-            timestamp__gte=time.mktime(start.timetuple()),
-            timestamp__lt=time.mktime(end.timetuple())
+        def as_datetime(when):
+            if isinstance(when, datetime.datetime):
+                return when
+            return datetime.datetime.combine(
+                when, datetime.datetime.min.time()
+            )
+
+        last = as_datetime(end) - datetime.timedelta(microseconds=1)
+        return DailyScrobbleCount.objects.filter(
+            day__gte=as_datetime(start).date(), day__lte=last.date()
         )
 
     # Top artist lists
-    def _top_scrobbles_for_qs(self, qs, limit=25):
-        result = qs.values(
-            'artist').annotate(total=Count('artist')).order_by('-total')[:limit]
+    def _top_scrobbles_for_qs(self, qs, limit=25, with_urls=True):
+        """
+        Return a list of dicts with the LIMIT most scrobbled artists
+        in the daily counts QS and their totals.
+
+        If WITH_URLS is true, add the url of the matching Artist in our
+        collection where there is one, looking them all up at once.
+        """
+        result = list(qs.values(
+            'artist').annotate(total=Sum('count')).order_by('-total')[:limit])
+        if not with_urls:
+            return result
+
+        # Where two artists share a name, take the first like we always have
+        artists = Artist.objects.filter(
+            name__in=[a['artist'] for a in result]
+        ).only('id', 'name').order_by('-id')
+        urls = {artist.name: artist.get_absolute_url() for artist in artists}
+
         for a in result:
-            artist = Artist.objects.filter(name=a['artist']).first()
-            if artist:
-                a['url'] = artist.get_absolute_url()
+            if a['artist'] in urls:
+                a['url'] = urls[a['artist']]
         return result
 
     @cached_property
+    @caching.cached(caching.SCROBBLES)
     def get_top_lastfm_artists_all_time(self):
-        print( self._top_scrobbles_for_qs(Scrobble.objects.all()))
-        return self._top_scrobbles_for_qs(Scrobble.objects.all())
+        return self._top_scrobbles_for_qs(DailyScrobbleCount.objects.all())
 
+    @caching.cached(caching.SCROBBLES)
     def get_top_lastfm_artists_this_year(self):
         today   = datetime.date.today()
-        start   = time.mktime(datetime.datetime(today.year, 1, 1, 0, 0).timetuple())
         scrobbles = self._top_scrobbles_for_qs(
-            Scrobble.objects.filter(timestamp__gte=start)
+            DailyScrobbleCount.objects.filter(day__year=today.year)
         )
 
         all_time_rankings = {}
@@ -410,11 +469,14 @@ class ListeningHistoryView(TemplateView):
 
         return scrobbles
 
+    @caching.cached(caching.SCROBBLES)
     def get_top_lastfm_artists_this_month(self):
         today = datetime.date.today()
-        start = time.mktime(datetime.datetime(today.year, today.month, 1, 0, 0).timetuple())
-        return Scrobble.objects.filter(timestamp__gte=start).values(
-            'artist').annotate(total=Count('artist')).order_by('-total')[:25]
+        return list(DailyScrobbleCount.objects.filter(
+            day__gte=datetime.date(today.year, today.month, 1)
+        ).values('artist').annotate(
+            total=Sum('count')
+        ).order_by('-total')[:25])
 
     # Count / Avg pairs
 
@@ -424,8 +486,8 @@ class ListeningHistoryView(TemplateView):
         scrobbles per day between them
         """
         days = (end - start).days
-        qs   = self._get_scrobbles_between(start, end)
-        count = qs.count()
+        qs   = self._get_counts_between(start, end)
+        count = qs.aggregate(total=Sum('count'))['total'] or 0
         # So we can toggle float view
         per_day = float(count) / days
         per_day = float("{:.2f}".format(per_day))
@@ -437,12 +499,16 @@ class ListeningHistoryView(TemplateView):
             'count'  : count
         }
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobbles_per_day_all_time(self):
-        qs    = Scrobble.objects.all().order_by('timestamp')
-        start = qs.first().ts_as_dt()
-        end   = qs.last().ts_as_dt()
+        days  = DailyScrobbleCount.objects.aggregate(
+            first=Min('day'), last=Max('day')
+        )
+        start = days['first']
+        end   = days['last'] + datetime.timedelta(days=1)
         return self._scrobbles_per_day_between(start, end)
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobbles_per_day_this_year(self):
         today = datetime.date.today()
         start = datetime.datetime(today.year, 1, 1)
@@ -451,6 +517,7 @@ class ListeningHistoryView(TemplateView):
         ) + datetime.timedelta(days=1)
         return self._scrobbles_per_day_between(start, end)
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobbles_per_day_this_month(self):
         today = datetime.date.today()
         year  = today.year
@@ -466,16 +533,18 @@ class ListeningHistoryView(TemplateView):
 
     # Graphs
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobble_graph_this_month(self):
         now = datetime.datetime.now()
         start = datetime.datetime(now.year, now.month, 1)
-        queryset = self._get_scrobbles_between(start, now)
+        queryset = self._get_counts_between(start, now)
         return lastfm.scrobbles_by_day_for_queryset(queryset, min_values=12)
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobble_graph_this_year(self):
         now = datetime.datetime.now()
         start = datetime.datetime(now.year, 1, 1)
-        qs = self._get_scrobbles_between(start, now)
+        qs = self._get_counts_between(start, now)
         data = lastfm.scrobbles_by_month_for_queryset(qs)
         months = {
             1: 'Jan',
@@ -499,6 +568,7 @@ class ListeningHistoryView(TemplateView):
         ]
         return data
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobble_graph_all_time(self):
         data = lastfm.total_scrobbles_by_year()
         data = [
@@ -515,40 +585,41 @@ class ListeningHistoryYearView(ListeningHistoryView):
         self.year  = k.get('year', None)
         self.start = datetime.datetime(self.year, 1, 1)
         self.end   = datetime.datetime(self.year + 1, 1, 1)
-        self.qs    = self._get_scrobbles_between(self.start, self.end)
+        self.qs    = self._get_counts_between(self.start, self.end)
         self.lastfm_subheading = 'Last.fm &mdash; {}'.format(self.year)
 
         return super().dispatch(*a, **k)
 
+    @caching.cached(caching.SCROBBLES)
     def get_number_of_artists_this_year(self):
         artists = self.qs.values_list('artist', flat=True).distinct()
         return len(artists)
 
+    @caching.cached(caching.SCROBBLES)
     def get_number_of_artists_last_year(self):
-        qs = self._get_scrobbles_between(
+        qs = self._get_counts_between(
             self.start - datetime.timedelta(days=365),
             self.end - datetime.timedelta(days=365),
         )
         artists = qs.values_list('artist', flat=True).distinct()
         return len(artists)
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobbles_per_day_this_year(self):
         return self._scrobbles_per_day_between(self.start, self.end)
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobble_graph_this_year(self):
         return lastfm.scrobbles_by_month_for_queryset(self.qs)
 
+    @caching.cached(caching.SCROBBLES)
     def get_top_lastfm_artists_this_year(self):
         scrobbles = self._top_scrobbles_for_qs(self.qs, limit=50)
 
         prev_year_rankings = {}
         prev_year_top = self._top_scrobbles_for_qs(
-            Scrobble.objects.filter(
-                timestamp__gte=time.mktime(
-                    datetime.datetime(self.year -1, 1, 1).timetuple()),
-                timestamp__lt=time.mktime(
-                    self.start.timetuple())
-            )
+            DailyScrobbleCount.objects.filter(day__year=self.year - 1),
+            with_urls=False
         )
         for i, s in enumerate(prev_year_top):
             prev_year_rankings[s['artist']] = i+1
@@ -598,12 +669,13 @@ class ListeningHistoryMonthView(ListeningHistoryView):
 
         return super().dispatch(*a, **k)
 
+    @caching.cached(caching.SCROBBLES)
     def get_scrobbles_per_day_this_month(self):
         return self._scrobbles_per_day_between(self.start, self.end)
 
-
+    @caching.cached(caching.SCROBBLES)
     def get_scrobble_graph_this_month(self):
-        queryset = self._get_scrobbles_between(self.start, self.end)
+        queryset = self._get_counts_between(self.start, self.end)
         return lastfm.scrobbles_by_day_for_queryset(queryset, min_values=12)
 
 
@@ -616,6 +688,13 @@ class TopArtistsView(ListView):
     def get_ol_start(self):
         return ((self.get_context_data()['page_obj'].number - 1 )* self.paginate_by ) + 1
 
+    @caching.cached(caching.SCROBBLES)
+    def get_artist_totals(self):
+        """
+        Return a list of every artist we have scrobbled and their totals
+        """
+        return list(DailyScrobbleCount.objects.values('artist').annotate(
+            total=Sum('count')).order_by('-total'))
+
     def get_queryset(self):
-        return Scrobble.objects.all().values('artist').annotate(
-            total=Count('artist')).order_by('-total')
+        return self.get_artist_totals()